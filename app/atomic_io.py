@@ -0,0 +1,79 @@
+"""
+Crash-safe file writes.
+
+Each file is written to a temporary file next to it, synced, and renamed over
+the target, so a crash leaves either the old or the new version of the file,
+never a truncated one.
+"""
+
+import os
+import uuid
+from pathlib import Path
+from typing import Iterable
+
+TMP_FILE_SUFFIX = '.tmp'
+
+
+def _tmp_path(path: Path) -> Path:
+    # Hidden, and without the target's extension so directory scans skip it
+    return path.with_name(f".{path.stem}.{uuid.uuid4().hex[:8]}{TMP_FILE_SUFFIX}")
+
+
+def fsync_dir(dir_path: Path) -> None:
+    """Make the renames and deletions in a directory durable."""
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_files_atomically(files: Iterable[tuple[Path, str | bytes]]) -> int:
+    """
+    Write several files, each atomically, syncing them as a group.
+
+    All temporary files are written before any is synced, letting the OS
+    flush them together, then they are renamed over their targets and each
+    directory is synced once for the whole batch.
+
+    Args:
+        files: (path, data) pairs, text is written as UTF-8
+
+    Returns:
+        The number of files written
+    """
+    pending: list[tuple[Path, Path]] = []  # (temporary path, target path)
+    try:
+        for path, data in files:
+            tmp_path = _tmp_path(path)
+            pending.append((tmp_path, path))
+            with open(tmp_path, 'wb') as file:
+                file.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+        for tmp_path, _ in pending:
+            fd = os.open(tmp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        for tmp_path, path in pending:
+            os.replace(tmp_path, path)
+    except BaseException:
+        for tmp_path, _ in pending:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+    for dir_path in {path.parent for _, path in pending}:
+        fsync_dir(dir_path)
+    return len(pending)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write a single text file atomically."""
+    write_files_atomically([(path, text)])
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write a single binary file atomically."""
+    write_files_atomically([(path, data)])
@@ -0,0 +1,233 @@
+"""
+Bulk import of directories of text and markdown files into a DocStore.
+
+Files are read and normalized by a pool of threads, file reads release the
+GIL, while the previous batch is written to the store. Each batch goes in
+with a single add_documents() call, so the store's indexes update once per
+batch, and with a single save, which syncs the files once per batch.
+
+    python -m app.bulk_import test_data imported --workers 8
+"""
+
+import argparse
+import os
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from .constants import FilePaths
+from .custom_logging import LOGGER
+from .doc_duplicates import DuplicatePolicies
+from .document import DocID, DocStore, LocalFilesystemDocStore
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .doc_duplicates import DuplicateDetector
+
+IMPORT_FILE_EXTS = ('.txt', '.md', '.markdown')
+DEFAULT_IMPORT_WORKERS = min(32, (os.cpu_count() or 1) * 4)  # Mostly waiting on the disk
+DEFAULT_IMPORT_BATCH_DOCS = 500
+
+# Files larger than this are skipped, they are rarely prose
+MAX_IMPORT_FILE_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class ImportProgress:
+    """Counts of an import so far."""
+
+    files_found: int = 0
+    files_read: int = 0
+    docs_added: int = 0
+    duplicates: int = 0  # Merged into documents the store already had
+    skipped: int = 0  # Empty or too large
+    failed: int = 0
+    bytes_read: int = 0
+    started_at: float = 0.0
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def __str__(self) -> str:
+        elapsed = max(self.elapsed_seconds, 1e-9)
+        return (
+            f"{self.files_read}/{self.files_found} files read, {self.docs_added} added, "
+            f"{self.duplicates} duplicates, {self.skipped} skipped, {self.failed} failed, "
+            f"{self.files_read / elapsed:.0f} files/s, {self.bytes_read / elapsed / 1e6:.1f} MB/s"
+        )
+
+
+@dataclass
+class SourceFile:
+    """A file read for import."""
+
+    path: Path
+    name: str
+    content: Optional[str]  # None if skipped or failed
+    size: int
+    failed: bool = False
+    signature: Optional["np.ndarray"] = None  # For the store's duplicate detector
+
+
+def find_source_files(root: Path, exts: tuple[str, ...] = IMPORT_FILE_EXTS) -> Iterator[Path]:
+    """The files under a directory with one of the extensions, in a stable order, skipping hidden ones."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+        for file_name in sorted(file_names):
+            if not file_name.startswith('.') and file_name.lower().endswith(exts):
+                yield Path(dir_path) / file_name
+
+
+def normalize_text(text: str) -> str:
+    """Normalize line endings, Unicode composition and trailing whitespace."""
+    text = text.lstrip('\ufeff').replace('\r\n', '\n').replace('\r', '\n')
+    text = unicodedata.normalize('NFC', text)
+    return '\n'.join(line.rstrip() for line in text.split('\n')).strip('\n')
+
+
+def read_source_file(path: Path, duplicate_detector: Optional["DuplicateDetector"] = None) -> SourceFile:
+    """Read and normalize a file, named by its stem, and compute its signature with the detector, if any."""
+    try:
+        size = path.stat().st_size
+        if size > MAX_IMPORT_FILE_BYTES:
+            return SourceFile(path=path, name=path.stem, content=None, size=size)
+        content = normalize_text(path.read_bytes().decode('utf-8', errors='replace'))
+    except OSError as e:
+        LOGGER.error(f"Failed to read {path}: {e}")
+        return SourceFile(path=path, name=path.stem, content=None, size=0, failed=True)
+    if not content:
+        return SourceFile(path=path, name=path.stem, content=None, size=size)
+    return SourceFile(
+        path=path,
+        name=path.stem,
+        content=content,
+        size=size,
+        signature=duplicate_detector.signature(content) if duplicate_detector is not None else None,
+    )
+
+
+def _batches(paths: Iterator[Path], batch_size: int) -> Iterator[list[Path]]:
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_directory(
+    store: DocStore,
+    root: Path,
+    workers: int = DEFAULT_IMPORT_WORKERS,
+    batch_size: int = DEFAULT_IMPORT_BATCH_DOCS,
+    save: bool = True,
+    on_progress: Optional[Callable[[ImportProgress], None]] = None,
+) -> ImportProgress:
+    """
+    Import the text and markdown files under a directory into a store.
+
+    The next batch is read while the current one is written, so reading and
+    writing overlap. Enable duplicate detection on the store first to skip
+    files it already has, re-importing a directory then only adds the new
+    files, and those too short to compare.
+
+    Args:
+        store: The store to add documents to
+        root: The directory, walked recursively
+        workers: Threads reading files
+        batch_size: Documents added and saved at once
+        save: Save each batch to the store's remote, otherwise leave them unsaved
+        on_progress: Called after each batch, logs the progress by default
+
+    Returns:
+        The final counts
+    """
+    progress = ImportProgress(started_at=time.monotonic())
+    on_progress = on_progress or (lambda counts: LOGGER.info(f"Importing {root}: {counts}"))
+    # Documents returned by the store that are not in here are new
+    with store.lock.read():
+        known_ids = set(store.doc_map)
+
+    def counted(paths: Iterator[Path]) -> Iterator[Path]:
+        for path in paths:
+            progress.files_found += 1
+            yield path
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-import') as executor:
+        reading: list[Future] = []
+        for batch in _batches(counted(find_source_files(root)), batch_size):
+            # Near-duplicate signatures are computed on the reading threads too
+            submitted = [executor.submit(read_source_file, path, store.duplicate_detector) for path in batch]
+            if reading:
+                _write_batch(store, [future.result() for future in reading], known_ids, save, progress)
+                on_progress(progress)
+            reading = submitted
+        if reading:
+            _write_batch(store, [future.result() for future in reading], known_ids, save, progress)
+            on_progress(progress)
+
+    return progress
+
+
+def _write_batch(
+    store: DocStore,
+    files: list[SourceFile],
+    known_ids: set[DocID],
+    save: bool,
+    progress: ImportProgress,
+) -> None:
+    progress.files_read += len(files)
+    progress.bytes_read += sum(file.size for file in files)
+    readable = [(file, file.content) for file in files if file.content is not None]
+    failed = sum(file.failed for file in files)
+    progress.failed += failed
+    progress.skipped += len(files) - len(readable) - failed
+    if not readable:
+        return
+
+    docs = store.add_documents(
+        [(file.name, content) for file, content in readable],
+        signatures=[file.signature for file, _ in readable] if store.duplicate_detector is not None else None,
+    )
+    for doc in docs:
+        assert doc.doc_id is not None, "Documents are given an ID when added."
+        if doc.doc_id in known_ids:
+            # A near duplicate, merged into a document the store already had
+            progress.duplicates += 1
+        else:
+            known_ids.add(doc.doc_id)
+            progress.docs_added += 1
+    if save:
+        store.save_all_to_remote()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import a directory of text and markdown files into a namespace.")
+    parser.add_argument('directory', type=Path, help="Directory walked recursively for .txt and .md files")
+    parser.add_argument('namespace', help="Namespace of the store, created if missing")
+    parser.add_argument('--root-dir', type=Path, default=FilePaths.MOCK_DOC_STORE_DIR, help="Directory of the stores")
+    parser.add_argument('--workers', type=int, default=DEFAULT_IMPORT_WORKERS, help="Threads reading files")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_IMPORT_BATCH_DOCS, help="Documents written at once")
+    parser.add_argument(
+        '--keep-duplicates', action='store_true',
+        help="Import files nearly the same as a document of the store, flagged, instead of skipping them",
+    )
+    args = parser.parse_args()
+
+    (args.root_dir / args.namespace).mkdir(parents=True, exist_ok=True)
+    store = LocalFilesystemDocStore(args.namespace, args.root_dir)
+    store.refresh()
+    store.enable_duplicate_detection(policy=DuplicatePolicies.FLAG if args.keep_duplicates else DuplicatePolicies.MERGE)
+    progress = import_directory(store, args.directory, workers=args.workers, batch_size=args.batch_size)
+    LOGGER.info(f"Imported {args.directory} into namespace {args.namespace}: {progress}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Splitting of documents into overlapping, token-bounded chunks.
+
+Chunk boundaries depend only on the text around them: a chunk ends at a
+paragraph break once it has min_tokens, at the end of a sentence once it has
+half of max_tokens, and after max_tokens in any case. An edit therefore only
+moves the boundaries near it, and the chunks elsewhere keep their text and
+so their IDs, which are hashes of the text. Work done per chunk, embedding
+or summarizing, is only redone for the chunks an edit touched.
+
+Tokens are words and single punctuation marks, a close enough estimate of
+model tokens for bounding chunk sizes.
+"""
+
+import dataclasses
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+CHUNK_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+SENTENCE_ENDS = frozenset('.!?')
+
+DEFAULT_CHUNK_MAX_TOKENS = 200
+DEFAULT_CHUNK_OVERLAP_TOKENS = 20
+DEFAULT_CHUNK_CACHE_ENTRIES = 1024
+
+# Strings are compared in blocks of this many characters to find where an edit starts and ends
+COMPARE_BLOCK_CHARS = 4096
+
+ChunkID = int  # 64-bit hash of the chunk's text
+
+
+def chunk_id(text: str) -> ChunkID:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def count_tokens(text: str) -> int:
+    return sum(1 for _ in CHUNK_TOKEN_RE.finditer(text))
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """
+    A span of a text.
+
+    The chunk's own tokens start at body_start, the previous chunk ends
+    there. Before it, from start, it repeats the last tokens of the previous
+    chunk, so that text cut at a boundary is seen whole by one of the two.
+    """
+
+    chunk_id: ChunkID
+    start: int
+    body_start: int
+    end: int
+    token_count: int  # Of the body
+
+    def text(self, content: str) -> str:
+        return content[self.start:self.end]
+
+    def body(self, content: str) -> str:
+        return content[self.body_start:self.end]
+
+    def shifted(self, offset: int) -> "Chunk":
+        return dataclasses.replace(
+            self, start=self.start + offset, body_start=self.body_start + offset, end=self.end + offset,
+        )
+
+
+class Chunker:
+    """
+    Splits texts into chunks, caching the chunks of recent texts by content hash.
+
+    Args:
+        max_tokens: Most tokens in a chunk's body
+        overlap_tokens: Tokens of the previous chunk repeated at the start of each chunk
+        min_tokens: Fewest tokens before a chunk can end at a paragraph break, max_tokens / 4 by default
+        cache_entries: Texts whose chunks are cached
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+        overlap_tokens: int = DEFAULT_CHUNK_OVERLAP_TOKENS,
+        min_tokens: Optional[int] = None,
+        cache_entries: int = DEFAULT_CHUNK_CACHE_ENTRIES,
+    ):
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(f"Chunk overlap must be below the chunk size, not {overlap_tokens}")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens if min_tokens is not None else max(1, max_tokens // 4)
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict[bytes, list[Chunk]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """Identifies the chunker's settings, chunks of different names differ."""
+        return f"chunks-{self.max_tokens}-{self.overlap_tokens}-{self.min_tokens}"
+
+    def chunk(self, text: str) -> list[Chunk]:
+        """Split a text into chunks, in order."""
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            chunks = self._cache.get(key)
+            if chunks is not None:
+                self._cache.move_to_end(key)
+                return chunks
+
+        chunks = list(self._chunks_from(text, 0, []))
+        self._remember(key, chunks)
+        return chunks
+
+    def rechunk(self, old_text: str, old_chunks: list[Chunk], new_text: str) -> list[Chunk]:
+        """
+        Split an edited text into chunks, reusing the chunks of its previous version.
+
+        Only the text from the last boundary before the edit is scanned, up to
+        the first boundary after the edit that the previous version also had.
+
+        Args:
+            old_text: The previous version of the text
+            old_chunks: Its chunks, from chunk() or rechunk() with the same settings
+            new_text: The edited text
+
+        Returns:
+            The same chunks as chunk(new_text)
+        """
+        if old_text == new_text:
+            return old_chunks
+        prefix_length = _common_prefix_length(old_text, new_text)
+        suffix_length = _common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - prefix_length)
+        suffix_start = len(new_text) - suffix_length
+        offset = len(new_text) - len(old_text)
+
+        # Whether a chunk ends where it does depends on the text just past its end, so the last chunk before the
+        # edit is redone too
+        kept = [chunk for chunk in old_chunks if chunk.end < prefix_length][:-1]
+        previous = kept[-1] if kept else None
+        position = previous.end if previous is not None else 0
+        overlap_starts = self._tail_token_starts(new_text, previous)
+
+        old_index_by_end = {chunk.end: index for index, chunk in enumerate(old_chunks)}
+        chunks = kept
+        for chunk in self._chunks_from(new_text, position, overlap_starts):
+            chunks.append(chunk)
+            # Whether a token starts at a position depends on the character before it too
+            if chunk.end <= suffix_start:
+                continue
+            old_index = old_index_by_end.get(chunk.end - offset)
+            if old_index is None:
+                continue
+            rest = old_chunks[old_index + 1:]
+            # The chunks after a shared boundary are the same, if what they repeat of this one is past the edit too,
+            # and starts where it did, the body of this one may be shorter than the overlap
+            if not rest or (
+                rest[0].start + offset > suffix_start
+                and rest[0].start + offset == self._overlap_start(new_text, chunk)
+            ):
+                chunks.extend(old_chunk.shifted(offset) for old_chunk in rest)
+                break
+
+        key = hashlib.blake2b(new_text.encode('utf-8'), digest_size=16).digest()
+        self._remember(key, chunks)
+        return chunks
+
+    def _remember(self, key: bytes, chunks: list[Chunk]) -> None:
+        with self._lock:
+            self._cache[key] = chunks
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def _tail_token_starts(self, text: str, chunk: Optional[Chunk]) -> list[int]:
+        """Where the last overlap_tokens tokens of a chunk's body start."""
+        if chunk is None or not self.overlap_tokens:
+            return []
+        starts = [match.start() for match in CHUNK_TOKEN_RE.finditer(text, chunk.body_start, chunk.end)]
+        return starts[-self.overlap_tokens:]
+
+    def _overlap_start(self, text: str, chunk: Chunk) -> int:
+        """Where the chunk after a chunk starts."""
+        tail_starts = self._tail_token_starts(text, chunk)
+        return tail_starts[0] if tail_starts else chunk.end
+
+    def _chunks_from(self, text: str, position: int, overlap_starts: list[int]) -> Iterator[Chunk]:
+        """
+        Chunk a text from a boundary on.
+
+        Args:
+            text: The whole text
+            position: A boundary, where the previous chunk ends
+            overlap_starts: Where the previous chunk's last overlap_tokens tokens start
+        """
+        body_start = position
+        token_starts: list[int] = []
+        end = position
+        for match in CHUNK_TOKEN_RE.finditer(text, position):
+            if len(token_starts) >= self.min_tokens and PARAGRAPH_BREAK_RE.search(text, end, match.start()):
+                yield self._make_chunk(text, overlap_starts, body_start, end, len(token_starts))
+                overlap_starts = token_starts[-self.overlap_tokens:] if self.overlap_tokens else []
+                body_start, token_starts = end, []
+
+            token_starts.append(match.start())
+            end = match.end()
+            if len(token_starts) >= self.max_tokens or (
+                len(token_starts) >= self.max_tokens // 2 and match.group() in SENTENCE_ENDS
+            ):
+                yield self._make_chunk(text, overlap_starts, body_start, end, len(token_starts))
+                overlap_starts = token_starts[-self.overlap_tokens:] if self.overlap_tokens else []
+                body_start, token_starts = end, []
+
+        if token_starts:
+            yield self._make_chunk(text, overlap_starts, body_start, end, len(token_starts))
+
+    @staticmethod
+    def _make_chunk(text: str, overlap_starts: list[int], body_start: int, end: int, token_count: int) -> Chunk:
+        start = overlap_starts[0] if overlap_starts else body_start
+        return Chunk(
+            chunk_id=chunk_id(text[start:end]),
+            start=start,
+            body_start=body_start,
+            end=end,
+            token_count=token_count,
+        )
+
+
+def _common_prefix_length(first: str, second: str) -> int:
+    length = min(len(first), len(second))
+    position = 0
+    block = slice(0, COMPARE_BLOCK_CHARS)
+    while position < length and first[block] == second[block]:
+        position += COMPARE_BLOCK_CHARS
+        block = slice(position, position + COMPARE_BLOCK_CHARS)
+    position = min(position, length)
+    while position < length and first[position] == second[position]:
+        position += 1
+    return position
+
+
+def _common_suffix_length(first: str, second: str, max_length: int) -> int:
+    length = 0
+    while length < max_length:
+        block = min(COMPARE_BLOCK_CHARS, max_length - length)
+        first_block = first[len(first) - length - block:len(first) - length]
+        if first_block != second[len(second) - length - block:len(second) - length]:
+            break
+        length += block
+    while length < max_length and first[len(first) - length - 1] == second[len(second) - length - 1]:
+        length += 1
+    return length
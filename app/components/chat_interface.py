@@ -4,7 +4,7 @@ import rio
 
 from ..chat import ChatMessage, ChatRole
 from ..common import make_button, make_text
-from ..researcher_agents import Researcher, get_default_researcher
+from ..researcher_agents import Researcher, Researchers, get_default_researcher
 
 
 class ChatInterfaceComponentNames:
@@ -23,6 +23,7 @@ class ChatInterfaceComponentNames:
 
 ENABLED_RESEARCHERS: list[Researcher] = [
     get_default_researcher(),
+    Researchers.RESEARCH_ASSISTANT,
 ]
 
 
@@ -7,6 +7,8 @@ import rio
 
 from ..common import make_button
 from ..custom_logging import LOGGER
+from ..doc_facets import FacetFilter, Facets
+from ..doc_listing import DEFAULT_PAGE_SIZE, DocPage, PageCursor, SortFields
 from ..document import Doc, DocID, InRepoLocalFilesystemDocumentStore, SupportedDocStore
 from ..navigation import Navigator
 
@@ -25,11 +27,22 @@ class DocumentListCopy:
     REFRESH_DOC_STORE_BUTTON_TEXT = "Refresh Doc Store"
     SAVE_DOCUMENTS_BUTTON_TEXT = "Save Docs"
     NO_DOCUMENTS_TEXT = "No documents found"
+    ALL_TAGS_BUTTON_TEXT = "All"
+    PREVIOUS_PAGE_BUTTON_TEXT = "Previous Page"
+    NEXT_PAGE_BUTTON_TEXT = "Next Page"
+    SORT_BUTTON_TEXTS = {
+        SortFields.UPDATED_AT: "Recently Updated",
+        SortFields.CREATED_AT: "Recently Created",
+        SortFields.NAME: "Name",
+    }
 
 
 class DocumentListComponentNames:
 
     HEADER = "header"
+    TAG_FACETS = "tag_facets"
+    SORT_OPTIONS = "sort_options"
+    PAGINATION = "pagination"
     # ADD_DOC_BUTTON = "add_document_button"
     # DELETE_DOC_BUTTON = "delete_document_button"
     # VIEW_DOC_BUTTON = "view_document_button"
@@ -40,7 +53,10 @@ class DocumentListComponentNames:
 
     DISPLAY_ORDER = [
         HEADER,
+        TAG_FACETS,
+        SORT_OPTIONS,
         DOCUMENTS,
+        PAGINATION,
         BUTTON_ROW,
     ]
 
@@ -102,6 +118,12 @@ class DocListComponent(rio.Component):
 
     doc_store: InRepoLocalFilesystemDocumentStore
     selected_doc_id: Optional[DocID] = None
+    selected_tag: Optional[str] = None
+    sort_by: str = SortFields.UPDATED_AT
+    page_size: int = DEFAULT_PAGE_SIZE
+    # Cursor of the page shown, None for the first, and of the pages before it
+    page_cursor: Optional[PageCursor] = None
+    previous_page_cursors: Tuple[Optional[PageCursor], ...] = ()
     on_add_document: Optional[Callable[[], None]] = None
     on_delete_document: Optional[DocumentAction] = None
     on_view_document: Optional[DocumentAction] = None
@@ -148,6 +170,35 @@ class DocListComponent(rio.Component):
                 self.debug_output = "No document selected."
         self.force_refresh()
 
+    def handle_select_tag(self, tag: Optional[str]):
+        """Only list the documents with a tag, or all of them for None."""
+        self.selected_tag = tag
+        self._go_to_first_page()
+        self.force_refresh()
+
+    def handle_sort(self, sort_by: str):
+        """List the documents sorted by a field, names A to Z, dates latest first."""
+        self.sort_by = sort_by
+        self._go_to_first_page()
+        self.force_refresh()
+
+    def handle_next_page(self, next_cursor: Optional[PageCursor]):
+        if next_cursor is None:
+            return
+        self.previous_page_cursors = (*self.previous_page_cursors, self.page_cursor)
+        self.page_cursor = next_cursor
+        self.force_refresh()
+
+    def handle_previous_page(self):
+        if self.previous_page_cursors:
+            self.page_cursor = self.previous_page_cursors[-1]
+            self.previous_page_cursors = self.previous_page_cursors[:-1]
+        self.force_refresh()
+
+    def _go_to_first_page(self):
+        self.page_cursor = None
+        self.previous_page_cursors = ()
+
     def handle_add(self):
         """Handle document add."""
         if self.on_add_document:
@@ -167,15 +218,26 @@ class DocListComponent(rio.Component):
     def handle_force_refresh_ui(self):
         self.force_refresh()
 
-    def _create_document_cards_component(self) -> rio.Component:
+    def _get_page(self) -> DocPage:
+        """Get the page of documents shown, only fetching the documents on it."""
+        filters = [FacetFilter(all_of=(self.selected_tag,))] if self.selected_tag is not None else []
+        return self.doc_store.list_page(
+            sort_by=self.sort_by,
+            descending=self.sort_by != SortFields.NAME,
+            limit=self.page_size,
+            cursor=self.page_cursor,
+            filters=filters,
+        )
+
+    def _create_document_cards_component(self, page: DocPage) -> rio.Component:
         """Create a list of document card components."""
-        LOGGER.debug(f"Creating document cards, count: {len(self.doc_store.get_doc_map())}")
+        LOGGER.debug(f"Creating document cards, count: {len(page.docs)} of {page.total}")
         document_cards = [
             _build_document_card(
                 doc=doc,
                 selected_doc_id=self.selected_doc_id,
                 on_select=self.handle_select,
-            ) for doc in self.doc_store.get_doc_map().values()
+            ) for doc in page.docs
         ]
 
         return rio.Column(
@@ -183,6 +245,58 @@ class DocListComponent(rio.Component):
             spacing=1,
         )
 
+    def _create_tag_facets_component(self) -> rio.Component:
+        """Create a row of buttons filtering by tag, with the document count of each tag."""
+        tag_counts = self.doc_store.facet_counts(Facets.TAGS)
+        buttons = [
+            make_button(
+                content=DocumentListCopy.ALL_TAGS_BUTTON_TEXT,
+                on_press=lambda: self.handle_select_tag(None),
+                is_sensitive=self.selected_tag is not None,
+            )
+        ]
+        for tag, count in tag_counts.items():
+            buttons.append(
+                make_button(
+                    content=f"{tag} ({count})",
+                    on_press=lambda tag=tag: self.handle_select_tag(tag),
+                    is_sensitive=tag != self.selected_tag,
+                )
+            )
+        return rio.Row(*buttons, spacing=1)
+
+    def _create_sort_options_component(self) -> rio.Component:
+        """Create a row of buttons choosing the order of the documents."""
+        buttons = [
+            make_button(
+                content=label,
+                on_press=lambda sort_by=sort_by: self.handle_sort(sort_by),
+                is_sensitive=sort_by != self.sort_by,
+            )
+            for sort_by, label in DocumentListCopy.SORT_BUTTON_TEXTS.items()
+        ]
+        return rio.Row(*buttons, spacing=1)
+
+    def _create_pagination_component(self, page: DocPage) -> rio.Component:
+        """Create the buttons moving between pages, and the position of the page."""
+        first = len(self.previous_page_cursors) * self.page_size + 1
+        position = f"{first}-{first + len(page.docs) - 1} of {page.total}" if page.docs else f"0 of {page.total}"
+        next_cursor = page.next_cursor
+        return rio.Row(
+            make_button(
+                content=DocumentListCopy.PREVIOUS_PAGE_BUTTON_TEXT,
+                on_press=self.handle_previous_page,
+                is_sensitive=bool(self.previous_page_cursors),
+            ),
+            rio.Text(text=position, style="dim"),
+            make_button(
+                content=DocumentListCopy.NEXT_PAGE_BUTTON_TEXT,
+                on_press=lambda: self.handle_next_page(next_cursor),
+                is_sensitive=next_cursor is not None,
+            ),
+            spacing=1,
+        )
+
     def _generate_buttons(self) -> List[rio.Component]:
         """Generate buttons based on button specifications"""
         buttons = []
@@ -228,10 +342,15 @@ class DocListComponent(rio.Component):
         # if not self.doc_store.get_doc_map():
         #     documents = rio.Text(DocumentListCopy.NO_DOCUMENTS_TEXT)
         # else:
-        documents = self._create_document_cards_component()
+        page = self._get_page()
+        documents = self._create_document_cards_component(page)
+        tag_facets = self._create_tag_facets_component()
 
         return {
             DocumentListComponentNames.HEADER: header,
+            DocumentListComponentNames.TAG_FACETS: tag_facets,
+            DocumentListComponentNames.SORT_OPTIONS: self._create_sort_options_component(),
+            DocumentListComponentNames.PAGINATION: self._create_pagination_component(page),
             DocumentListComponentNames.BUTTON_ROW: button_row,
             DocumentListComponentNames.DOCUMENTS: documents,
         }
@@ -0,0 +1,199 @@
+"""
+Caching of document content loaded on demand.
+
+ContentLRU keeps content in two tiers, each with a byte budget: hot content
+as strings, ready to use, and warm content compressed, about a quarter of
+the size for prose. Content evicted from the hot tier is compressed into the
+warm one, and content evicted from the warm tier is dropped, it is cold and
+read again from the store when next accessed. Warm content read repeatedly
+is promoted back to the hot tier, content read once is decompressed without
+displacing hot content, so a scan over the whole store does not flush it.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+try:
+    import zstandard
+except ImportError:  # Optional, warm content is compressed with zlib without it
+    zstandard = None  # type: ignore[assignment]
+
+DEFAULT_CONTENT_CACHE_BYTES = 64 * 1024 * 1024  # 64 MiB of strings
+DEFAULT_WARM_CACHE_BYTES = 64 * 1024 * 1024  # 64 MiB compressed, 4 to 5 times that of prose
+
+# Reads of warm content, since it was demoted, that promote it back to the hot tier
+PROMOTE_AFTER_HITS = 2
+
+# Fastest levels, warm content is compressed on every demotion
+ZSTD_LEVEL = 1
+ZLIB_LEVEL = 1
+
+
+def content_size(content: str) -> int:
+    """Size of the content in bytes, as UTF-8."""
+    return len(content.encode('utf-8'))
+
+
+# zstd (de)compressors are not thread-safe, each thread keeps its own
+_zstd_local = threading.local()
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is None:
+        return zlib.compress(data, ZLIB_LEVEL)
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor.compress(data)
+
+
+def _decompress(data: bytes) -> bytes:
+    if zstandard is None:
+        return zlib.decompress(data)
+    decompressor = getattr(_zstd_local, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data)
+
+
+@dataclass(frozen=True)
+class ContentCacheStats:
+    """A snapshot of a ContentLRU's tiers and of how it was used so far."""
+
+    hot_entries: int
+    hot_bytes: int  # UTF-8 size of the strings
+    warm_entries: int
+    warm_bytes: int  # Compressed
+    hot_hits: int = 0
+    warm_hits: int = 0
+    misses: int = 0  # Content read from the store
+    promotions: int = 0  # Warm to hot
+    demotions: int = 0  # Hot to warm
+    evictions: int = 0  # Warm, or too large for it, to cold
+
+    @property
+    def hit_ratio(self) -> float:
+        reads = self.hot_hits + self.warm_hits + self.misses
+        return (self.hot_hits + self.warm_hits) / reads if reads else 0.0
+
+
+class ContentLRU:
+    """
+    Least-recently-used cache of document content, in a hot and a warm tier with a byte budget each.
+
+    Adding content beyond the hot budget demotes the least recently used
+    entries to the warm tier, and beyond the warm budget evicts them. Content
+    larger than the hot budget goes straight to the warm tier, and content
+    that does not fit in either is not cached at all. A warm budget of 0
+    keeps only the hot tier.
+
+    Thread-safe, entries are (de)compressed with the cache's lock held.
+    """
+
+    def __init__(self, byte_budget: int = DEFAULT_CONTENT_CACHE_BYTES, warm_byte_budget: int = DEFAULT_WARM_CACHE_BYTES):
+        self.byte_budget = byte_budget
+        self.warm_byte_budget = warm_byte_budget
+        self.size_bytes = 0
+        self.warm_size_bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[str, int]] = OrderedDict()  # Key -> (content, size)
+        self._warm_entries: OrderedDict[Hashable, tuple[bytes, int]] = OrderedDict()  # Key -> (compressed, hits)
+        self._counts = dict.fromkeys(('hot_hits', 'warm_hits', 'misses', 'promotions', 'demotions', 'evictions'), 0)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._warm_entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries or key in self._warm_entries
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._counts['hot_hits'] += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+
+            warm_entry = self._warm_entries.get(key)
+            if warm_entry is None:
+                self._counts['misses'] += 1
+                return None
+
+            self._counts['warm_hits'] += 1
+            compressed, hits = warm_entry
+            content = _decompress(compressed).decode('utf-8')
+            if hits + 1 >= PROMOTE_AFTER_HITS and content_size(content) <= self.byte_budget:
+                self._counts['promotions'] += 1
+                self._pop(key)
+                self._put_hot(key, content)
+            else:
+                self._warm_entries[key] = (compressed, hits + 1)
+                self._warm_entries.move_to_end(key)
+            return content
+
+    def put(self, key: Hashable, content: str) -> None:
+        size = content_size(content)
+        with self._lock:
+            self._pop(key)
+            if size > self.byte_budget:
+                self._put_warm(key, content)
+                return
+            self._put_hot(key, content, size)
+
+    def _put_hot(self, key: Hashable, content: str, size: Optional[int] = None) -> None:
+        size = size if size is not None else content_size(content)
+        self._entries[key] = (content, size)
+        self.size_bytes += size
+        while self.size_bytes > self.byte_budget:
+            demoted_key, (demoted, demoted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= demoted_size
+            self._counts['demotions'] += 1
+            self._put_warm(demoted_key, demoted)
+
+    def _put_warm(self, key: Hashable, content: str) -> None:
+        if self.warm_byte_budget <= 0:
+            self._counts['evictions'] += 1
+            return
+        compressed = _compress(content.encode('utf-8'))
+        if len(compressed) > self.warm_byte_budget:
+            self._counts['evictions'] += 1
+            return
+
+        self._warm_entries[key] = (compressed, 0)
+        self.warm_size_bytes += len(compressed)
+        while self.warm_size_bytes > self.warm_byte_budget:
+            _, (evicted, _) = self._warm_entries.popitem(last=False)
+            self.warm_size_bytes -= len(evicted)
+            self._counts['evictions'] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._warm_entries.clear()
+            self.size_bytes = 0
+            self.warm_size_bytes = 0
+
+    def stats(self) -> ContentCacheStats:
+        with self._lock:
+            return ContentCacheStats(
+                hot_entries=len(self._entries),
+                hot_bytes=self.size_bytes,
+                warm_entries=len(self._warm_entries),
+                warm_bytes=self.warm_size_bytes,
+                **self._counts,
+            )
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+        warm_entry = self._warm_entries.pop(key, None)
+        if warm_entry is not None:
+            self.warm_size_bytes -= len(warm_entry[0])
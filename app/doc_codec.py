@@ -0,0 +1,203 @@
+"""
+Serialization formats of document files.
+
+A format is a codec (JSON or msgpack) plus an optional compression (zstd).
+Plain JSON keeps the original headerless .json files. Every other format is
+written to .mmdoc files starting with a header recording the codec and
+compression, so files of different formats can sit side by side while a
+store is converted in place.
+
+Codecs work on Doc records, see Doc.to_record() and Doc.from_record().
+"""
+
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+try:
+    import msgpack
+except ImportError:  # Optional, only needed for the msgpack codec
+    msgpack = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for zstd compression
+    zstandard = None  # type: ignore[assignment]
+
+DOC_FILE_EXT = '.json'
+DOC_CODEC_FILE_EXT = '.mmdoc'
+DOC_FILE_EXTS = (DOC_FILE_EXT, DOC_CODEC_FILE_EXT)
+
+HEADER_MAGIC = b'MMDOC'
+HEADER_VERSION = 1
+HEADER_SIZE = len(HEADER_MAGIC) + 3  # Magic, version, codec ID, compression ID
+
+ZSTD_LEVEL = 3
+
+
+class DocCodecs:
+    """Supported codecs, by name."""
+
+    JSON = 'json'
+    MSGPACK = 'msgpack'
+
+
+class DocCompressions:
+    """Supported compressions, by name."""
+
+    NONE = 'none'
+    ZSTD = 'zstd'
+
+
+# IDs stored in the header, never reuse one
+CODEC_IDS = {DocCodecs.JSON: 1, DocCodecs.MSGPACK: 2}
+COMPRESSION_IDS = {DocCompressions.NONE: 0, DocCompressions.ZSTD: 1}
+CODECS_BY_ID = {codec_id: codec for codec, codec_id in CODEC_IDS.items()}
+COMPRESSIONS_BY_ID = {compression_id: compression for compression, compression_id in COMPRESSION_IDS.items()}
+
+
+class DocFormatException(Exception):
+    """
+    Exception when a document file cannot be decoded, or a format is unavailable
+    """
+
+
+@dataclass(frozen=True)
+class DocFormat:
+    """How document files are encoded."""
+
+    codec: str = DocCodecs.JSON
+    compression: str = DocCompressions.NONE
+
+    def __post_init__(self):
+        if self.codec not in CODEC_IDS:
+            raise DocFormatException(f"Unknown codec: {self.codec}")
+        if self.compression not in COMPRESSION_IDS:
+            raise DocFormatException(f"Unknown compression: {self.compression}")
+        if self.codec == DocCodecs.MSGPACK and msgpack is None:
+            raise DocFormatException("The msgpack codec needs the msgpack package")
+        if self.compression == DocCompressions.ZSTD and zstandard is None:
+            raise DocFormatException("zstd compression needs the zstandard package")
+
+    @property
+    def has_header(self) -> bool:
+        return self.codec != DocCodecs.JSON or self.compression != DocCompressions.NONE
+
+    @property
+    def file_ext(self) -> str:
+        return DOC_CODEC_FILE_EXT if self.has_header else DOC_FILE_EXT
+
+    @property
+    def header(self) -> bytes:
+        return HEADER_MAGIC + bytes([HEADER_VERSION, CODEC_IDS[self.codec], COMPRESSION_IDS[self.compression]])
+
+    def file_name(self, doc_id: int) -> str:
+        return f"{doc_id}{self.file_ext}"
+
+
+# The original headerless .json files
+JSON_FORMAT = DocFormat()
+
+
+def is_doc_file_name(file_name: str) -> bool:
+    return file_name.endswith(DOC_FILE_EXTS)
+
+
+# zstd (de)compressors are not thread-safe, each thread keeps its own
+_zstd_local = threading.local()
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor.compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    decompressor = getattr(_zstd_local, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data)
+
+
+def _json_encode(record: dict) -> bytes:
+    return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+
+def _json_decode(data: bytes) -> dict:
+    # Decoding first is faster than letting json detect the encoding of bytes
+    return json.loads(data.decode('utf-8'))
+
+
+def _msgpack_encode(record: dict) -> bytes:
+    return msgpack.packb(record, use_bin_type=True)
+
+
+def _msgpack_decode(data: bytes) -> dict:
+    return msgpack.unpackb(data, raw=False)
+
+
+ENCODERS: dict[str, Callable[[dict], bytes]] = {
+    DocCodecs.JSON: _json_encode,
+    DocCodecs.MSGPACK: _msgpack_encode,
+}
+
+DECODERS: dict[str, Callable[[bytes], dict]] = {
+    DocCodecs.JSON: _json_decode,
+    DocCodecs.MSGPACK: _msgpack_decode,
+}
+
+
+def encode_record(record: dict, doc_format: DocFormat = JSON_FORMAT) -> bytes:
+    """Encode a Doc record to the bytes of a document file."""
+    payload = ENCODERS[doc_format.codec](record)
+    if not doc_format.has_header:
+        return payload
+    if doc_format.compression == DocCompressions.ZSTD:
+        payload = _zstd_compress(payload)
+    return doc_format.header + payload
+
+
+# Header -> format, so headers are only parsed and validated once
+_formats_by_header: dict[bytes, DocFormat] = {}
+
+
+def sniff_format(data: bytes) -> DocFormat:
+    """Get the format of a document file from its header."""
+    if not data.startswith(HEADER_MAGIC):
+        return JSON_FORMAT
+
+    header = data[:HEADER_SIZE]
+    doc_format = _formats_by_header.get(header)
+    if doc_format is not None:
+        return doc_format
+
+    version, codec_id, compression_id = header[len(HEADER_MAGIC):]
+    if version > HEADER_VERSION:
+        raise DocFormatException(f"Unsupported document file version {version}")
+    try:
+        doc_format = DocFormat(codec=CODECS_BY_ID[codec_id], compression=COMPRESSIONS_BY_ID[compression_id])
+    except KeyError:
+        raise DocFormatException(f"Unknown codec {codec_id} or compression {compression_id}")
+    _formats_by_header[header] = doc_format
+    return doc_format
+
+
+def decode_record(data: bytes) -> dict:
+    """Decode the bytes of a document file, whatever its format, to a Doc record."""
+    if not data.startswith(HEADER_MAGIC):
+        return _json_decode(data)
+
+    doc_format = sniff_format(data)
+    payload = data[HEADER_SIZE:]
+    if doc_format.compression == DocCompressions.ZSTD:
+        payload = _zstd_decompress(payload)
+    return DECODERS[doc_format.codec](payload)
+
+
+def read_record_file(path: Path) -> dict:
+    with open(path, 'rb') as file:
+        return decode_record(file.read())
@@ -0,0 +1,98 @@
+"""
+Near-duplicate detection for DocStores.
+
+DuplicateDetector keeps a MinHash LSH index of the documents' content, see
+near_duplicates, so add_document() can tell when new content is nearly the
+same as a document the store already has.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from .document import Doc, DocID, DocStoreObserver
+from .near_duplicates import DEFAULT_SIMILARITY_THRESHOLD, NearDuplicateIndex
+
+NEAR_DUPLICATE_TAG = 'near-duplicate'
+
+
+class DuplicatePolicies:
+    """What add_document() does with a near duplicate of a document."""
+
+    MERGE = 'merge'  # Return the existing document instead of adding one
+    FLAG = 'flag'  # Add it, tagged NEAR_DUPLICATE_TAG, with the original noted in its edit log
+
+    ALL = (MERGE, FLAG)
+
+
+class DuplicateDetector(DocStoreObserver):
+    """
+    Index of the documents' content by MinHash signature.
+
+    Documents flagged as near duplicates are not indexed, later copies match
+    their original, so the index does not grow with redundant copies.
+
+    Args:
+        threshold: Estimated Jaccard similarity of word shingles from which documents are near duplicates
+        policy: See DuplicatePolicies
+    """
+
+    def __init__(self, threshold: float = DEFAULT_SIMILARITY_THRESHOLD, policy: str = DuplicatePolicies.MERGE):
+        if policy not in DuplicatePolicies.ALL:
+            raise ValueError(f"Unknown duplicate policy: {policy}")
+        self.index: NearDuplicateIndex[DocID] = NearDuplicateIndex(threshold=threshold)
+        self.policy = policy
+        self.doc_versions: dict[DocID, str] = {}  # Document ID -> Doc.version when indexed
+        # Signatures computed by the store, reused when the document is put
+        self._remembered: dict[DocID, Optional[np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def merges(self) -> bool:
+        return self.policy == DuplicatePolicies.MERGE
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        for doc in docs:
+            if doc.doc_id is None:
+                continue
+            self.doc_versions[doc.doc_id] = doc.version
+            if NEAR_DUPLICATE_TAG in doc.tags:
+                self._remembered.pop(doc.doc_id, None)
+                self.index.remove(doc.doc_id)
+            elif doc.doc_id in self._remembered:
+                # Already indexed by remember()
+                del self._remembered[doc.doc_id]
+            else:
+                self.index.add(doc.doc_id, self.index.signature(doc.content))
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        self.on_docs_put([
+            doc for doc in docs if doc.doc_id is not None and self.doc_versions.get(doc.doc_id) != doc.version
+        ])
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        for doc_id in doc_ids:
+            self.doc_versions.pop(doc_id, None)
+            self.index.remove(doc_id)
+
+    def signature(self, content: str) -> Optional[np.ndarray]:
+        return self.index.signature(content)
+
+    def remember(self, doc_id: DocID, signature: Optional[np.ndarray]) -> None:
+        """Index a new document's signature ahead of the store telling of it."""
+        self._remembered[doc_id] = signature
+        self.index.add(doc_id, signature)
+
+    def find_original(self, signature: Optional[np.ndarray]) -> Optional[tuple[DocID, float]]:
+        """The (document ID, estimated similarity) of the document most similar to a signature, if similar enough."""
+        matches = self.index.query(signature)
+        return matches[0] if matches else None
+
+    @staticmethod
+    def flag(doc: Doc, original: tuple[DocID, float]) -> None:
+        """Mark a document as a near duplicate of another."""
+        doc_id, similarity = original
+        doc.tags = [*doc.tags, NEAR_DUPLICATE_TAG]
+        doc.edit_log.append(f"Near duplicate of document {doc_id} ({similarity:.0%} similar)")
@@ -0,0 +1,179 @@
+"""
+Secondary indexes of document tags and citations.
+
+FacetIndex maps every tag and citation to the set of documents having it,
+kept up to date by observing a DocStore. Sets are bitsets, plain ints with
+bit i set for document ID i: document IDs are small and dense, so the sets
+are compact, and filters like "tag A and not tag B" are a few big-integer
+operations however many documents match.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import reduce
+from operator import or_
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .document import Doc, DocID, DocStoreObserver
+
+DocIDBits = int  # Bitset of document IDs
+
+
+class Facets:
+    """Indexed Doc fields, each a list of values."""
+
+    TAGS = 'tags'
+    CITATIONS = 'citations'
+
+    ALL = (TAGS, CITATIONS)
+
+
+# Below this many IDs, setting bits one by one beats packing them with numpy
+PACK_MIN_IDS = 64
+
+
+def bits_from_ids(doc_ids: Iterable[DocID]) -> DocIDBits:
+    doc_ids = list(doc_ids)
+    if len(doc_ids) < PACK_MIN_IDS:
+        return reduce(or_, (1 << doc_id for doc_id in doc_ids), 0)
+    flags = np.zeros(max(doc_ids) + 1, dtype=bool)
+    flags[doc_ids] = True
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+
+def flags_from_bits(bits: DocIDBits) -> np.ndarray:
+    """Whether each document ID is in a bitset, as booleans indexed by ID, up to the highest ID in it."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little').view(bool)
+
+
+def ids_from_bits(bits: DocIDBits) -> list[DocID]:
+    """The document IDs in a bitset, in ascending order."""
+    if not bits:
+        return []
+    return np.flatnonzero(flags_from_bits(bits)).tolist()
+
+
+@dataclass(frozen=True)
+class FacetFilter:
+    """
+    Documents whose values of a facet include every value of all_of, at least
+    one value of any_of, if given, and no value of none_of.
+    """
+
+    facet: str = Facets.TAGS
+    all_of: tuple[str, ...] = ()
+    any_of: tuple[str, ...] = ()
+    none_of: tuple[str, ...] = ()
+
+
+class FacetIndex(DocStoreObserver):
+    """
+    Bitsets of the documents having each tag and citation.
+
+    Not thread-safe on its own: a store calls it with its write lock held,
+    and queries it with its read lock held.
+
+    Args:
+        facets: The Doc fields to index, see Facets
+    """
+
+    def __init__(self, facets: Iterable[str] = Facets.ALL):
+        self.facets = tuple(facets)
+        self.all_docs: DocIDBits = 0
+        self.bits: dict[str, dict[str, DocIDBits]] = {facet: {} for facet in self.facets}  # Facet -> value -> bitset
+        self.doc_values: dict[DocID, tuple[frozenset[str], ...]] = {}  # Indexed values, per facet
+
+    def __len__(self) -> int:
+        return len(self.doc_values)
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        added: dict[tuple[str, str], list[DocID]] = defaultdict(list)
+        removed: dict[tuple[str, str], list[DocID]] = defaultdict(list)
+        new_ids = []
+        for doc in docs:
+            if doc.doc_id is None:
+                continue
+            values = tuple(frozenset(getattr(doc, facet) or ()) for facet in self.facets)
+            old_values = self.doc_values.get(doc.doc_id)
+            if old_values == values:
+                continue
+            if old_values is None:
+                new_ids.append(doc.doc_id)
+                old_values = tuple(frozenset() for _ in self.facets)
+
+            for facet, facet_values, facet_old_values in zip(self.facets, values, old_values):
+                for value in facet_values - facet_old_values:
+                    added[facet, value].append(doc.doc_id)
+                for value in facet_old_values - facet_values:
+                    removed[facet, value].append(doc.doc_id)
+            self.doc_values[doc.doc_id] = values
+
+        self.all_docs |= bits_from_ids(new_ids)
+        self._remove_bits(removed)
+        for (facet, value), doc_ids in added.items():
+            facet_bits = self.bits[facet]
+            facet_bits[value] = facet_bits.get(value, 0) | bits_from_ids(doc_ids)
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        removed: dict[tuple[str, str], list[DocID]] = defaultdict(list)
+        gone = []
+        for doc_id in doc_ids:
+            values = self.doc_values.pop(doc_id, None)
+            if values is None:
+                continue
+            gone.append(doc_id)
+            for facet, facet_values in zip(self.facets, values):
+                for value in facet_values:
+                    removed[facet, value].append(doc_id)
+
+        self.all_docs &= ~bits_from_ids(gone)
+        self._remove_bits(removed)
+
+    def _remove_bits(self, removed: dict[tuple[str, str], list[DocID]]) -> None:
+        for (facet, value), doc_ids in removed.items():
+            facet_bits = self.bits[facet]
+            bits = facet_bits.get(value, 0) & ~bits_from_ids(doc_ids)
+            if bits:
+                facet_bits[value] = bits
+            else:
+                del facet_bits[value]
+
+    def get(self, facet: str, value: str) -> DocIDBits:
+        """The documents having a value."""
+        return self.bits[facet].get(value, 0)
+
+    def filter(self, filters: Iterable[FacetFilter] = ()) -> DocIDBits:
+        """The documents passing every filter."""
+        bits = self.all_docs
+        for facet_filter in filters:
+            facet_bits = self.bits[facet_filter.facet]
+            for value in facet_filter.all_of:
+                bits &= facet_bits.get(value, 0)
+            if facet_filter.any_of:
+                bits &= reduce(or_, (facet_bits.get(value, 0) for value in facet_filter.any_of))
+            for value in facet_filter.none_of:
+                bits &= ~facet_bits.get(value, 0)
+        return bits
+
+    def counts(self, facet: str, within: Optional[DocIDBits] = None) -> dict[str, int]:
+        """
+        Count the documents having each value of a facet.
+
+        Args:
+            facet: The facet to count the values of
+            within: Only count these documents, e.g. the result of filter()
+
+        Returns:
+            Value -> count, most common first, without the values of no document
+        """
+        if within is None:
+            counts = {value: bits.bit_count() for value, bits in self.bits[facet].items()}
+        else:
+            counts = {value: (bits & within).bit_count() for value, bits in self.bits[facet].items()}
+        return dict(sorted(
+            ((value, count) for value, count in counts.items() if count),
+            key=lambda item: (-item[1], item[0]),
+        ))
@@ -0,0 +1,212 @@
+"""
+Sorted, paginated listing of the documents of a DocStore.
+
+SortedKeyIndex keeps the documents' sort keys in a sorted list per sortable
+field, updated by bisect insertion and removal as the store changes, so no
+listing sorts the whole store. Pages are fetched with keyset cursors: a
+cursor holds the sort key of the last document of a page, and the next page
+starts just past it with a binary search, in O(log n + page size) however
+deep the page. Keys end with the document ID, so the order is total and
+stable, and pages neither repeat nor skip documents that did not move.
+"""
+
+import bisect
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Optional
+
+from .doc_facets import FacetFilter, flags_from_bits
+from .document import Doc, DocID, DocStoreObserver
+
+if TYPE_CHECKING:
+    from .document import DocStore
+
+DEFAULT_PAGE_SIZE = 50
+
+# Changes to at least this share of the documents re-sort the lists instead of inserting one by one
+RESORT_MIN_RATIO = 0.25
+RESORT_MIN_DOCS = 64
+
+SortKey = tuple[Any, DocID]  # (Sort field value, document ID)
+
+
+class SortFields:
+    """Doc fields documents can be listed by."""
+
+    UPDATED_AT = 'updated_at'
+    CREATED_AT = 'created_at'
+    NAME = 'name'  # Case-insensitive
+
+    ALL = (UPDATED_AT, CREATED_AT, NAME)
+
+
+def sort_key(doc: Doc, sort_by: str) -> SortKey:
+    assert doc.doc_id is not None, "Only stored documents have sort keys."
+    value = getattr(doc, sort_by)
+    if sort_by == SortFields.NAME:
+        value = value.casefold()
+    return value, doc.doc_id
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """Where a page of a listing ended, the next page starts after it."""
+
+    sort_by: str
+    descending: bool
+    key: Optional[SortKey]  # Of the last document of the page, None for an empty page
+
+
+@dataclass
+class DocPage:
+    """A page of a sorted listing."""
+
+    docs: list[Doc]
+    next_cursor: Optional[PageCursor]  # None for the last page
+    total: int  # Documents in the whole listing
+
+
+class SortedKeyIndex(DocStoreObserver):
+    """
+    Sorted lists of the documents' sort keys, one per sortable field.
+
+    Not thread-safe on its own: a store calls it with its write lock held,
+    and reads it with its read lock held.
+
+    Args:
+        sort_fields: The Doc fields to keep sorted lists of, see SortFields
+    """
+
+    def __init__(self, sort_fields: Iterable[str] = SortFields.ALL):
+        self.sort_fields = tuple(sort_fields)
+        self.keys: dict[str, list[SortKey]] = {sort_by: [] for sort_by in self.sort_fields}
+        self.doc_keys: dict[DocID, tuple[SortKey, ...]] = {}  # Indexed keys, per sort field
+
+    def __len__(self) -> int:
+        return len(self.doc_keys)
+
+    def on_attached(self, docs: list[Doc]) -> None:
+        self.keys = {sort_by: [] for sort_by in self.sort_fields}
+        self.doc_keys = {}
+        self._update(docs)
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        self._update(docs)
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        self._update(docs)
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        for doc_id in doc_ids:
+            old_keys = self.doc_keys.pop(doc_id, None)
+            if old_keys is not None:
+                for sort_by, old_key in zip(self.sort_fields, old_keys):
+                    self._discard(self.keys[sort_by], old_key)
+
+    def _doc_keys(self, doc: Doc) -> tuple[SortKey, ...]:
+        return tuple(sort_key(doc, sort_by) for sort_by in self.sort_fields)
+
+    def _update(self, docs: list[Doc]) -> None:
+        updates = [(doc.doc_id, self._doc_keys(doc)) for doc in docs if doc.doc_id is not None]
+        if len(updates) >= RESORT_MIN_DOCS and len(updates) >= RESORT_MIN_RATIO * len(self.doc_keys):
+            self.doc_keys.update(updates)
+            self._resort()
+            return
+
+        for doc_id, new_keys in updates:
+            old_keys = self.doc_keys.get(doc_id)
+            if old_keys == new_keys:
+                continue
+            for index, sort_by in enumerate(self.sort_fields):
+                keys = self.keys[sort_by]
+                if old_keys is not None:
+                    self._discard(keys, old_keys[index])
+                bisect.insort(keys, new_keys[index])
+            self.doc_keys[doc_id] = new_keys
+
+    def _resort(self) -> None:
+        for index, sort_by in enumerate(self.sort_fields):
+            self.keys[sort_by] = sorted(doc_keys[index] for doc_keys in self.doc_keys.values())
+
+    @staticmethod
+    def _discard(keys: list[SortKey], key: SortKey) -> None:
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    def key_range(self, sort_by: str, start: Any = None, end: Any = None) -> tuple[int, int]:
+        """
+        The positions in the sorted keys of the documents whose value is in [start, end).
+
+        Returns:
+            (first, past the last) positions, in keys[sort_by]
+        """
+        if sort_by not in self.keys:
+            raise ValueError(f"Documents are not sorted by {sort_by}")
+        keys = self.keys[sort_by]
+        # A 1-tuple sorts before every key starting with the same value
+        first = bisect.bisect_left(keys, (start,)) if start is not None else 0
+        end_position = bisect.bisect_left(keys, (end,)) if end is not None else len(keys)
+        return first, max(first, end_position)
+
+    def iter_keys(self, sort_by: str, descending: bool = False, after: Optional[SortKey] = None) -> Iterator[SortKey]:
+        """
+        The sort keys in order, from just past a key if given.
+
+        Not to be iterated while the documents change.
+        """
+        if sort_by not in self.keys:
+            raise ValueError(f"Documents are not sorted by {sort_by}")
+        keys = self.keys[sort_by]
+        if descending:
+            end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+            return (keys[index] for index in range(end - 1, -1, -1))
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        return (keys[index] for index in range(start, len(keys)))
+
+
+def list_page(
+    store: "DocStore",
+    sort_by: str = SortFields.UPDATED_AT,
+    descending: bool = False,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[PageCursor] = None,
+    filters: Iterable[FacetFilter] = (),
+) -> DocPage:
+    """
+    Get a page of a store's documents, sorted by a field, see DocStore.list_page().
+
+    With a cursor, the page continues the cursor's listing, its sort order
+    overrides the one given.
+    """
+    if cursor is not None:
+        sort_by, descending = cursor.sort_by, cursor.descending
+    filters = list(filters)
+    sorted_index = store.enable_sorted_listing()
+    facet_index = store.enable_facets() if filters else None
+
+    with store.lock.read():
+        allowed = None
+        total = len(sorted_index)
+        if facet_index is not None:
+            # Unpacked once, each key is then tested with an array lookup
+            bits = facet_index.filter(filters)
+            allowed = flags_from_bits(bits)
+            total = bits.bit_count()
+
+        docs: list[Doc] = []
+        last_key: Optional[SortKey] = None
+        keys = sorted_index.iter_keys(sort_by, descending, after=cursor.key if cursor is not None else None)
+        for key in keys:
+            doc_id = key[1]
+            if allowed is not None and (doc_id >= len(allowed) or not allowed[doc_id]):
+                continue
+            doc = store.doc_map.get(doc_id)
+            if doc is None:
+                continue
+            if len(docs) == limit:
+                # There is a next page
+                return DocPage(docs=docs, next_cursor=PageCursor(sort_by, descending, last_key), total=total)
+            docs.append(doc)
+            last_key = key
+
+    return DocPage(docs=docs, next_cursor=None, total=total)
@@ -0,0 +1,239 @@
+"""
+Hybrid search of DocStores.
+
+A query runs the full-text (BM25) and semantic (vector) searches of each
+store concurrently, on the documents passing its filters only, and merges
+their rankings by reciprocal rank fusion: a document scores
+sum(1 / (RRF_K + rank)) over the rankings it appears in. Documents found by
+both searches rise to the top, without calibrating BM25 scores against
+cosine similarities.
+
+Results are cached under the versions of the stores, which every change
+bumps, so a repeated query is answered from memory until a store changes.
+"""
+
+import functools
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Hashable, Iterable, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from .doc_facets import FacetFilter, ids_from_bits
+from .doc_timeline import TimeFields, doc_ids_between
+from .document import Doc, DocID, DocStore
+from .vector_index import Passage
+
+RRF_K = 60  # Damps the lead of the top ranks, the value of the original RRF paper
+CANDIDATES_PER_RESULT = 3  # Results fetched from each search per result returned
+DEFAULT_QUERY_CACHE_ENTRIES = 256
+QUERY_WORKERS = 4
+
+KeyT = TypeVar('KeyT', bound=Hashable)
+
+
+@dataclass(frozen=True)
+class DocQuery:
+    """A hybrid search, and the filters applied before scoring."""
+
+    text: str
+    limit: int = 10
+    namespaces: tuple[str, ...] = ()  # Stores searched by a registry, all if empty
+    filters: tuple[FacetFilter, ...] = ()  # E.g. FacetFilter(all_of=("tag",))
+    updated_after: Optional[datetime] = None
+    updated_before: Optional[datetime] = None
+
+    @property
+    def is_filtered(self) -> bool:
+        return bool(self.filters) or self.is_time_scoped
+
+    @property
+    def is_time_scoped(self) -> bool:
+        return self.updated_after is not None or self.updated_before is not None
+
+
+@dataclass
+class QueryHit:
+    """A document found by a query."""
+
+    namespace: str
+    doc: Doc
+    score: float  # Fused score
+    passage: Passage  # Most similar passage, the first one for documents only found by words
+    lexical_rank: Optional[int] = None  # Rank in the full-text results, from 1
+    semantic_rank: Optional[int] = None  # Rank in the semantic results, from 1
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[KeyT]], k: int = RRF_K) -> list[tuple[KeyT, float]]:
+    """
+    Merge rankings of keys, best first.
+
+    Returns:
+        (key, fused score) pairs, best first
+    """
+    scores: dict[KeyT, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class QueryCache:
+    """
+    Least-recently-used cache of query results.
+
+    Keys include the versions of the stores searched, so results of changed
+    stores are never returned, and age out of the cache.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_QUERY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, list[QueryHit]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[list[QueryHit]]:
+        with self._lock:
+            hits = self._entries.get(key)
+            if hits is not None:
+                self._entries.move_to_end(key)
+            return hits
+
+    def put(self, key: Hashable, hits: list[QueryHit]) -> None:
+        with self._lock:
+            self._entries[key] = hits
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+@functools.cache
+def _executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='doc-query')
+
+
+def allowed_doc_ids(store: DocStore, query: DocQuery) -> Optional[np.ndarray]:
+    """The IDs of the store's documents passing the query's filters, None if it has none."""
+    if not query.is_filtered:
+        return None
+
+    facet_index = store.enable_facets() if query.filters else None
+    sorted_index = store.enable_sorted_listing() if query.is_time_scoped else None
+    with store.lock.read():
+        if sorted_index is None:
+            assert facet_index is not None  # Filtered by facets only
+            return np.array(ids_from_bits(facet_index.filter(query.filters)), dtype=np.int64)
+        # Binary searched in the time index, rather than checking every document's date
+        in_range = doc_ids_between(sorted_index, TimeFields.UPDATED_AT, query.updated_after, query.updated_before)
+        if facet_index is None:
+            return np.array(in_range, dtype=np.int64)
+        doc_ids = np.intersect1d(ids_from_bits(facet_index.filter(query.filters)), in_range)
+    return np.asarray(doc_ids, dtype=np.int64)
+
+
+def _lexical_ranking(store: DocStore, text: str, limit: int, doc_ids: Optional[np.ndarray]) -> list[DocID]:
+    search_index = store.search_index
+    assert search_index is not None, "Search index should be enabled by run_query()."
+    with store.lock.read():
+        return [doc_id for doc_id, _ in search_index.search(text, limit=limit, doc_ids=doc_ids)]
+
+
+def run_query(stores: list[DocStore], query: DocQuery, cache: Optional[QueryCache] = None) -> list[QueryHit]:
+    """
+    Run a hybrid query on stores, ranking the results of all of them together.
+
+    Not to be called with the lock of any of the stores held, the searches
+    run on other threads.
+    """
+    # Enabled before the versions are read, enabling an index refreshes the store
+    for store in stores:
+        if store.search_index is None:
+            store.enable_search_index()
+        store.enable_vector_index()
+        if query.filters:
+            store.enable_facets()
+        if query.is_time_scoped:
+            store.enable_sorted_listing()
+
+    cache_key = (query, tuple((store.namespace, store.version) for store in stores))
+    if cache is not None:
+        hits = cache.get(cache_key)
+        if hits is not None:
+            return hits
+
+    hits = _fuse(_start_searches(stores, query), query.limit)
+    if cache is not None:
+        cache.put(cache_key, hits)
+    return hits
+
+
+def _start_searches(stores: list[DocStore], query: DocQuery) -> list[tuple[DocStore, Future, Future]]:
+    """Submit the full-text and semantic searches of each store, skipping stores with no document passing the filters."""
+    candidate_count = query.limit * CANDIDATES_PER_RESULT
+    searches = []
+    for store in stores:
+        doc_ids = allowed_doc_ids(store, query)
+        if doc_ids is not None and not len(doc_ids):
+            continue
+        vector_index = store.vector_index
+        assert vector_index is not None, "Vector index should be enabled by run_query()."
+        searches.append((
+            store,
+            _executor().submit(_lexical_ranking, store, query.text, candidate_count, doc_ids),
+            _executor().submit(vector_index.search, query.text, candidate_count, doc_ids),
+        ))
+    return searches
+
+
+def _fuse(searches: list[tuple[DocStore, Future, Future]], limit: int) -> list[QueryHit]:
+    """Wait for the searches, and rank their results together."""
+    rankings: list[list[tuple[str, DocID]]] = []
+    lexical_ranks: dict[tuple[str, DocID], int] = {}
+    semantic_ranks: dict[tuple[str, DocID], int] = {}
+    best_passages: dict[tuple[str, DocID], Passage] = {}
+    for store, lexical, semantic in searches:
+        lexical_ranking = [(store.namespace, doc_id) for doc_id in lexical.result()]
+        semantic_ranking: list[tuple[str, DocID]] = []
+        for passage in semantic.result():
+            key = (store.namespace, passage.doc_id)
+            if key not in best_passages:
+                best_passages[key] = passage
+                semantic_ranking.append(key)
+        lexical_ranks.update((key, rank) for rank, key in enumerate(lexical_ranking, start=1))
+        semantic_ranks.update((key, rank) for rank, key in enumerate(semantic_ranking, start=1))
+        rankings += [lexical_ranking, semantic_ranking]
+
+    stores_by_namespace = {store.namespace: store for store, _, _ in searches}
+    hits = []
+    for (namespace, doc_id), score in reciprocal_rank_fusion(rankings):
+        doc = stores_by_namespace[namespace].get_document(doc_id)
+        if doc is None:
+            continue
+        passage = best_passages.get((namespace, doc_id)) or _first_passage(stores_by_namespace[namespace], doc)
+        hits.append(QueryHit(
+            namespace=namespace,
+            doc=doc,
+            score=score,
+            passage=passage,
+            lexical_rank=lexical_ranks.get((namespace, doc_id)),
+            semantic_rank=semantic_ranks.get((namespace, doc_id)),
+        ))
+        if len(hits) == limit:
+            break
+    return hits
+
+
+def _first_passage(store: DocStore, doc: Doc) -> Passage:
+    assert store.vector_index is not None and doc.doc_id is not None
+    chunks = store.vector_index.chunker.chunk(doc.content)
+    start, end = (chunks[0].start, chunks[0].end) if chunks else (0, 0)
+    return Passage(doc_id=doc.doc_id, start=start, end=end, text=doc.content[start:end])
@@ -0,0 +1,424 @@
+"""
+Full-text search over the documents of a DocStore.
+
+SearchIndex is an inverted index over each document's name and content,
+ranked with BM25. It observes its store, so adds, edits and deletes are
+indexed as they happen, and it is saved next to the store so it does not need
+rebuilding at startup: only documents whose version changed since the index
+was saved, see Doc.version, are indexed again.
+
+Queries are words, matched in any order, and may hold:
+    "exact phrases"     Only documents containing the phrase match
+    prefix*             Matches every indexed word starting with the prefix
+"""
+
+import bisect
+import io
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from .atomic_io import atomic_write_bytes
+from .custom_logging import LOGGER
+from .document import Doc, DocID, DocStoreObserver
+
+try:
+    import msgpack
+except ImportError:  # Optional, the index is rebuilt at startup without it
+    msgpack = None
+
+SEARCH_INDEX_VERSION = 2
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+NAME_WEIGHT = 2  # A word in the name counts as this many in the content
+
+MAX_TERM_FREQUENCY = 2**16 - 1  # Term frequencies are stored as uint16
+MAX_PREFIX_EXPANSIONS = 64  # Most frequent words a prefix expands to
+NEW_TERMS_LIMIT = 1024  # New words scanned one by one before the sorted word list is rebuilt
+COMPACT_DEAD_RATIO = 0.5  # Compact once this share of the slots are deleted documents
+COMPACT_MIN_SLOTS = 1024
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_CHAR = chr(0x10FFFF)  # Sorts after every word
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+DocLoader = Callable[[DocID], Optional[Doc]]
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def contains_phrase(tokens: list[str], phrase: list[str]) -> bool:
+    first = phrase[0]
+    n = len(phrase)
+    for i, token in enumerate(tokens):
+        if token == first and tokens[i:i + n] == phrase:
+            return True
+    return False
+
+
+class ParsedQuery:
+    """A query split into plain words, prefixes and phrases."""
+
+    def __init__(self, query: str):
+        self.terms: list[str] = []
+        self.prefixes: list[str] = []
+        self.phrases: list[list[str]] = []
+
+        for phrase, word in QUERY_RE.findall(query):
+            if phrase:
+                tokens = tokenize(phrase)
+                if len(tokens) > 1:
+                    self.phrases.append(tokens)
+                self.terms.extend(tokens)
+            elif word.endswith('*') and tokenize(word):
+                # Only the last word of e.g. "pre-fix*" is a prefix
+                *words, prefix = tokenize(word)
+                self.terms.extend(words)
+                self.prefixes.append(prefix)
+            else:
+                self.terms.extend(tokenize(word))
+
+    def __bool__(self) -> bool:
+        return bool(self.terms or self.prefixes)
+
+
+def _array_bytes(values: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, values, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _array_from_bytes(data: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class SearchIndex(DocStoreObserver):
+    """
+    BM25-ranked inverted index of documents.
+
+    Every indexing of a document gets a new slot. Postings map each word to
+    the slots holding it and its frequency there, as compact arrays scored
+    in bulk with numpy. Slots of changed or deleted documents are marked dead
+    and dropped by the next compaction.
+
+    Not thread-safe on its own: a store calls it with its write lock held,
+    and searches it with its read lock held.
+
+    Args:
+        doc_loader: Gets a document by ID, to check phrases against its text
+        index_path: File the index is saved to and loaded from, if any
+    """
+
+    def __init__(self, doc_loader: DocLoader, index_path: Optional[Path] = None):
+        self.doc_loader = doc_loader
+        self.index_path = index_path
+        self._clear()
+        self._changed = False
+        if index_path is not None:
+            self._load(index_path)
+
+    def _clear(self) -> None:
+        self.postings: dict[str, tuple[array, array]] = {}  # Word -> (slots, term frequencies)
+        self.doc_slots: dict[DocID, int] = {}
+        self.doc_versions: dict[DocID, str] = {}  # Document ID -> Doc.version when indexed
+        self.slot_count = 0
+        self.live_count = 0
+        self.live_length = 0  # Total length of the live slots
+        self.slot_docs = np.zeros(0, dtype=np.int64)
+        self.slot_lengths = np.zeros(0, dtype=np.float32)
+        self.slot_live = np.zeros(0, dtype=bool)
+        self._reset_term_list()
+
+    def _reset_term_list(self) -> None:
+        # Sorted words and their posting sizes, for prefix queries, rebuilt lazily
+        self._term_list: Optional[tuple[list[str], np.ndarray]] = None
+        self._new_terms: list[str] = []  # Words added since the term list was built
+
+    def __len__(self) -> int:
+        return self.live_count
+
+    def __contains__(self, doc_id: DocID) -> bool:
+        return doc_id in self.doc_slots
+
+    # Store changes
+
+    def on_attached(self, docs: list[Doc]) -> None:
+        """Bring the index in line with the store, re-indexing only what changed."""
+        doc_ids = {doc.doc_id for doc in docs}
+        self.on_docs_removed([doc_id for doc_id in self.doc_slots if doc_id not in doc_ids])
+        self.on_docs_loaded(docs)
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        for doc in docs:
+            self.index_doc(doc)
+        self._compact_if_sparse()
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        for doc in docs:
+            if doc.doc_id is not None and self.doc_versions.get(doc.doc_id) != doc.version:
+                self.index_doc(doc)
+        self._compact_if_sparse()
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        for doc_id in doc_ids:
+            self._remove_slot(doc_id)
+        self._compact_if_sparse()
+
+    def on_store_saved(self) -> None:
+        self.persist()
+
+    # Indexing
+
+    def index_doc(self, doc: Doc) -> None:
+        """Index a document, replacing any previous version of it."""
+        if doc.doc_id is None:
+            return
+        self._remove_slot(doc.doc_id)
+
+        frequencies = Counter(tokenize(doc.content))
+        for token in tokenize(doc.name):
+            frequencies[token] += NAME_WEIGHT
+
+        slot = self._new_slot(doc.doc_id, frequencies.total())
+        postings = self.postings
+        for term, frequency in frequencies.items():
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = (array('i'), array('H'))
+                self._new_terms.append(term)
+            posting[0].append(slot)
+            posting[1].append(min(frequency, MAX_TERM_FREQUENCY))
+
+        self.doc_slots[doc.doc_id] = slot
+        self.doc_versions[doc.doc_id] = doc.version
+        self._changed = True
+
+    def _new_slot(self, doc_id: DocID, length: int) -> int:
+        slot = self.slot_count
+        if slot == len(self.slot_docs):
+            capacity = max(1024, 2 * slot)
+            self.slot_docs = np.resize(self.slot_docs, capacity)
+            self.slot_lengths = np.resize(self.slot_lengths, capacity)
+            self.slot_live = np.resize(self.slot_live, capacity)
+        self.slot_docs[slot] = doc_id
+        self.slot_lengths[slot] = length
+        self.slot_live[slot] = True
+        self.slot_count += 1
+        self.live_count += 1
+        self.live_length += length
+        return slot
+
+    def _remove_slot(self, doc_id: DocID) -> None:
+        slot = self.doc_slots.pop(doc_id, None)
+        if slot is None:
+            return
+        self.doc_versions.pop(doc_id, None)
+        self.slot_live[slot] = False
+        self.live_count -= 1
+        self.live_length -= int(self.slot_lengths[slot])
+        self._changed = True
+
+    def _compact_if_sparse(self) -> None:
+        dead_count = self.slot_count - self.live_count
+        if self.slot_count >= COMPACT_MIN_SLOTS and dead_count > COMPACT_DEAD_RATIO * self.slot_count:
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop the slots of changed and deleted documents, renumbering the live ones."""
+        live = self.slot_live[:self.slot_count]
+        new_slots = (np.cumsum(live) - 1).astype(np.int32)  # Old slot -> new slot, for the live ones
+
+        postings = {}
+        for term, (slots, frequencies) in self.postings.items():
+            slot_view = np.array(slots, dtype=np.int32)
+            keep = live[slot_view]
+            if not keep.any():
+                continue
+            postings[term] = (
+                array('i', new_slots[slot_view[keep]].tobytes()),
+                array('H', np.array(frequencies, dtype=np.uint16)[keep].tobytes()),
+            )
+        self.postings = postings
+
+        self.slot_docs = self.slot_docs[:self.slot_count][live]
+        self.slot_lengths = self.slot_lengths[:self.slot_count][live]
+        self.slot_count = self.live_count
+        self.slot_live = np.ones(self.slot_count, dtype=bool)
+        self.doc_slots = {int(doc_id): slot for slot, doc_id in enumerate(self.slot_docs)}
+        self._reset_term_list()
+        self._changed = True
+
+    # Searching
+
+    def search(self, query: str, limit: int = 10, doc_ids: Optional[np.ndarray] = None) -> list[tuple[DocID, float]]:
+        """
+        Find the documents best matching a query.
+
+        Args:
+            query: Words, prefix* and "quoted phrases"
+            limit: Maximum number of results
+            doc_ids: Only score these documents, if given
+
+        Returns:
+            Up to limit (document ID, score) pairs, best first
+        """
+        parsed = ParsedQuery(query)
+        if not parsed or not self.live_count or limit <= 0:
+            return []
+
+        terms = list(parsed.terms)
+        for prefix in parsed.prefixes:
+            terms.extend(self._expand_prefix(prefix))
+        slot_mask = None if doc_ids is None else np.isin(self.slot_docs[:self.slot_count], doc_ids, kind='table')
+        scores = self._score_terms(list(dict.fromkeys(terms)), slot_mask)
+
+        if parsed.phrases:
+            # Only documents holding every word of the phrases can contain them
+            for term in {term for phrase in parsed.phrases for term in phrase}:
+                posting = self.postings.get(term)
+                if posting is None:
+                    return []
+                has_term = np.zeros(self.slot_count, dtype=bool)
+                has_term[np.array(posting[0], dtype=np.int32)] = True
+                scores[~has_term] = 0
+
+        candidates = np.flatnonzero(scores)
+        if not parsed.phrases and len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for slot in candidates:
+            doc_id = int(self.slot_docs[slot])
+            if parsed.phrases and not self._matches_phrases(doc_id, parsed.phrases):
+                continue
+            results.append((doc_id, float(scores[slot])))
+            if len(results) == limit:
+                break
+        return results
+
+    def _score_terms(self, terms: list[str], slot_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        BM25 scores of every slot for the given words, with the postings of all words scored at once.
+
+        Slots outside slot_mask, if given, are not scored. They still count
+        towards the word frequencies, so filtering does not change the scores.
+        """
+        postings = [self.postings[term] for term in terms if term in self.postings]
+        if not postings:
+            return np.zeros(self.slot_count)
+
+        slots = np.concatenate([np.array(posting[0], dtype=np.int32) for posting in postings])
+        frequencies = np.concatenate([np.array(posting[1], dtype=np.float32) for posting in postings])
+        term_ids = np.repeat(np.arange(len(postings)), [len(posting[0]) for posting in postings])
+        live = self.slot_live[slots]
+        slots, frequencies, term_ids = slots[live], frequencies[live], term_ids[live]
+
+        doc_frequencies = np.bincount(term_ids, minlength=len(postings))
+        idfs = np.log1p((self.live_count - doc_frequencies + 0.5) / (doc_frequencies + 0.5))
+        if slot_mask is not None:
+            kept = slot_mask[slots]
+            slots, frequencies, term_ids = slots[kept], frequencies[kept], term_ids[kept]
+        average_length = self.live_length / self.live_count
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * self.slot_lengths[slots] / average_length)
+        weights = idfs[term_ids] * frequencies * (BM25_K1 + 1) / (frequencies + norms)
+        return np.bincount(slots, weights=weights, minlength=self.slot_count)
+
+    def _expand_prefix(self, prefix: str) -> list[str]:
+        """The indexed words starting with a prefix, only the most frequent ones if there are many."""
+        term_list = self._term_list
+        if term_list is None or len(self._new_terms) > NEW_TERMS_LIMIT:
+            # Assigned at once, concurrent searches may rebuild it too
+            terms = sorted(self.postings)
+            term_list = self._term_list = (terms, np.array([len(self.postings[term][0]) for term in terms]))
+            self._new_terms = []
+        sorted_terms, sizes = term_list
+
+        start = bisect.bisect_left(sorted_terms, prefix)
+        end = bisect.bisect_left(sorted_terms, prefix + MAX_CHAR, lo=start)
+        if end - start > MAX_PREFIX_EXPANSIONS:
+            top = start + np.argpartition(-sizes[start:end], MAX_PREFIX_EXPANSIONS)[:MAX_PREFIX_EXPANSIONS]
+            terms = [sorted_terms[i] for i in top]
+        else:
+            terms = sorted_terms[start:end]
+        terms += [term for term in self._new_terms if term.startswith(prefix)]
+        # Words of deleted documents stay listed until the next compaction
+        return [term for term in terms if term in self.postings]
+
+    def _matches_phrases(self, doc_id: DocID, phrases: list[list[str]]) -> bool:
+        doc = self.doc_loader(doc_id)
+        if doc is None:
+            return False
+        # Name and content are checked apart, a phrase cannot span both
+        name_tokens = tokenize(doc.name)
+        content_tokens = tokenize(doc.content)
+        return all(
+            contains_phrase(name_tokens, phrase) or contains_phrase(content_tokens, phrase)
+            for phrase in phrases
+        )
+
+    # Persistence
+
+    def persist(self) -> None:
+        """Save the index to its file, if it changed since the last save."""
+        if self.index_path is None or not self._changed:
+            return
+        if msgpack is None:
+            LOGGER.warning(f"msgpack is not installed, search index {self.index_path} is not saved")
+            return
+        # Plain data only, loading the file never runs code
+        state = {
+            'version': SEARCH_INDEX_VERSION,
+            'postings': {
+                term: [slots.tobytes(), frequencies.tobytes()] for term, (slots, frequencies) in self.postings.items()
+            },
+            'doc_versions': self.doc_versions,
+            'slot_count': self.slot_count,
+            'slot_docs': _array_bytes(self.slot_docs[:self.slot_count]),
+            'slot_lengths': _array_bytes(self.slot_lengths[:self.slot_count]),
+            'slot_live': _array_bytes(self.slot_live[:self.slot_count]),
+        }
+        atomic_write_bytes(self.index_path, msgpack.packb(state, use_bin_type=True))
+        self._changed = False
+        LOGGER.debug(f"Saved search index of {self.live_count} documents to {self.index_path}")
+
+    def _load(self, index_path: Path) -> None:
+        if msgpack is None:
+            return
+        try:
+            with open(index_path, 'rb') as file:
+                state = msgpack.unpackb(file.read(), raw=False, strict_map_key=False)
+            if not isinstance(state, dict):
+                raise ValueError("not a search index")
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            LOGGER.error(f"Search index {index_path} failed to load, rebuilding it: {e}")
+            return
+        if state.get('version') != SEARCH_INDEX_VERSION:
+            LOGGER.info(f"Search index {index_path} is of another version, rebuilding it")
+            return
+
+        self.postings = {
+            term: (array('i', slots), array('H', frequencies))
+            for term, (slots, frequencies) in state['postings'].items()
+        }
+        self.doc_versions = state['doc_versions']
+        self.slot_count = state['slot_count']
+        self.slot_docs = _array_from_bytes(state['slot_docs'])
+        self.slot_lengths = _array_from_bytes(state['slot_lengths'])
+        self.slot_live = _array_from_bytes(state['slot_live'])
+        live_slots = np.flatnonzero(self.slot_live)
+        self.doc_slots = dict(zip(self.slot_docs[live_slots].tolist(), live_slots.tolist()))
+        self.live_count = len(live_slots)
+        self.live_length = int(self.slot_lengths[live_slots].sum())
+        self._reset_term_list()
@@ -0,0 +1,188 @@
+"""
+Statistics of the documents of a DocStore, kept as they change.
+
+NamespaceStats observes a store and keeps running totals: each change
+subtracts the old contribution of the documents it touches and adds the
+new one, so reading the statistics never scans the documents. Contributions
+are saved with the store, next to it or in its SQLite file, so a reopened
+store only measures the documents changed since, and lazy stores do not load
+every document's content to count it.
+"""
+
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from .atomic_io import atomic_write_text
+from .chunking import count_tokens
+from .custom_logging import LOGGER
+from .document import Doc, DocID, DocStoreObserver
+
+STATS_VERSION = 2
+
+# (Doc.version when measured, content bytes, token estimate, tags)
+DocContribution = tuple[str, int, int, tuple[str, ...]]
+
+
+@dataclass(frozen=True)
+class StoreStats:
+    """A snapshot of the statistics of a namespace."""
+
+    doc_count: int
+    content_bytes: int  # UTF-8
+    token_estimate: int  # Words and punctuation marks, see chunking.count_tokens
+    tag_counts: dict[str, int] = field(default_factory=dict)  # Tag -> documents having it, most common first
+    last_modified: Optional[datetime] = None  # Of the last change seen, None before any
+
+    @property
+    def tag_cardinality(self) -> int:
+        """The number of distinct tags."""
+        return len(self.tag_counts)
+
+
+class NamespaceStats(DocStoreObserver):
+    """
+    Running totals of a store's documents, updated in O(1) per document changed.
+
+    Not thread-safe on its own: a store calls it with its write lock held,
+    and reads it with its read lock held.
+
+    Args:
+        stats_path: File the statistics are saved to and loaded from, if any
+    """
+
+    def __init__(self, stats_path: Optional[Path] = None):
+        self.stats_path = stats_path
+        self.contributions: dict[DocID, DocContribution] = {}
+        self.content_bytes = 0
+        self.token_estimate = 0
+        self.tag_counts: Counter[str] = Counter()
+        self.last_modified: Optional[datetime] = None
+        self._changed = False
+        if stats_path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.contributions)
+
+    # Store changes
+
+    def on_attached(self, docs: list[Doc]) -> None:
+        """Bring the totals in line with the store, measuring only what changed."""
+        doc_ids = {doc.doc_id for doc in docs}
+        removed = [doc_id for doc_id in self.contributions if doc_id not in doc_ids]
+        for doc_id in removed:
+            self._subtract(doc_id)
+        self.on_docs_loaded(docs)
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        for doc in docs:
+            self._measure(doc)
+        if docs:
+            self._touch(datetime.now())
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        changed = [
+            doc for doc in docs
+            if doc.doc_id not in self.contributions
+            or self.contributions[doc.doc_id][0] != doc.version
+        ]
+        for doc in changed:
+            self._measure(doc)
+        if changed:
+            self._touch(max(doc.updated_at for doc in changed))
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        removed = [doc_id for doc_id in doc_ids if doc_id in self.contributions]
+        for doc_id in removed:
+            self._subtract(doc_id)
+        if removed:
+            self._touch(datetime.now())
+
+    def on_store_saved(self) -> None:
+        self.persist()
+
+    def _measure(self, doc: Doc) -> None:
+        if doc.doc_id is None:
+            return
+        self._subtract(doc.doc_id)
+        content = doc.content
+        contribution = (
+            doc.version,
+            len(content.encode('utf-8')),
+            count_tokens(content),
+            tuple(dict.fromkeys(doc.tags)),
+        )
+        self._add(doc.doc_id, contribution)
+        self._changed = True
+
+    def _add(self, doc_id: DocID, contribution: DocContribution) -> None:
+        self.contributions[doc_id] = contribution
+        self.content_bytes += contribution[1]
+        self.token_estimate += contribution[2]
+        self.tag_counts.update(contribution[3])
+
+    def _subtract(self, doc_id: DocID) -> None:
+        contribution = self.contributions.pop(doc_id, None)
+        if contribution is None:
+            return
+        self.content_bytes -= contribution[1]
+        self.token_estimate -= contribution[2]
+        self.tag_counts.subtract(contribution[3])
+        for tag in contribution[3]:
+            if self.tag_counts[tag] <= 0:
+                del self.tag_counts[tag]
+        self._changed = True
+
+    def _touch(self, modified_at: datetime) -> None:
+        if self.last_modified is None or modified_at > self.last_modified:
+            self.last_modified = modified_at
+            self._changed = True
+
+    def snapshot(self) -> StoreStats:
+        return StoreStats(
+            doc_count=len(self.contributions),
+            content_bytes=self.content_bytes,
+            token_estimate=self.token_estimate,
+            tag_counts=dict(self.tag_counts.most_common()),
+            last_modified=self.last_modified,
+        )
+
+    # Persistence
+
+    def persist(self) -> None:
+        """Save the statistics to their file, if they changed since the last save."""
+        if self.stats_path is None or not self._changed:
+            return
+        state = {
+            'version': STATS_VERSION,
+            'last_modified': self.last_modified.isoformat() if self.last_modified is not None else None,
+            'contributions': {str(doc_id): contribution for doc_id, contribution in self.contributions.items()},
+        }
+        atomic_write_text(self.stats_path, json.dumps(state, separators=(',', ':')))
+        self._changed = False
+        LOGGER.debug(f"Saved statistics of {len(self.contributions)} documents to {self.stats_path}")
+
+    def _load(self) -> None:
+        stats_path = self.stats_path
+        if stats_path is None:
+            return
+        try:
+            with open(stats_path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            LOGGER.error(f"Statistics {stats_path} failed to load, recounting: {e}")
+            return
+        if state.get('version') != STATS_VERSION:
+            LOGGER.info(f"Statistics {stats_path} are of another version, recounting")
+            return
+
+        for doc_id, (version, content_bytes, token_estimate, tags) in state['contributions'].items():
+            self._add(int(doc_id), (version, content_bytes, token_estimate, tuple(tags)))
+        if state['last_modified'] is not None:
+            self.last_modified = datetime.fromisoformat(state['last_modified'])
@@ -0,0 +1,112 @@
+"""
+Time-range queries over the documents' created_at and updated_at.
+
+They read the store's sorted listing index, see doc_listing, whose keys for
+the date fields are in timestamp order, so every query starts with a binary
+search: a range costs O(log n + matches), the most recent N documents
+O(log n + N), and a timeline of B buckets O(B log n), however many
+documents the namespace holds.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Optional
+
+from .doc_listing import SortedKeyIndex, SortFields
+from .document import Doc, DocID
+
+if TYPE_CHECKING:
+    from .document import DocStore
+
+# Most buckets a timeline is split into, bounds the cost of a too fine bucket width
+MAX_TIMELINE_BUCKETS = 10_000
+
+
+class TimeFields:
+    """Doc fields indexed by time."""
+
+    CREATED_AT = SortFields.CREATED_AT
+    UPDATED_AT = SortFields.UPDATED_AT
+
+    ALL = (CREATED_AT, UPDATED_AT)
+
+
+@dataclass(frozen=True)
+class TimelineBucket:
+    """The number of documents whose time falls in [start, end)."""
+
+    start: datetime
+    end: datetime
+    count: int
+
+
+def _check_field(field: str) -> None:
+    if field not in TimeFields.ALL:
+        raise ValueError(f"Documents are not indexed by time of {field}")
+
+
+def doc_ids_between(
+    sorted_index: SortedKeyIndex,
+    field: str = TimeFields.UPDATED_AT,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> list[DocID]:
+    """The IDs of the documents whose time is in [start, end), oldest first."""
+    _check_field(field)
+    first, end_position = sorted_index.key_range(field, start, end)
+    return [doc_id for _, doc_id in sorted_index.keys[field][first:end_position]]
+
+
+def documents_between(
+    store: "DocStore",
+    field: str = TimeFields.UPDATED_AT,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    latest_first: bool = False,
+) -> list[Doc]:
+    """The documents whose time is in [start, end), see DocStore.documents_between()."""
+    _check_field(field)
+    sorted_index = store.enable_sorted_listing()
+    with store.lock.read():
+        first, end_position = sorted_index.key_range(field, start, end)
+        if limit is not None:
+            if latest_first:
+                first = max(first, end_position - limit)
+            else:
+                end_position = min(end_position, first + limit)
+        keys = sorted_index.keys[field][first:end_position]
+        if latest_first:
+            keys.reverse()
+        return [store.doc_map[doc_id] for _, doc_id in keys if doc_id in store.doc_map]
+
+
+def timeline(
+    store: "DocStore",
+    start: datetime,
+    end: datetime,
+    bucket: timedelta,
+    field: str = TimeFields.UPDATED_AT,
+) -> list[TimelineBucket]:
+    """Count the documents whose time falls in each bucket of a range, see DocStore.timeline()."""
+    _check_field(field)
+    if bucket <= timedelta(0):
+        raise ValueError(f"Timeline buckets must be a positive duration, not {bucket}")
+    if (end - start) / bucket > MAX_TIMELINE_BUCKETS:
+        raise ValueError(f"A timeline of {end - start} by {bucket} has more than {MAX_TIMELINE_BUCKETS} buckets")
+
+    edges = []
+    edge = start
+    while edge < end:
+        edges.append(edge)
+        edge += bucket
+    edges.append(end)
+
+    sorted_index = store.enable_sorted_listing()
+    with store.lock.read():
+        # One binary search per edge, the documents themselves are never read
+        positions = [sorted_index.key_range(field, edge)[0] for edge in edges]
+    return [
+        TimelineBucket(start=bucket_start, end=bucket_end, count=end_position - first)
+        for bucket_start, bucket_end, first, end_position in zip(edges, edges[1:], positions, positions[1:])
+    ]
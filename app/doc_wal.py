@@ -0,0 +1,235 @@
+"""
+Write-ahead log of DocStore mutations.
+
+Every document put or delete is appended to a log before the store's own
+(slower, whole-file) save happens, so a crash loses at most the last group
+commit interval of edits. Appends are buffered and written by a background
+thread, which fsyncs once per group of records rather than once per edit.
+
+The log is split into segments. Saving the store seals the current segment
+and deletes the sealed ones once the save succeeded; the WALCompactor does
+this periodically. Segments left over from a previous run are replayed into
+the store when the log is opened.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .custom_logging import LOGGER
+from .document import Doc, DocEncoder, DocID
+
+if TYPE_CHECKING:
+    from .document import DocStore
+
+WAL_SEGMENT_EXT = '.wal'
+
+DEFAULT_GROUP_COMMIT_INTERVAL_SECONDS = 0.005
+DEFAULT_COMPACT_INTERVAL_SECONDS = 30.0
+
+
+class WALOps:
+    """Operations recorded in the log."""
+
+    PUT = 'put'
+    DELETE = 'delete'
+
+
+def encode_record(record: dict) -> str:
+    # The checksum detects a record torn by a crash mid-write
+    payload = json.dumps(record, cls=DocEncoder)
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n"
+
+
+def decode_record(line: str) -> Optional[dict]:
+    """Decode a log line, None if it is torn or corrupt."""
+    checksum, _, payload = line.rstrip('\n').partition(' ')
+    try:
+        if int(checksum, 16) != zlib.crc32(payload.encode('utf-8')):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class DocWAL:
+    """
+    Append-only, segmented log with group commit.
+
+    Args:
+        wal_dir: Directory holding the log segments
+        group_commit_interval_seconds: How long the commit thread gathers records before each fsync
+    """
+
+    def __init__(
+        self,
+        wal_dir: Path,
+        group_commit_interval_seconds: float = DEFAULT_GROUP_COMMIT_INTERVAL_SECONDS,
+    ):
+        self.wal_dir = wal_dir
+        self.group_commit_interval_seconds = group_commit_interval_seconds
+        wal_dir.mkdir(parents=True, exist_ok=True)
+
+        # Segments of a previous run are only ever read, new records go to a fresh segment
+        self.replay_segment_ids = sorted(int(path.stem) for path in wal_dir.glob(f"*{WAL_SEGMENT_EXT}"))
+        self.size_bytes = sum(self._segment_path(segment_id).stat().st_size for segment_id in self.replay_segment_ids)
+        self._segment_id = max(self.replay_segment_ids, default=0) + 1
+        self._file = open(self._segment_path(self._segment_id), 'a', encoding='utf-8')
+
+        self._cond = threading.Condition()
+        self._buffer: list[str] = []
+        self._appended_lsn = 0  # Log sequence number of the last appended record
+        self._committed_lsn = 0  # ... and of the last one synced to disk
+        self._file_lock = threading.Lock()
+        self._closed = False
+
+        self._commit_thread = threading.Thread(target=self._run_commits, name=f"wal-{wal_dir}", daemon=True)
+        self._commit_thread.start()
+        atexit.register(self.close)
+
+    def _segment_path(self, segment_id: int) -> Path:
+        return self.wal_dir / f"{segment_id:010d}{WAL_SEGMENT_EXT}"
+
+    def replay(self) -> Iterator[dict]:
+        """Yield the records left by previous runs, oldest first."""
+        for segment_id in self.replay_segment_ids:
+            path = self._segment_path(segment_id)
+            with open(path, encoding='utf-8') as file:
+                for line_number, line in enumerate(file, start=1):
+                    record = decode_record(line)
+                    if record is None:
+                        # Only the tail of a segment can be torn, nothing valid follows it
+                        LOGGER.warning(f"Stopping replay of {path} at corrupt line {line_number}")
+                        break
+                    yield record
+
+    def append(self, record: dict) -> int:
+        """
+        Queue a record for the next group commit.
+
+        Returns:
+            The record's log sequence number, see wait_for_commit()
+        """
+        line = encode_record(record)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Write-ahead log {self.wal_dir} is closed")
+            self._buffer.append(line)
+            self._appended_lsn += 1
+            self._cond.notify_all()
+            return self._appended_lsn
+
+    def log_put(self, doc: Doc) -> int:
+        return self.append({'op': WALOps.PUT, 'doc': doc.to_record()})
+
+    def log_delete(self, doc_id: DocID, file_names: list[str]) -> int:
+        return self.append({'op': WALOps.DELETE, 'doc_id': doc_id, 'file_names': file_names})
+
+    def wait_for_commit(self, lsn: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Block until the record with the given sequence number, by default the last one, is on disk."""
+        with self._cond:
+            target_lsn = self._appended_lsn if lsn is None else lsn
+            return self._cond.wait_for(lambda: self._committed_lsn >= target_lsn, timeout=timeout)
+
+    def _run_commits(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if self._closed:
+                    return
+            # Let more records join the group before paying for the fsync
+            time.sleep(self.group_commit_interval_seconds)
+            try:
+                with self._file_lock:
+                    self._write_pending()
+            except Exception as e:
+                LOGGER.error(f"Write-ahead log commit to {self.wal_dir} failed: {e}")
+
+    def _write_pending(self) -> None:
+        """Write and sync the buffered records, called with the file lock held."""
+        with self._cond:
+            lines, self._buffer = self._buffer, []
+            lsn = self._appended_lsn
+        if lines:
+            data = ''.join(lines)
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.size_bytes += len(data.encode('utf-8'))
+        with self._cond:
+            self._committed_lsn = max(self._committed_lsn, lsn)
+            self._cond.notify_all()
+
+    def rotate(self) -> int:
+        """
+        Seal the current segment and start a new one.
+
+        Returns:
+            The ID of the sealed segment, pass it to drop_segments_through()
+            once everything it holds has been saved
+        """
+        with self._file_lock:
+            self._write_pending()
+            self._file.close()
+            sealed_segment_id = self._segment_id
+            self._segment_id += 1
+            self._file = open(self._segment_path(self._segment_id), 'a', encoding='utf-8')
+        return sealed_segment_id
+
+    def drop_segments_through(self, segment_id: int) -> None:
+        """Delete the sealed segments up to and including the given one."""
+        for path in self.wal_dir.glob(f"*{WAL_SEGMENT_EXT}"):
+            if int(path.stem) <= segment_id:
+                self.size_bytes -= path.stat().st_size
+                path.unlink()
+        self.replay_segment_ids = [i for i in self.replay_segment_ids if i > segment_id]
+
+    def close(self) -> None:
+        """Commit what is buffered and stop the commit thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._commit_thread.join()
+        with self._file_lock:
+            self._write_pending()
+            self._file.close()
+        atexit.unregister(self.close)
+
+
+class WALCompactor:
+    """
+    Periodically saves a store, folding its write-ahead log into it.
+
+    Args:
+        store: The store whose log to compact
+        interval_seconds: Time between compactions
+    """
+
+    def __init__(self, store: "DocStore", interval_seconds: float = DEFAULT_COMPACT_INTERVAL_SECONDS):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"wal-compactor-{store.namespace}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            if not self.store.has_unsaved_changes:
+                continue
+            try:
+                self.store.save_all_to_remote()
+            except Exception as e:
+                LOGGER.error(f"Compacting the write-ahead log of namespace {self.store.namespace} failed: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
@@ -0,0 +1,105 @@
+"""
+Watching a LocalFilesystemDocStore directory for changes made on disk.
+
+With watchdog installed, changes are pushed from filesystem notifications
+(inotify on Linux) as they happen. Without it, a background thread refreshes
+the store at a fixed interval instead.
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from .custom_logging import LOGGER
+from .doc_codec import is_doc_file_name
+from .document import DEFAULT_POLL_INTERVAL_SECONDS
+
+if TYPE_CHECKING:
+    from watchdog.observers.api import BaseObserver
+
+    from .document import LocalFilesystemDocStore
+
+try:
+    from watchdog.events import FileSystemEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Optional, fall back to polling
+    Observer = None  # type: ignore[assignment, misc]
+    FileSystemEventHandler = object  # type: ignore[assignment, misc]
+
+
+class DocDirEventHandler(FileSystemEventHandler):
+    """Applies the changes to document files as they are notified."""
+
+    def __init__(self, store: "LocalFilesystemDocStore"):
+        super().__init__()
+        self.store = store
+
+    def on_any_event(self, event: "FileSystemEvent") -> None:
+        if event.is_directory:
+            return
+
+        # A move touches both its source and its destination
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        file_names = {os.path.basename(os.fsdecode(path)) for path in paths if path}
+        file_names = {name for name in file_names if is_doc_file_name(name)}
+        if not file_names:
+            return
+
+        try:
+            self.store.apply_file_changes(file_names)
+        except Exception as e:
+            LOGGER.error(f"Failed to apply changes to {file_names} in {self.store.doc_dir}: {e}")
+
+
+class DocDirWatcher:
+    """
+    Keeps a LocalFilesystemDocStore in sync with its directory.
+
+    Args:
+        store: The store to keep up to date
+        poll_interval_seconds: Refresh interval when polling
+        use_notifications: Use filesystem notifications if watchdog is installed
+    """
+
+    def __init__(
+        self,
+        store: "LocalFilesystemDocStore",
+        poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS,
+        use_notifications: bool = True,
+    ):
+        self.store = store
+        self.poll_interval_seconds = poll_interval_seconds
+        self.pushes_changes = use_notifications and Observer is not None
+        self._observer: Optional["BaseObserver"] = None
+        self._poll_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self) -> None:
+        if self.pushes_changes:
+            self._observer = Observer()
+            self._observer.schedule(DocDirEventHandler(self.store), str(self.store.doc_dir), recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+            LOGGER.info(f"Watching {self.store.doc_dir} for changes")
+        else:
+            self._stop_event.clear()
+            self._poll_thread = threading.Thread(target=self._poll, name=f"poll-{self.store.namespace}", daemon=True)
+            self._poll_thread.start()
+            LOGGER.info(f"Polling {self.store.doc_dir} for changes every {self.poll_interval_seconds}s")
+
+    def _poll(self) -> None:
+        while not self._stop_event.wait(self.poll_interval_seconds):
+            try:
+                self.store.refresh()
+            except Exception as e:
+                LOGGER.error(f"Failed to refresh {self.store.doc_dir}: {e}")
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._poll_thread is not None:
+            self._stop_event.set()
+            self._poll_thread.join()
+            self._poll_thread = None
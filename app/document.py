@@ -1,15 +1,79 @@
+import functools
 import itertools
 import json
+import os
+import threading
+import zlib
 from abc import ABCMeta, abstractmethod
-from dataclasses import dataclass, field
-from datetime import datetime
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
 
+from .atomic_io import atomic_write_text, fsync_dir, write_files_atomically
 from .constants import FilePaths
+from .content_cache import (
+    DEFAULT_CONTENT_CACHE_BYTES,
+    DEFAULT_WARM_CACHE_BYTES,
+    ContentLRU,
+)
 from .custom_logging import LOGGER
-
-DOC_FILE_EXT = '.json'
+from .doc_codec import (
+    DOC_FILE_EXT,
+    DOC_FILE_EXTS,
+    JSON_FORMAT,
+    DocFormat,
+    decode_record,
+    encode_record,
+    is_doc_file_name,
+    read_record_file,
+    sniff_format,
+)
+from .locks import ReadWriteLock
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .doc_duplicates import DuplicateDetector
+    from .doc_facets import FacetFilter, FacetIndex
+    from .doc_listing import DocPage, PageCursor, SortedKeyIndex
+    from .doc_query import DocQuery, QueryCache, QueryHit
+    from .doc_search import SearchIndex
+    from .doc_stats import NamespaceStats, StoreStats
+    from .doc_timeline import TimelineBucket
+    from .doc_wal import DocWAL, WALCompactor
+    from .doc_watcher import DocDirWatcher
+    from .embedding import Embedder
+    from .vector_index import Passage, VectorIndex
+
+# Per-directory index of document metadata, used by lazy LocalFilesystemDocStores
+METADATA_INDEX_FN = '_metadata.index'
+
+# Directory of the write-ahead log, inside a LocalFilesystemDocStore's directory
+WAL_DIR_NAME = '_wal'
+
+# How often a watched store directory is scanned when notifications are unavailable
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+
+# Documents rewritten per atomic batch by convert_format()
+CONVERSION_BATCH_SIZE = 1000
+
+# Full-text search index, inside a LocalFilesystemDocStore's directory
+SEARCH_INDEX_FN = '_search.index'
+
+# Namespace statistics, inside a LocalFilesystemDocStore's directory
+STATS_FN = '_stats.index'
+
+# Directory of the vector index, inside a LocalFilesystemDocStore's directory
+VECTOR_INDEX_DIR_NAME = '_vectors'
+
+# Highest document ID handed out, inside a LocalFilesystemDocStore's directory, so IDs survive restarts
+DOC_ID_COUNTER_FN = '_doc_ids.index'
+
+FileStat = tuple[int, int]  # (mtime_ns, size)
+FileChange = tuple[Optional[FileStat], Optional["Doc"]]  # (None, None) for a deleted file
 
 
 def serialize_datetime(
@@ -50,32 +114,94 @@ class Doc:
     def fn(self) -> str:
         return str(self.doc_id) + DOC_FILE_EXT
 
+    @property
+    def version(self) -> str:
+        """
+        Identifies this version of the document, for indexes to tell what changed.
+
+        Changes with its updated_at, and with its content, name, tags and
+        citations even when they are edited on disk without touching it.
+        """
+        metadata = '\x00'.join([self.name, *self.tags, '\x01', *self.citations])
+        return f"{serialize_datetime(self.updated_at)}/{self.content_checksum():08x}/{zlib.crc32(metadata.encode('utf-8')):08x}"
+
+    def content_checksum(self) -> int:
+        """CRC-32 of the content, computed once per content string."""
+        content = self.content
+        cached = self.__dict__.get('_content_checksum_cache')
+        if cached is None or cached[0] is not content:
+            cached = self.__dict__['_content_checksum_cache'] = (content, zlib.crc32(content.encode('utf-8')))
+        return cached[1]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_record(self) -> dict:
+        """
+        Serializable dict of the document.
+
+        Much cheaper than to_dict() with DocEncoder: nothing is deep-copied and
+        datetimes are converted directly. Keep in sync with the fields above.
+        """
+        return {
+            'name': self.name,
+            'content': self.content,
+            'doc_id': self.doc_id,
+            'created_at': serialize_datetime(self.created_at),
+            'updated_at': serialize_datetime(self.updated_at),
+            'namespace': self.namespace,
+            'tags': self.tags,
+            'citations': self.citations,
+            'edit_log': self.edit_log,
+        }
+
+    def to_metadata_dict(self) -> dict:
+        """Everything but the content, without loading it."""
+        return {
+            f.name: getattr(self, f.name)
+            for f in fields(Doc)
+            if f.name != 'content'
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_record())
+
     def save(self, outdir: Path) -> None:
         path_out = outdir / self.fn
-        with open(path_out, 'w') as file:
-            print(f"Saving document to {path_out}")
-            json.dump(self.__dict__, file, cls=DocEncoder)
+        print(f"Saving document to {path_out}")
+        atomic_write_text(path_out, self.to_json())
 
     @staticmethod
-    def from_dict(kwargs: dict) -> "Doc":
-
-        def cast_key(k: str, f: Callable) -> Any:
-            kwargs[k] = f(kwargs[k])
+    def cast_fields(kwargs: dict) -> dict:
+        """Cast serialized field values back to their types, in place."""
+        for key, caster in FIELD_CASTERS:
+            if key in kwargs:
+                kwargs[key] = caster(kwargs[key])
+        return kwargs
 
-        for key, f in Doc.__dataclass_fields__.items():
-            if f.type == DocID:
-                cast_key(key, int)
-            elif f.type == int:
-                cast_key(key, int)
-            elif f.type == datetime:
-                cast_key(key, datetime.fromisoformat)
+    @staticmethod
+    def from_dict(kwargs: dict) -> "Doc":
+        return Doc(**Doc.cast_fields(kwargs))
 
-        return Doc(**kwargs)
+    @staticmethod
+    def from_record(record: dict) -> "Doc":
+        """The reverse of to_record(), without the generic field casting of from_dict()."""
+        return Doc(
+            name=record['name'],
+            content=record['content'],
+            doc_id=int(record['doc_id']),
+            created_at=datetime.fromisoformat(record['created_at']),
+            updated_at=datetime.fromisoformat(record['updated_at']),
+            namespace=record.get('namespace', 'default'),
+            tags=record.get('tags', []),
+            citations=record.get('citations', []),
+            edit_log=record.get('edit_log', []),
+        )
 
     @staticmethod
     def load_from_path(path: Path) -> "Doc":
-        if DOC_FILE_EXT in path.name:
-            return Doc.from_dict(json.load(open(path)))
+        if is_doc_file_name(path.name):
+            return Doc.from_record(read_record_file(path))
         raise ValueError(f"Invalid file extension: {path.name}")
 
     def __str__(self) -> str:
@@ -85,7 +211,97 @@ class Doc:
         return self.__str__()
 
 
-DOCMAP_LIMIT = 100  # Maximum doc count supported in a single map
+def _field_caster(field_type: Any) -> Optional[Callable]:
+    if field_type in (DocID, int):
+        return int
+    if field_type == datetime:
+        return datetime.fromisoformat
+    return None
+
+
+# (field name, caster) of the Doc fields that need casting when deserialized, worked out once
+FIELD_CASTERS: list[tuple[str, Callable]] = [
+    (f.name, caster)
+    for f in fields(Doc)
+    if (caster := _field_caster(f.type)) is not None
+]
+
+
+ContentLoader = Callable[[], str]
+
+
+class LazyDoc(Doc):
+    """
+    A document whose content is only fetched from its store on first access.
+
+    Loaded content is kept in the store's ContentLRU rather than on the object,
+    so the cache budget bounds memory no matter how many documents are listed.
+    Content assigned directly, e.g. by an edit, stays on the object until the
+    store saves it, see release_content().
+    """
+
+    def __init__(
+        self,
+        content_loader: ContentLoader,
+        content_cache: ContentLRU,
+        content_checksum: Optional[int] = None,
+        **metadata,
+    ):
+        self._content_loader = content_loader
+        self._content_cache = content_cache
+        self._content: Optional[str] = None
+        # Of the content in the store, known without loading it
+        self._content_checksum = content_checksum
+        super().__init__(content=None, **metadata)  # type: ignore[arg-type]
+
+    @property  # type: ignore[override]
+    def content(self) -> str:
+        if self._content is not None:
+            return self._content
+
+        content = self._content_cache.get(self.doc_id)
+        if content is None:
+            content = self._content_loader()
+            self._content_cache.put(self.doc_id, content)
+        return content
+
+    @content.setter
+    def content(self, value: Optional[str]) -> None:
+        # The dataclass __init__ passes None, which leaves the content unloaded
+        if value is None:
+            return
+        self._content = value
+        self._content_cache.invalidate(self.doc_id)
+
+    @property
+    def is_content_loaded(self) -> bool:
+        return self._content is not None or self.doc_id in self._content_cache
+
+    def content_checksum(self) -> int:
+        if self._content is None and self._content_checksum is not None:
+            return self._content_checksum
+        return super().content_checksum()
+
+    def release_content(self, saved_content: str) -> None:
+        """Move content assigned to the document to the cache, once the store saved it, unless edited since."""
+        if self._content is not None and self._content is saved_content:
+            self._content_checksum = super().content_checksum()
+            self._content_cache.put(self.doc_id, saved_content)
+            self._content = None
+
+    @staticmethod
+    def from_metadata(
+        metadata: dict,
+        content_loader: ContentLoader,
+        content_cache: ContentLRU,
+        content_checksum: Optional[int] = None,
+    ) -> "LazyDoc":
+        return LazyDoc(
+            content_loader=content_loader,
+            content_cache=content_cache,
+            content_checksum=metadata.pop('content_checksum', content_checksum),
+            **Doc.cast_fields(metadata),
+        )
 
 
 class DocMapOverflowException(Exception):
@@ -94,22 +310,35 @@ class DocMapOverflowException(Exception):
     """
 
 
-class DocMap(dict[DocID, Doc]):
+class BaseDocMap(MutableMapping[DocID, Doc]):
+    """
+    Interface shared by the document maps (Document ID -> Document).
+
+    New IDs come from a monotonic counter, so allocating one is O(1) and IDs of
+    deleted documents are never handed out again.
+    """
+
+    max_docs: Optional[int] = None  # Optional cap on the doc count, unlimited by default
+
+    @abstractmethod
+    def next_doc_id(self) -> DocID:
+        """Allocate a new, unused document ID."""
+        ...
 
     def _add(self, doc: Doc):
         if doc.doc_id is None:
             LOGGER.info(f"Generating id for doc {doc.name}")
-            doc.doc_id = max(self.keys()) + 1
+            doc.doc_id = self.next_doc_id()
 
         self[doc.doc_id] = doc
 
     def add(self, doc: Doc):
         """
         Add a document to the map. If the document already exists, raise an error.
-        If the document is too large, raise an error.
+        If the map is full, raise an error.
         """
 
-        if len(self) >= DOCMAP_LIMIT:
+        if self.max_docs is not None and len(self) >= self.max_docs:
             raise DocMapOverflowException
 
         if doc.doc_id is not None and doc.doc_id in self:
@@ -122,8 +351,41 @@ class DocMap(dict[DocID, Doc]):
 
         self.pop(doc_id)
 
-    def total_size(self) -> int:
-        raise NotImplementedError
+
+class DocMap(dict[DocID, Doc], BaseDocMap):
+    """
+    In-memory document map, the default for small namespaces.
+    """
+
+    def __init__(self, docs: Optional[dict[DocID, Doc]] = None, max_docs: Optional[int] = None):
+        super().__init__()
+        self.max_docs = max_docs
+        self._last_doc_id: DocID = 0
+        if docs:
+            self.update(docs)
+
+    def __setitem__(self, doc_id: DocID, doc: Doc) -> None:
+        super().__setitem__(doc_id, doc)
+        if doc_id > self._last_doc_id:
+            self._last_doc_id = doc_id
+
+    def update(self, *args, **kwargs) -> None:  # type: ignore[override]
+        # dict.update bypasses __setitem__, route it through so the counter stays current
+        for doc_id, doc in dict(*args, **kwargs).items():
+            self[doc_id] = doc
+
+    def next_doc_id(self) -> DocID:
+        self._last_doc_id += 1
+        return self._last_doc_id
+
+    @property
+    def last_doc_id(self) -> DocID:
+        """The highest ID handed out or put in the map so far."""
+        return self._last_doc_id
+
+    def advance_doc_id(self, doc_id: DocID) -> None:
+        """Never hand out IDs up to doc_id, e.g. those of documents deleted before a restart."""
+        self._last_doc_id = max(self._last_doc_id, doc_id)
 
 
 NAME_CONTENT_SAMPLES = [
@@ -164,40 +426,594 @@ def generate_docs(
 DocStoreNamespace = str
 
 
+class DocStoreObserver(metaclass=ABCMeta):
+    """
+    Follows the changes to a DocStore's documents, e.g. to keep an index of them.
+
+    Called with the store's write lock held, so changes arrive in order and
+    observers must not call back into the store to change it.
+    """
+
+    def on_attached(self, docs: list[Doc]) -> None:
+        """Called once with every document of the store, when added to it."""
+        self.on_docs_loaded(docs)
+
+    @abstractmethod
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        """Documents added or changed through the store."""
+        ...
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        """Documents (re)loaded from the store's storage, possibly unchanged since last seen."""
+        self.on_docs_put(docs)
+
+    @abstractmethod
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        """Documents deleted, through the store or from its storage."""
+        ...
+
+    def on_store_saved(self) -> None:
+        """Called after the store saved its changes, with the read lock held."""
+        pass
+
+
 class DocStore(metaclass=ABCMeta):
+    """
+    A namespace of documents.
+
+    Each store has its own maps, guarded by a reader-writer lock: any number of
+    sessions can read at once, and writes wait for them and each other. Use
+    batch() to make several changes atomically.
+
+    Documents added, updated or deleted through the store are tracked, and
+    save_all_to_remote() only writes those. With a write-ahead log enabled,
+    these changes are also durable within milliseconds, before any save.
+
+    Observers added with add_observer() are told of every change, which is how
+    the search, facet and vector indexes keep up, see enable_search_index(),
+    enable_facets() and enable_vector_index(). query() combines them, and
+    list_page() pages through the documents in sorted order. stats() reads
+    running totals of them.
+
+    Every change also bumps version, so results computed from the documents
+    can be cached under it.
+    """
 
     namespace: DocStoreNamespace
-    doc_map: DocMap = DocMap()  # Document ID -> Document
-    file_map: dict[str, Doc] = {}  # File name -> Document
+    doc_map: BaseDocMap  # Document ID -> Document
+    file_map: dict[str, Doc]  # File name -> Document
+    lock: ReadWriteLock
+    version: int  # Bumped by every change to the documents
 
     def __init__(self, namespace: DocStoreNamespace) -> None:
         assert namespace
         self.namespace = namespace
+        self.doc_map = DocMap()
+        self.file_map = {}
+        self.lock = ReadWriteLock()
+        self._dirty: set[DocID] = set()  # Changed since the last save
+        self._deleted: dict[DocID, list[str]] = {}  # Deleted since the last save -> their file names
+        self.wal: Optional["DocWAL"] = None
+        self.wal_compactor: Optional["WALCompactor"] = None
+        self.observers: list[DocStoreObserver] = []
+        self.search_index: Optional["SearchIndex"] = None
+        self.facet_index: Optional["FacetIndex"] = None
+        self.sorted_index: Optional["SortedKeyIndex"] = None
+        self.namespace_stats: Optional["NamespaceStats"] = None
+        self.vector_index: Optional["VectorIndex"] = None
+        self.duplicate_detector: Optional["DuplicateDetector"] = None
+        self.version = 0
+        self._query_cache: Optional["QueryCache"] = None
 
     @abstractmethod
-    def _get_doc_map_from_store(self) -> DocMap:
+    def _get_doc_map_from_store(self) -> BaseDocMap:
         ...
 
     @abstractmethod
     def save_document(self, doc: Doc):
         ...
 
+    @contextmanager
+    def batch(self) -> Iterator["DocStore"]:
+        """
+        Hold the write lock for a group of changes.
+
+        Readers see either none or all of the changes made inside the block.
+        """
+        with self.lock.write():
+            yield self
+
     def refresh(self) -> None:
         doc_map_remote = self._get_doc_map_from_store()
-        self.doc_map.update(doc_map_remote)
+        with self.lock.write():
+            self.doc_map.update(doc_map_remote)
+            self._notify_loaded(list(doc_map_remote.values()))
 
-    def save_all_to_remote(self) -> None:
-        for doc in self.doc_map.values():
+    def save_documents(self, docs: Iterable[Doc]) -> None:
+        for doc in docs:
             self.save_document(doc=doc)
 
-    def get_doc_map(self, refresh=False) -> DocMap:
+    def _remove_from_remote(self, deleted: dict[DocID, list[str]]) -> None:
+        """Remove deleted documents from the remote, for stores that can."""
+        pass
+
+    def _mark_dirty(self, doc_id: DocID) -> None:
+        self._dirty.add(doc_id)
+        if self.wal is not None:
+            self.wal.log_put(self.doc_map[doc_id])
+
+    def add_observer(self, observer: DocStoreObserver) -> None:
+        """Have an observer follow the changes to the documents, starting with the current ones."""
+        with self.lock.write():
+            observer.on_attached(list(self.doc_map.values()))
+            self.observers.append(observer)
+
+    def remove_observer(self, observer: DocStoreObserver) -> None:
+        with self.lock.write():
+            self.observers.remove(observer)
+
+    def _notify_put(self, docs: list[Doc]) -> None:
+        self.version += 1
+        for observer in self.observers:
+            observer.on_docs_put(docs)
+
+    def _notify_loaded(self, docs: list[Doc]) -> None:
+        self.version += 1
+        for observer in self.observers:
+            observer.on_docs_loaded(docs)
+
+    def _notify_removed(self, doc_ids: list[DocID]) -> None:
+        self.version += 1
+        for observer in self.observers:
+            observer.on_docs_removed(doc_ids)
+
+    def _notify_saved(self) -> None:
+        with self.lock.read():
+            for observer in self.observers:
+                observer.on_store_saved()
+
+    def _mark_deleted(self, doc_id: DocID, file_names: list[str]) -> None:
+        self._dirty.discard(doc_id)
+        self._deleted[doc_id] = file_names
+        if self.wal is not None:
+            self.wal.log_delete(doc_id, file_names)
+
+    def enable_write_ahead_log(
+        self,
+        wal_dir: Path,
+        group_commit_interval_seconds: Optional[float] = None,
+        compact_interval_seconds: Optional[float] = None,
+    ) -> int:
+        """
+        Log every change to the store, and fold the log into it in the background.
+
+        Loads the store, then replays the changes a previous run logged but
+        did not get to save.
+
+        Args:
+            wal_dir: Directory of the log segments
+            group_commit_interval_seconds: How long to gather changes before each fsync of the log
+            compact_interval_seconds: Time between background saves of the store
+
+        Returns:
+            The number of changes replayed
+        """
+        # Imported here, the log module depends on this one
+        from .doc_wal import (
+            DEFAULT_COMPACT_INTERVAL_SECONDS,
+            DEFAULT_GROUP_COMMIT_INTERVAL_SECONDS,
+            DocWAL,
+            WALCompactor,
+            WALOps,
+        )
+
+        if self.wal is not None:
+            return 0
+
+        self.refresh()
+        wal = DocWAL(
+            wal_dir=wal_dir,
+            group_commit_interval_seconds=group_commit_interval_seconds or DEFAULT_GROUP_COMMIT_INTERVAL_SECONDS,
+        )
+
+        replayed = 0
+        with self.lock.write():
+            for record in wal.replay():
+                if record['op'] == WALOps.PUT:
+                    doc = Doc.from_record(record['doc'])
+                    assert doc.doc_id is not None, "Only stored documents are logged."
+                    self.doc_map[doc.doc_id] = doc
+                    self._dirty.add(doc.doc_id)
+                    self._notify_put([doc])
+                elif record['op'] == WALOps.DELETE:
+                    self.doc_map.pop(record['doc_id'], None)
+                    self._dirty.discard(record['doc_id'])
+                    self._deleted[record['doc_id']] = record['file_names']
+                    self._notify_removed([record['doc_id']])
+                replayed += 1
+            self.wal = wal
+        if replayed:
+            LOGGER.info(f"Replayed {replayed} logged changes into namespace {self.namespace}")
+
+        self.wal_compactor = WALCompactor(self, compact_interval_seconds or DEFAULT_COMPACT_INTERVAL_SECONDS)
+        self.wal_compactor.start()
+        return replayed
+
+    def disable_write_ahead_log(self) -> None:
+        """Stop logging changes, after saving the ones logged so far."""
+        if self.wal is None:
+            return
+        if self.wal_compactor is not None:
+            self.wal_compactor.stop()
+            self.wal_compactor = None
+        self.save_all_to_remote()
+        self.wal.close()
+        self.wal = None
+
+    def wait_for_durability(self, timeout: Optional[float] = None) -> bool:
+        """Block until every change so far is on disk, in the log or the store."""
+        if self.wal is None:
+            return not self.has_unsaved_changes
+        return self.wal.wait_for_commit(timeout=timeout)
+
+    def enable_search_index(self, index_path: Optional[Path] = None) -> "SearchIndex":
+        """
+        Index the documents for search(), and keep the index up to date.
+
+        With an index_path the index is saved there whenever the store is
+        saved, and loaded from it next time, so only documents changed since
+        are indexed again.
+        """
+        # Imported here, the search module depends on this one
+        from .doc_search import SearchIndex
+
+        if self.search_index is not None:
+            return self.search_index
+
+        self.refresh()
+        search_index = SearchIndex(doc_loader=self.get_document, index_path=index_path)
+        self.add_observer(search_index)
+        with self.lock.read():
+            search_index.persist()
+        self.search_index = search_index
+        return search_index
+
+    def enable_stats(self, stats_path: Optional[Path] = None) -> "NamespaceStats":
+        """
+        Keep running statistics of the documents, see stats().
+
+        With a stats_path the statistics are saved there whenever the store
+        is saved, and loaded from it next time, so only documents changed
+        since are measured again.
+        """
+        if self.namespace_stats is not None:
+            return self.namespace_stats
+
+        self.refresh()
+        namespace_stats = self._new_namespace_stats(stats_path)
+        self.add_observer(namespace_stats)
+        with self.lock.read():
+            namespace_stats.persist()
+        self.namespace_stats = namespace_stats
+        return namespace_stats
+
+    def _new_namespace_stats(self, stats_path: Optional[Path]) -> "NamespaceStats":
+        # Imported here, the stats module depends on this one
+        from .doc_stats import NamespaceStats
+
+        return NamespaceStats(stats_path=stats_path)
+
+    def stats(self) -> "StoreStats":
+        """
+        Get the document count, content bytes, token estimate, tag counts and last change time.
+
+        Read from running totals, without scanning the documents. The first
+        call enables them.
+        """
+        namespace_stats = self.enable_stats()
+        with self.lock.read():
+            return namespace_stats.snapshot()
+
+    def search(self, query: str, limit: int = 10) -> list[Doc]:
+        """
+        Full-text search of the documents' names and content, best match first.
+
+        Words match in any order, "quoted phrases" only match as a whole and
+        prefix* matches every word starting with the prefix. The first search
+        enables the search index if it is not yet.
+        """
+        search_index = self.search_index
+        if search_index is None:
+            search_index = self.enable_search_index()
+        with self.lock.read():
+            results = search_index.search(query, limit=limit)
+            return [self.doc_map[doc_id] for doc_id, _ in results if doc_id in self.doc_map]
+
+    def enable_vector_index(
+        self,
+        embedder: Optional["Embedder"] = None,
+        approximate: bool = False,
+        index_dir: Optional[Path] = None,
+        quantization: Optional[str] = None,
+    ) -> "VectorIndex":
+        """
+        Embed the passages of the documents for search_passages(), and keep them up to date.
+
+        Args:
+            embedder: Defaults to a local HashingEmbedder
+            approximate: Search only the nearest clusters of passages in large stores
+            index_dir: Directory to memory-map the index from, saved along with the store
+            quantization: "int8" or "pq" to search compact copies of the vectors, see vector_storage
+        """
+        # Imported here, the vector index module depends on this one
+        from .vector_index import VectorIndex
+        from .vector_storage import Quantizations
+
+        if self.vector_index is None:
+            self.refresh()
+            vector_index = VectorIndex(
+                doc_loader=self.get_document,
+                embedder=embedder,
+                approximate=approximate,
+                index_dir=index_dir,
+                quantization=quantization or Quantizations.NONE,
+            )
+            self.add_observer(vector_index)
+            self.vector_index = vector_index
+        return self.vector_index
+
+    def search_passages(self, query: str, limit: int = 5) -> list["Passage"]:
+        """
+        Find the passages of the documents most similar in meaning to a query.
+
+        Documents changed since the last search are embedded first, outside the
+        store's lock. The first search enables the vector index if it is not yet.
+        """
+        return self.enable_vector_index().search(query, limit=limit)
+
+    def enable_facets(self) -> "FacetIndex":
+        """Index the documents by tag and citation, and keep the index up to date."""
+        # Imported here, the facets module depends on this one
+        from .doc_facets import FacetIndex
+
+        if self.facet_index is None:
+            self.refresh()
+            facet_index = FacetIndex()
+            self.add_observer(facet_index)
+            self.facet_index = facet_index
+        return self.facet_index
+
+    def filter_documents(self, filters: Iterable["FacetFilter"] = ()) -> list[Doc]:
+        """
+        Get the documents passing every filter, in ID order.
+
+        E.g. FacetFilter(all_of=("a",), none_of=("b",)) for the documents
+        tagged "a" but not "b". The first call enables the facet index.
+        """
+        from .doc_facets import ids_from_bits
+
+        facet_index = self.enable_facets()
+        with self.lock.read():
+            doc_ids = ids_from_bits(facet_index.filter(filters))
+            return [self.doc_map[doc_id] for doc_id in doc_ids if doc_id in self.doc_map]
+
+    def get_documents_by_tag(self, tag: str) -> list[Doc]:
+        """Get the documents tagged with a tag, in ID order."""
+        from .doc_facets import FacetFilter
+
+        return self.filter_documents([FacetFilter(all_of=(tag,))])
+
+    def enable_sorted_listing(self) -> "SortedKeyIndex":
+        """Keep the documents sorted by each field of SortFields, for list_page()."""
+        # Imported here, the listing module depends on this one
+        from .doc_listing import SortedKeyIndex
+
+        if self.sorted_index is None:
+            self.refresh()
+            sorted_index = SortedKeyIndex()
+            self.add_observer(sorted_index)
+            self.sorted_index = sorted_index
+        return self.sorted_index
+
+    def list_page(
+        self,
+        sort_by: str = 'updated_at',
+        descending: bool = False,
+        limit: int = 50,
+        cursor: Optional["PageCursor"] = None,
+        filters: Iterable["FacetFilter"] = (),
+    ) -> "DocPage":
+        """
+        Get a page of the documents, sorted by "updated_at", "created_at" or "name".
+
+        Pass a page's next_cursor for the next page, which costs O(log n + limit)
+        however deep it is. Documents failing the filters are skipped, so a
+        rarely matching filter scans further. The first call enables the
+        sorted index.
+
+        Args:
+            sort_by: See SortFields, ties are broken by document ID
+            descending: Latest or last name first
+            limit: Documents per page
+            cursor: Where the previous page ended, its sort order overrides sort_by and descending
+            filters: As for filter_documents()
+        """
+        from .doc_listing import list_page
+
+        return list_page(self, sort_by=sort_by, descending=descending, limit=limit, cursor=cursor, filters=filters)
+
+    def documents_between(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        field: str = 'updated_at',
+        limit: Optional[int] = None,
+        latest_first: bool = False,
+    ) -> list[Doc]:
+        """
+        Get the documents created or updated in [start, end), in time order.
+
+        Found by binary search in the sorted index, O(log n + matches). E.g.
+        documents_between(start=datetime.now() - timedelta(days=7), field="created_at")
+        for what was added in the last week.
+
+        Args:
+            start: Earliest time, unbounded if None
+            end: Time after the latest, unbounded if None
+            field: "created_at" or "updated_at"
+            limit: At most this many, the latest ones with latest_first, the earliest ones otherwise
+            latest_first: Latest first
+        """
+        from .doc_timeline import documents_between
+
+        return documents_between(self, field=field, start=start, end=end, limit=limit, latest_first=latest_first)
+
+    def most_recent(self, count: int, field: str = 'updated_at') -> list[Doc]:
+        """Get the last count documents created or updated, latest first, in O(log n + count)."""
+        return self.documents_between(field=field, limit=count, latest_first=True)
+
+    def timeline(
+        self,
+        start: datetime,
+        end: datetime,
+        bucket: timedelta,
+        field: str = 'updated_at',
+    ) -> list["TimelineBucket"]:
+        """
+        Count the documents created or updated in each bucket of [start, end), for timeline views.
+
+        Each bucket costs a binary search, not a scan of its documents.
+
+        Args:
+            start: Start of the first bucket
+            end: End of the last bucket, which is shorter if the range is not a whole number of buckets
+            bucket: Width of the buckets
+            field: "created_at" or "updated_at"
+        """
+        from .doc_timeline import timeline
+
+        return timeline(self, start=start, end=end, bucket=bucket, field=field)
+
+    def facet_counts(self, facet: str = 'tags', filters: Iterable["FacetFilter"] = ()) -> dict[str, int]:
+        """
+        Count the documents passing the filters by each value of a facet, "tags" or "citations".
+
+        Returns:
+            Value -> count, most common first
+        """
+        filters = list(filters)
+        facet_index = self.enable_facets()
+        with self.lock.read():
+            return facet_index.counts(facet, within=facet_index.filter(filters) if filters else None)
+
+    def query(self, query: "DocQuery | str") -> list["QueryHit"]:
+        """
+        Hybrid search: full-text and semantic results merged by reciprocal rank fusion.
+
+        Both searches run concurrently, on the documents passing the query's
+        filters only. Results are cached until the store changes. The first
+        query enables the indexes it needs.
+        """
+        # Imported here, the query module depends on this one
+        from .doc_query import DocQuery, QueryCache, run_query
+
+        if isinstance(query, str):
+            query = DocQuery(text=query)
+        if self._query_cache is None:
+            self._query_cache = QueryCache()
+        return run_query([self], query, self._query_cache)
+
+    def enable_duplicate_detection(
+        self,
+        threshold: Optional[float] = None,
+        policy: Optional[str] = None,
+    ) -> "DuplicateDetector":
+        """
+        Have add_document() check new content for near duplicates of the documents.
+
+        Args:
+            threshold: Estimated share of word shingles in common from which documents are near duplicates, 0.9 by default
+            policy: "merge" to return the existing document instead of adding one, the default, or "flag" to add
+                it tagged "near-duplicate", see DuplicatePolicies
+        """
+        # Imported here, the duplicates module depends on this one
+        from .doc_duplicates import (
+            DEFAULT_SIMILARITY_THRESHOLD,
+            DuplicateDetector,
+            DuplicatePolicies,
+        )
+
+        if self.duplicate_detector is None:
+            self.refresh()
+            duplicate_detector = DuplicateDetector(
+                threshold=threshold or DEFAULT_SIMILARITY_THRESHOLD,
+                policy=policy or DuplicatePolicies.MERGE,
+            )
+            self.add_observer(duplicate_detector)
+            self.duplicate_detector = duplicate_detector
+        return self.duplicate_detector
+
+    def mark_dirty(self, doc_id: DocID) -> None:
+        """Have the next save write a document that was changed in place."""
+        with self.lock.write():
+            self._mark_dirty(doc_id)
+            self._notify_put([self.doc_map[doc_id]])
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return bool(self._dirty or self._deleted)
+
+    def save_all_to_remote(self) -> None:
+        """Write the documents changed since the last save, and remove the deleted ones."""
+        with self.lock.write():
+            dirty, self._dirty = self._dirty, set()
+            deleted, self._deleted = self._deleted, {}
+            docs = [self.doc_map[doc_id] for doc_id in dirty if doc_id in self.doc_map]
+            # Changes from here on go to a new log segment, the sealed ones are dropped once saved
+            sealed_segment_id = self.wal.rotate() if self.wal is not None else None
+
+        try:
+            # Removed first, a deleted ID may have been reused by a document saved below
+            self._remove_from_remote(deleted)
+            self.save_documents(docs)
+        except Exception:
+            # Still unsaved, keep them for the next attempt
+            with self.lock.write():
+                self._dirty |= dirty
+                for doc_id, file_names in deleted.items():
+                    self._deleted.setdefault(doc_id, file_names)
+            raise
+
+        if sealed_segment_id is not None and self.wal is not None:
+            self.wal.drop_segments_through(sealed_segment_id)
+        if docs or deleted:
+            LOGGER.info(f"Saved {len(docs)} and removed {len(deleted)} documents in namespace {self.namespace}")
+        self._notify_saved()
+
+    def get_doc_map(self, refresh=False) -> BaseDocMap:
+        """
+        Get the live doc map.
+
+        Iterating it while other threads write is unsafe, use list_documents() instead.
+        """
         if refresh:
-            self.doc_map = self._get_doc_map_from_store()
+            doc_map = self._get_doc_map_from_store()
+            with self.lock.write():
+                removed = [doc_id for doc_id in self.doc_map if doc_id not in doc_map]
+                self.doc_map = doc_map
+                self._notify_removed(removed)
+                self._notify_loaded(list(doc_map.values()))
         return self.doc_map
 
+    def list_documents(self) -> list[Doc]:
+        """Get a consistent snapshot of the documents."""
+        with self.lock.read():
+            return list(self.doc_map.values())
+
     def get_document(self, doc_id: DocID) -> Optional[Doc]:
         """Get a document by ID."""
-        return self.doc_map.get(doc_id)
+        with self.lock.read():
+            return self.doc_map.get(doc_id)
 
     def add_document(
         self,
@@ -206,36 +1022,173 @@ class DocStore(metaclass=ABCMeta):
         doc_id: Optional[DocID] = None,
         file_name: Optional[str] = None,
     ) -> Doc:
-        """Add a new document."""
+        """
+        Add a new document.
 
-        if file_name:
-            if file_name in self.file_map:
-                LOGGER.info(f"File name {file_name} already exists, returning existing document")
-                return self.file_map[file_name]
+        With duplicate detection enabled, content nearly the same as a document's
+        returns that document instead, or is added flagged, see
+        enable_duplicate_detection().
+        """
+        # Computed before taking the lock, only the lookup needs it
+        signature = self._signature(content)
 
-        if doc_id is None:
-            doc_id = max(self.doc_map.keys(), default=0) + 1
-        if doc_id in self.doc_map:
-            LOGGER.info(f"Document {doc_id} already exists, returning existing document")
-            return self.doc_map[doc_id]
+        with self.lock.write():
+            if file_name:
+                if file_name in self.file_map:
+                    LOGGER.info(f"File name {file_name} already exists, returning existing document")
+                    return self.file_map[file_name]
+
+            new_doc, is_new = self._put_new_document(name, content, doc_id, signature)
+            if is_new:
+                self._notify_put([new_doc])
+                if file_name:
+                    self.file_map[file_name] = new_doc
 
-        new_doc = Doc(
+        return new_doc
+
+    def add_documents(
+        self,
+        names_and_contents: Iterable[tuple[str, str]],
+        signatures: Optional[list[Optional["np.ndarray"]]] = None,
+    ) -> list[Doc]:
+        """
+        Add new documents at once, under a single write lock.
+
+        Observers are told of the whole batch in one call, so the indexes are
+        updated once per batch rather than once per document. Near duplicates,
+        within the batch too, are handled as by add_document().
+
+        Args:
+            names_and_contents: (name, content) of the documents
+            signatures: Of the contents, from the duplicate detector, if computed already, e.g. on other threads
+
+        Returns:
+            The documents, in order, the existing one for a merged near duplicate
+        """
+        names_and_contents = list(names_and_contents)
+        if signatures is None:
+            signatures = [self._signature(content) for _, content in names_and_contents]
+
+        docs = []
+        new_docs = []
+        with self.lock.write():
+            for (name, content), signature in zip(names_and_contents, signatures):
+                doc, is_new = self._put_new_document(name, content, None, signature)
+                docs.append(doc)
+                if is_new:
+                    new_docs.append(doc)
+            if new_docs:
+                self._notify_put(new_docs)
+        return docs
+
+    def _signature(self, content: str) -> Optional["np.ndarray"]:
+        duplicate_detector = self.duplicate_detector
+        return duplicate_detector.signature(content) if duplicate_detector is not None else None
+
+    def _new_doc(self, doc_id: DocID, name: str, content: str) -> Doc:
+        """A new document of this store, before it is put in the map."""
+        return Doc(
             doc_id=doc_id,
             name=name,
             content=content,
         )
-        self.doc_map.add(doc=new_doc)
 
-        if file_name:
-            self.file_map[file_name] = new_doc
+    def _put_new_document(
+        self,
+        name: str,
+        content: str,
+        doc_id: Optional[DocID],
+        signature: Optional["np.ndarray"],
+    ) -> tuple[Doc, bool]:
+        """
+        Put a new document in the map, without telling the observers, with the write lock held.
 
-        return new_doc
+        Returns:
+            The document, and whether it is new, rather than an existing one
+        """
+        if doc_id is None:
+            doc_id = self.doc_map.next_doc_id()
+        if doc_id in self.doc_map:
+            LOGGER.info(f"Document {doc_id} already exists, returning existing document")
+            return self.doc_map[doc_id], False
+
+        duplicate_detector = self.duplicate_detector
+        original = None
+        if duplicate_detector is not None:
+            original = duplicate_detector.find_original(signature)
+            if original is not None and duplicate_detector.merges and original[0] in self.doc_map:
+                LOGGER.info(
+                    f"Document {name} is a near duplicate of document {original[0]}, returning existing document"
+                )
+                return self.doc_map[original[0]], False
+
+        new_doc = self._new_doc(doc_id, name, content)
+        if duplicate_detector is not None:
+            if original is not None:
+                duplicate_detector.flag(new_doc, original)
+            else:
+                # Indexed now so later documents of the same batch match it
+                duplicate_detector.remember(doc_id, signature)
+        self.doc_map.add(doc=new_doc)
+        self._mark_dirty(doc_id)
+        return new_doc, True
+
+    def update_document(
+        self,
+        doc_id: DocID,
+        name: Optional[str] = None,
+        content: Optional[str] = None,
+        tags: Optional[list[str]] = None,
+        citations: Optional[list[str]] = None,
+        edit_note: Optional[str] = None,
+    ) -> Optional[Doc]:
+        """
+        Change the given fields of a document, and mark it for the next save.
+
+        Args:
+            doc_id: The document to change
+            name: New name
+            content: New content
+            tags: New tags
+            citations: New citations
+            edit_note: Appended to the edit log
+
+        Returns:
+            The updated document, or None if there is no such document
+        """
+        with self.lock.write():
+            doc = self.doc_map.get(doc_id)
+            if doc is None:
+                return None
+
+            if name is not None:
+                doc.name = name
+            if content is not None:
+                doc.content = content
+            if tags is not None:
+                doc.tags = tags
+            if citations is not None:
+                doc.citations = citations
+            if edit_note:
+                doc.edit_log.append(edit_note)
+            doc.updated_at = datetime.now()
+
+            # Maps that hold encoded documents need the change written back
+            self.doc_map[doc_id] = doc
+            self._mark_dirty(doc_id)
+            self._notify_put([doc])
+        return doc
 
     def delete_document(self, doc_id: DocID) -> bool:
         try:
-            self.doc_map.delete(doc_id=doc_id)
-            if doc_id in self.file_map:
-                del self.file_map[doc_id]
+            with self.lock.write():
+                self.doc_map.delete(doc_id=doc_id)
+                # The file map is keyed by file name
+                file_names = [fn for fn, doc in self.file_map.items() if doc.doc_id == doc_id]
+                for file_name in file_names:
+                    del self.file_map[file_name]
+                self._mark_deleted(doc_id, file_names)
+                self._notify_removed([doc_id])
             LOGGER.info(f"Deleted document {doc_id} from doc map")
             return True
         except Exception as e:
@@ -243,59 +1196,486 @@ class DocStore(metaclass=ABCMeta):
             return False
 
 
+def read_doc_id_counter(path: Path) -> DocID:
+    """The highest ID a LocalFilesystemDocStore handed out, from its counter file, 0 if unknown."""
+    try:
+        with open(path) as file:
+            return json.load(file)['last_doc_id']
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        LOGGER.error(f"Document ID counter {path} failed to load, using the highest ID on disk: {e}")
+        return 0
+
+
 class LocalFilesystemDocStore(DocStore):
+    """
+    A store keeping one JSON file per document in a directory.
+
+    Refreshing is incremental: the mtime and size of every file are tracked,
+    and only new or changed files are parsed. Files deleted on disk are
+    removed from the map. start_watching() applies changes as they happen.
+
+    In lazy mode only a compact metadata record is kept per document, read from
+    a metadata index in the directory, and content is read from the document's
+    file on first access. Content then lives in content_cache, as strings up to
+    content_cache_bytes and compressed up to warm_cache_bytes more, so memory
+    stays bounded however large the namespace. New and edited content is moved
+    there too once saved.
+
+    With write_ahead_log, the store is loaded on creation and changes are
+    logged to a _wal directory next to the documents.
+
+    Documents are written in doc_format, plain JSON by default. Files of any
+    format are read, and convert_format() rewrites a store in place.
 
+    The search index, if enabled, is saved to a _search.index file next to
+    the documents, and the vector index to a _vectors directory.
+    """
+
+    doc_map: DocMap
     doc_dir: Path
 
-    def __init__(self, namespace: DocStoreNamespace, local_root_dir: Path):
+    def __init__(
+        self,
+        namespace: DocStoreNamespace,
+        local_root_dir: Path,
+        lazy: bool = False,
+        content_cache_bytes: int = DEFAULT_CONTENT_CACHE_BYTES,
+        warm_cache_bytes: int = DEFAULT_WARM_CACHE_BYTES,
+        write_ahead_log: bool = False,
+        group_commit_interval_seconds: Optional[float] = None,
+        compact_interval_seconds: Optional[float] = None,
+        doc_format: DocFormat = JSON_FORMAT,
+        search_index: bool = False,
+    ):
         self.doc_dir = local_root_dir / namespace
+        self.doc_format = doc_format
+        self.lazy = lazy
+        self.content_cache = ContentLRU(byte_budget=content_cache_bytes, warm_byte_budget=warm_cache_bytes)
+        self.file_stats: dict[str, FileStat] = {}  # File name -> stat when last loaded or saved
+        self.watcher: Optional["DocDirWatcher"] = None
+        self._metadata_index: Optional[dict[str, dict]] = None
+        self._metadata_index_changed = False
+        self._metadata_index_flush_lock = threading.Lock()
         super().__init__(namespace=namespace)
+        # IDs of documents deleted before a restart are not in the directory anymore, but are still never reused
+        self._saved_last_doc_id = read_doc_id_counter(self.doc_id_counter_path)
+        self._doc_id_counter_lock = threading.Lock()
+        self.doc_map.advance_doc_id(self._saved_last_doc_id)
+
+        if write_ahead_log:
+            self.enable_write_ahead_log(
+                wal_dir=self.doc_dir / WAL_DIR_NAME,
+                group_commit_interval_seconds=group_commit_interval_seconds,
+                compact_interval_seconds=compact_interval_seconds,
+            )
+        if search_index:
+            self.enable_search_index()
+
+    @property
+    def metadata_index_path(self) -> Path:
+        return self.doc_dir / METADATA_INDEX_FN
 
-    def _get_doc_map_from_store(self) -> DocMap:
-        for path in self.doc_dir.iterdir():
+    @property
+    def metadata_index(self) -> dict[str, dict]:
+        """File name -> {"mtime_ns", "size", "metadata"} of the documents seen so far."""
+        if self._metadata_index is None:
+            self._metadata_index = self._read_metadata_index()
+        return self._metadata_index
 
-            # If not a JSON file, skip
-            if DOC_FILE_EXT not in path.name:
-                LOGGER.debug(f"Skipping file {path} because it is not a JSON file")
-                continue
+    def enable_search_index(self, index_path: Optional[Path] = None) -> "SearchIndex":
+        return super().enable_search_index(index_path or self.doc_dir / SEARCH_INDEX_FN)
 
-            # Check if file is already in the map
-            if path.name in self.file_map:
-                LOGGER.debug(f"File {path} already exists in file map, skipping")
-                continue
+    def enable_stats(self, stats_path: Optional[Path] = None) -> "NamespaceStats":
+        return super().enable_stats(stats_path or self.doc_dir / STATS_FN)
 
-            try:
-                doc = Doc.load_from_path(path=path)
-                self.doc_map.add(doc=doc)
-                self.file_map[path.name] = doc
-                LOGGER.debug(f"Loaded document {doc} from path {path}")
-            except Exception as e:
-                LOGGER.error(f"Doc at path {path} failed to load: {e}")
+    def enable_vector_index(
+        self,
+        embedder: Optional["Embedder"] = None,
+        approximate: bool = False,
+        index_dir: Optional[Path] = None,
+        quantization: Optional[str] = None,
+    ) -> "VectorIndex":
+        return super().enable_vector_index(
+            embedder=embedder,
+            approximate=approximate,
+            index_dir=index_dir or self.doc_dir / VECTOR_INDEX_DIR_NAME,
+            quantization=quantization,
+        )
+
+    @property
+    def doc_id_counter_path(self) -> Path:
+        return self.doc_dir / DOC_ID_COUNTER_FN
+
+    def _save_doc_id_counter(self) -> None:
+        with self._doc_id_counter_lock:
+            with self.lock.read():
+                last_doc_id = self.doc_map.last_doc_id
+            if last_doc_id > self._saved_last_doc_id:
+                atomic_write_text(self.doc_id_counter_path, json.dumps({'last_doc_id': last_doc_id}))
+                self._saved_last_doc_id = last_doc_id
+
+    def save_all_to_remote(self) -> None:
+        # Saved first, so no ID reaches the disk before the counter covers it
+        self._save_doc_id_counter()
+        super().save_all_to_remote()
+
+    def _read_metadata_index(self) -> dict[str, dict]:
+        try:
+            with open(self.metadata_index_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            LOGGER.error(f"Metadata index {self.metadata_index_path} failed to load, rebuilding it: {e}")
+            return {}
+
+    def _flush_metadata_index(self) -> None:
+        # Only changed under the write lock, so a read lock is enough to dump it
+        with self.lock.read(), self._metadata_index_flush_lock:
+            if not self._metadata_index_changed:
+                return
+            atomic_write_text(self.metadata_index_path, json.dumps(self.metadata_index, cls=DocEncoder))
+            self._metadata_index_changed = False
+
+    def _index_metadata(self, file_name: str, stat: FileStat, doc: Doc) -> None:
+        self.metadata_index[file_name] = {
+            'mtime_ns': stat[0],
+            'size': stat[1],
+            'metadata': doc.to_metadata_dict(),
+            'content_checksum': doc.content_checksum(),
+        }
+        self._metadata_index_changed = True
+
+    def _load_lazy_doc(self, path: Path, stat: FileStat) -> LazyDoc:
+        """Load the metadata of a document, from the index if the file is unchanged."""
+        content_loader = functools.partial(self._read_content, path)
+
+        entry = self.metadata_index.get(path.name)
+        if entry and (entry['mtime_ns'], entry['size']) == stat:
+            return LazyDoc.from_metadata(
+                dict(entry['metadata']),
+                content_loader,
+                self.content_cache,
+                content_checksum=entry.get('content_checksum'),
+            )
+
+        # New or changed file: parse it once, and keep its content warm
+        full_doc = Doc.load_from_path(path=path)
+        self.content_cache.put(full_doc.doc_id, full_doc.content)
+        return LazyDoc(
+            content_loader=content_loader,
+            content_cache=self.content_cache,
+            content_checksum=full_doc.content_checksum(),
+            **full_doc.to_metadata_dict(),
+        )
+
+    def _new_doc(self, doc_id: DocID, name: str, content: str) -> Doc:
+        if not self.lazy:
+            return super()._new_doc(doc_id, name, content)
+        # Lazy from the start, so its content leaves memory once saved
+        content_loader = functools.partial(self._read_content, self.doc_dir / self.doc_format.file_name(doc_id))
+        doc = LazyDoc(content_loader=content_loader, content_cache=self.content_cache, doc_id=doc_id, name=name)
+        doc.content = content
+        return doc
+
+    @staticmethod
+    def _read_content(path: Path) -> str:
+        return Doc.load_from_path(path=path).content
+
+    def _scan_dir(self) -> dict[str, FileStat]:
+        """Stat every document file in the directory."""
+        stats = {}
+        with os.scandir(self.doc_dir) as entries:
+            for entry in entries:
+                # If not a document file, skip
+                if not is_doc_file_name(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Deleted since the listing
+                stats[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _read_file_change(self, file_name: str) -> Optional[FileChange]:
+        """
+        Load a file that may have changed, without touching the doc map.
+
+        Returns:
+            None if the file is unchanged or failed to load, (None, None) if it
+            was deleted, else its new stat and document
+        """
+        path = self.doc_dir / file_name
+        try:
+            os_stat = path.stat()
+        except FileNotFoundError:
+            return (None, None) if file_name in self.file_stats else None
+
+        stat = (os_stat.st_mtime_ns, os_stat.st_size)
+        # Empty files are still being written, a watcher sees them created before their content
+        if self.file_stats.get(file_name) == stat or not os_stat.st_size:
+            return None
+
+        try:
+            doc = self._load_lazy_doc(path=path, stat=stat) if self.lazy else Doc.load_from_path(path=path)
+        except Exception as e:
+            LOGGER.error(f"Doc at path {path} failed to load: {e}")
+            return None
+        return stat, doc
+
+    def _apply_file_change(self, file_name: str, stat: FileStat, doc: Doc) -> None:
+        """Put a loaded document in the maps, called with the write lock held."""
+        # Another refresh may have applied the same or a newer version in the meantime
+        current = self.file_stats.get(file_name)
+        if current is not None and current[0] >= stat[0]:
+            return
+
+        # The file may now hold a different document than when it was last loaded
+        previous = self.file_map.get(file_name)
+        if previous is not None and previous.doc_id != doc.doc_id:
+            self._drop_doc(previous)
+
+        if doc.doc_id is not None and doc.doc_id in self.doc_map:
+            self.doc_map[doc.doc_id] = doc
+        else:
+            self.doc_map.add(doc=doc)
+        self.file_map[file_name] = doc
+        self.file_stats[file_name] = stat
+        if self.lazy:
+            self._index_metadata(file_name, stat, doc)
+        self._notify_loaded([doc])
+        LOGGER.debug(f"Loaded document {doc} from file {file_name}")
+
+    def _forget_file(self, file_name: str) -> None:
+        """Remove the document of a file deleted on disk, called with the write lock held."""
+        if (self.doc_dir / file_name).exists():
+            return  # Recreated since, the next refresh picks it up
+
+        self.file_stats.pop(file_name, None)
+        doc = self.file_map.pop(file_name, None)
+        if doc is not None:
+            self._drop_doc(doc)
+            LOGGER.debug(f"Removed document {doc}, its file {file_name} was deleted")
+        if self.lazy and self.metadata_index.pop(file_name, None) is not None:
+            self._metadata_index_changed = True
+
+    def _drop_doc(self, doc: Doc) -> None:
+        # Only if the map still holds this very document, not one added since under the same ID
+        if doc.doc_id is not None and self.doc_map.get(doc.doc_id) is doc:
+            del self.doc_map[doc.doc_id]
+            self.content_cache.invalidate(doc.doc_id)
+            self._notify_removed([doc.doc_id])
+
+    def apply_file_changes(self, file_names: Iterable[str]) -> None:
+        """
+        Bring the given files up to date in the doc map.
+
+        Files are parsed before taking the write lock, so readers are only
+        blocked while the parsed documents are swapped in, all at once.
+
+        Args:
+            file_names: Names of files in doc_dir that were added, changed or deleted
+        """
+        changes = {}
+        for file_name in file_names:
+            change = self._read_file_change(file_name)
+            if change is not None:
+                changes[file_name] = change
+        if not changes:
+            return
+
+        with self.lock.write():
+            for file_name, (stat, doc) in changes.items():
+                if stat is None or doc is None:
+                    self._forget_file(file_name)
+                else:
+                    self._apply_file_change(file_name, stat, doc)
+        if self.lazy:
+            self._flush_metadata_index()
+
+    def _sync_with_dir(self) -> None:
+        disk_stats = self._scan_dir()
+        with self.lock.read():
+            changed = [name for name, stat in disk_stats.items() if self.file_stats.get(name) != stat]
+            deleted = [name for name in self.file_stats if name not in disk_stats]
+        if changed or deleted:
+            LOGGER.debug(f"Refreshing {len(changed)} changed and {len(deleted)} deleted files in {self.doc_dir}")
+        self.apply_file_changes(changed + deleted)
+
+    def _get_doc_map_from_store(self) -> BaseDocMap:
+        self._sync_with_dir()
         return self.doc_map
 
+    def refresh(self) -> None:
+        """
+        Pick up the documents added, changed or deleted on disk since the last refresh.
+
+        Unchanged files cost a stat and are not parsed. While a change
+        notification watcher is running, changes are applied as they happen
+        and there is nothing left to do.
+        """
+        if self.watcher is not None and self.watcher.pushes_changes:
+            return
+        self._sync_with_dir()
+
+    def start_watching(
+        self,
+        poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS,
+        use_notifications: bool = True,
+    ) -> None:
+        """
+        Apply changes made on disk to the doc map as they happen.
+
+        Uses filesystem notifications when watchdog is installed, otherwise
+        polls the directory every poll_interval_seconds.
+        """
+        # Imported here, the watcher module depends on this one
+        from .doc_watcher import DocDirWatcher
+
+        if self.watcher is not None:
+            return
+
+        self.watcher = DocDirWatcher(
+            store=self,
+            poll_interval_seconds=poll_interval_seconds,
+            use_notifications=use_notifications,
+        )
+        self.watcher.start()
+        # Started before the catch-up scan, so no change can fall in between
+        self._sync_with_dir()
+
+    def stop_watching(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
     def save_document(self, doc: Doc) -> None:
-        doc.save(self.doc_dir)
+        self.save_documents([doc])
+
+    def save_documents(self, docs: Iterable[Doc]) -> None:
+        """Write documents atomically, syncing them and the directory once for the whole batch."""
+        docs = list(docs)
+        if not docs:
+            return
+
+        with self.lock.read():
+            doc_format = self.doc_format
+            files: list[tuple[Path, bytes]] = []
+            for doc in docs:
+                assert doc.doc_id is not None, "Documents are given an ID before they are saved."
+                files.append((self.doc_dir / doc_format.file_name(doc.doc_id), encode_record(doc.to_record(), doc_format)))
+            lazy_docs = [(doc, doc.content) for doc in docs if isinstance(doc, LazyDoc)]
+        write_files_atomically(files)
+
+        # Record our own writes, so the next refresh does not reload them
+        stats = []
+        for path, _ in files:
+            os_stat = path.stat()
+            stats.append((os_stat.st_mtime_ns, os_stat.st_size))
+        with self.lock.write():
+            for doc, (path, _), stat in zip(docs, files, stats):
+                self.file_stats[path.name] = stat
+                self.file_map[path.name] = doc
+                if self.lazy:
+                    # Written out with the next refresh, a stale entry is only re-parsed on load
+                    self._index_metadata(path.name, stat, doc)
+            for lazy_doc, saved_content in lazy_docs:
+                # Now on disk, it can be evicted and read back
+                lazy_doc.release_content(saved_content)
+
+        # Files of the documents in another format, they would shadow the ones just written
+        self._remove_files({
+            f"{doc.doc_id}{ext}" for doc in docs for ext in DOC_FILE_EXTS if ext != doc_format.file_ext
+        })
+
+    def _remove_files(self, file_names: set[str]) -> None:
+        """Delete document files known to be on disk, syncing the directory once."""
+        with self.lock.write():
+            file_names &= self.file_stats.keys()
+            for file_name in file_names:
+                (self.doc_dir / file_name).unlink(missing_ok=True)
+                self.file_stats.pop(file_name, None)
+                self.file_map.pop(file_name, None)
+                if self.lazy and self.metadata_index.pop(file_name, None) is not None:
+                    self._metadata_index_changed = True
+
+        if file_names:
+            fsync_dir(self.doc_dir)
+
+    def _remove_from_remote(self, deleted: dict[DocID, list[str]]) -> None:
+        with self.lock.read():
+            file_names = set()
+            for doc_id, names in deleted.items():
+                file_names.update(names)
+                if doc_id not in self.doc_map:
+                    file_names.update(f"{doc_id}{ext}" for ext in DOC_FILE_EXTS)
+        self._remove_files(file_names)
+
+    def convert_format(self, doc_format: DocFormat) -> int:
+        """
+        Rewrite every document file of the store in the given format, in place.
+
+        Unsaved changes are saved first. Files are converted in atomic batches,
+        an interrupted conversion leaves a store mixing both formats, which
+        loads fine and can be converted again.
+
+        Returns:
+            The number of files converted
+        """
+        self.save_all_to_remote()
+        self.refresh()
+        with self.lock.write():
+            self.doc_format = doc_format
+            file_names = sorted(self.file_stats)
+
+        converted = 0
+        for start in range(0, len(file_names), CONVERSION_BATCH_SIZE):
+            files = []
+            replaced_file_names = set()
+            for file_name in file_names[start:start + CONVERSION_BATCH_SIZE]:
+                path = self.doc_dir / file_name
+                data = path.read_bytes()
+                record = decode_record(data)
+                new_file_name = doc_format.file_name(record['doc_id'])
+                if new_file_name == file_name and sniff_format(data) == doc_format:
+                    continue
+                files.append((self.doc_dir / new_file_name, encode_record(record, doc_format)))
+                if new_file_name != file_name:
+                    replaced_file_names.add(file_name)
+
+            write_files_atomically(files)
+            self.apply_file_changes(path.name for path, _ in files)
+            self._remove_files(replaced_file_names)
+            converted += len(files)
+
+        LOGGER.info(f"Converted {converted} documents in {self.doc_dir} to {doc_format}")
+        return converted
 
 
 class InRepoLocalFilesystemDocumentStore(LocalFilesystemDocStore):
     """
     A store for managing documents.
 
-    Optimized for in-memory storage and retrieval of documents.
+    Lazy, so a long-running app keeps only the content it reads in memory,
+    within the content cache's budgets, however many documents it lists.
 
-    Suitable for use in a single-user application with a small number of documents,
-    such as a personal note-taking app or document viewer.
+    Suitable for use in a single-user application, such as a personal
+    note-taking app or document viewer.
     """
 
     next_idx = 0
 
     def __init__(self, namespace: str):
-        super().__init__(namespace, FilePaths.MOCK_DOC_STORE_DIR)
+        super().__init__(namespace, FilePaths.MOCK_DOC_STORE_DIR, lazy=True)
 
     def seed_db(self):
         docs = generate_docs()
-        for doc in docs:
-            self.doc_map.add(doc=doc)
+        with self.batch():
+            for doc in docs:
+                self.doc_map.add(doc=doc)
+                self.mark_dirty(doc.doc_id)
 
     def debug_state(self) -> dict:
         state = {
@@ -312,6 +1692,10 @@ class InRepoLocalFilesystemDocumentStore(LocalFilesystemDocStore):
 
 class DocStoreRegistry(dict[DocStoreNamespace, DocStore]):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._query_cache: Optional["QueryCache"] = None
+
     def register_doc_stores(self, doc_stores: list[DocStore]):
         for doc_store in doc_stores:
             namespace = doc_store.namespace
@@ -319,7 +1703,7 @@ class DocStoreRegistry(dict[DocStoreNamespace, DocStore]):
                 raise ValueError(f"Collision on namespace {namespace}")
             self[namespace] = doc_store
 
-    def get_doc_maps(self) -> dict[DocStoreNamespace, DocMap]:
+    def get_doc_maps(self) -> dict[DocStoreNamespace, BaseDocMap]:
 
         docs_by_store = {
             doc_store_id: doc_store.get_doc_map()
@@ -328,5 +1712,24 @@ class DocStoreRegistry(dict[DocStoreNamespace, DocStore]):
 
         return docs_by_store
 
+    def stats(self) -> dict[DocStoreNamespace, "StoreStats"]:
+        """The statistics of each store, see DocStore.stats()."""
+        return {namespace: doc_store.stats() for namespace, doc_store in self.items()}
+
+    def query(self, query: "DocQuery | str") -> list["QueryHit"]:
+        """
+        Hybrid search across the stores, or the query's namespaces only, see DocStore.query().
+
+        Results of all stores are ranked together.
+        """
+        from .doc_query import DocQuery, QueryCache, run_query
+
+        if isinstance(query, str):
+            query = DocQuery(text=query)
+        if self._query_cache is None:
+            self._query_cache = QueryCache()
+        stores = [store for namespace, store in self.items() if not query.namespaces or namespace in query.namespaces]
+        return run_query(stores, query, self._query_cache)
+
 
 SupportedDocStore = InRepoLocalFilesystemDocumentStore
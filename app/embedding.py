@@ -0,0 +1,121 @@
+"""
+Text embedders for semantic retrieval.
+
+An Embedder turns texts into unit-length vectors, so the dot product of two
+vectors is their cosine similarity. HashingEmbedder runs locally and is
+deterministic, OpenAIEmbedder calls the OpenAI embeddings API.
+"""
+
+import zlib
+from abc import ABCMeta, abstractmethod
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from .doc_search import tokenize
+
+try:
+    import openai
+except ImportError:  # Optional, only needed for OpenAIEmbedder
+    openai = None  # type: ignore[assignment]
+
+DEFAULT_HASHING_DIMENSION = 512
+DEFAULT_OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+OPENAI_EMBEDDING_BATCH_SIZE = 256
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, in place, leaving zero rows as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class Embedder(metaclass=ABCMeta):
+    """Turns texts into unit-length float32 vectors of a fixed dimension."""
+
+    dimension: int
+
+    @property
+    def name(self) -> str:
+        """Identifies the embedder and its settings, vectors of different names are not comparable."""
+        return f"{type(self).__name__}-{self.dimension}"
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed texts.
+
+        Returns:
+            A (len(texts), dimension) float32 matrix of unit-length rows
+        """
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local, deterministic embedder needing no model or network.
+
+    Words and pairs of adjacent words are hashed into signed buckets, weighted
+    by log frequency. Texts sharing vocabulary end up close, which is enough
+    for keyword-heavy retrieval and for tests.
+    """
+
+    def __init__(self, dimension: int = DEFAULT_HASHING_DIMENSION):
+        self.dimension = dimension
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = Counter(tokens)
+            features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+            if not features:
+                continue
+
+            # crc32 rather than hash(), which differs between processes
+            hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint32)
+            weights = 1 + np.log(np.fromiter(features.values(), dtype=np.float32))
+            weights[hashes & 0x80000000 == 0] *= -1
+            vectors[row] = np.bincount(hashes % self.dimension, weights=weights, minlength=self.dimension)
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Embedder calling the OpenAI embeddings API.
+
+    Args:
+        model: The embedding model
+        dimension: Dimension of the model's vectors, or a smaller one to have them shortened
+        api_key: Defaults to the OPENAI_API_KEY environment variable
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_OPENAI_EMBEDDING_MODEL,
+        dimension: int = 1536,
+        api_key: Optional[str] = None,
+    ):
+        if openai is None:
+            raise ImportError("OpenAIEmbedder needs the openai package")
+        # Imported here, the LLM config pulls in pydantic
+        from .llm import OpenAIConfig
+
+        self.model = model
+        self.dimension = dimension
+        self.client = openai.Client(api_key=api_key or OpenAIConfig().api_key)
+
+    @property
+    def name(self) -> str:
+        return f"openai-{self.model}-{self.dimension}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), OPENAI_EMBEDDING_BATCH_SIZE):
+            batch = [text or " " for text in texts[start:start + OPENAI_EMBEDDING_BATCH_SIZE]]
+            response = self.client.embeddings.create(model=self.model, input=batch, dimensions=self.dimension)
+            for item in response.data:
+                vectors[start + item.index] = item.embedding
+        return normalize_rows(vectors)
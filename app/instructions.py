@@ -1,12 +1,16 @@
 from pydantic import BaseModel
 
 from .document import Doc
+from .vector_index import Passage
 
 
 class Context(BaseModel):
     """Schema for the context passed to the agent."""
 
     documents: list[Doc] = []
+    passages: list[Passage] = []  # Most relevant first, e.g. from DocStore.search_passages()
+    query: str = ""  # What the passages were retrieved for
+    part_summaries: list[str] = []  # Of consecutive chunks of the first document, when it is too long to send whole
 
 
 class InstructionNames(str):
@@ -14,6 +18,15 @@ class InstructionNames(str):
 
     LAZY = "lazy"
     SUMMARIZE_DOCUMENT = "summarize_document"
+    ANSWER_FROM_PASSAGES = "answer_from_passages"
+
+
+def format_passages(passages: list[Passage]) -> str:
+    """Number the passages, with the document each comes from."""
+    return "\n\n".join(
+        f"[{number}] (document {passage.doc_id})\n{passage.text.strip()}"
+        for number, passage in enumerate(passages, start=1)
+    )
 
 
 def generate_instructions(
@@ -28,6 +41,23 @@ def generate_instructions(
         instructions = "Do nothing. Just return the context you received."
         instructions += "\n\nContext:\n" + str(context)
 
+    elif instruction_name == InstructionNames.SUMMARIZE_DOCUMENT and context.part_summaries:
+
+        summaries = "\n\n".join(summary.strip() for summary in context.part_summaries)
+
+        instructions = f"""
+        You are a document summarizer. The document was too long to read at once,
+        so each part of it was summarized separately. Your task is to combine the
+        summaries of its parts, given in order in the context below, into a single
+        summary of the whole document.
+        You should not include any other information in your response.
+
+        The summaries of the parts are as follows:
+        <context>
+        {summaries}
+        </context>
+        """
+
     elif instruction_name == InstructionNames.SUMMARIZE_DOCUMENT:
 
         document = context.documents[0].content.strip()
@@ -44,6 +74,24 @@ def generate_instructions(
         </context>
         """
 
+    elif instruction_name == InstructionNames.ANSWER_FROM_PASSAGES:
+
+        passages = format_passages(context.passages)
+
+        instructions = f"""
+        You are a research assistant. Answer the user's question using only the
+        passages provided in the context below, the most relevant first.
+        Cite the passages you use by their number, like [1].
+        If the passages do not answer the question, say so.
+
+        The question is: {context.query}
+
+        The passages are as follows:
+        <context>
+        {passages}
+        </context>
+        """
+
     else:
         raise ValueError(f"Unknown instruction name: {instruction_name}")
 
@@ -0,0 +1,86 @@
+"""
+Locking shared by the document stores.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class ReadWriteLock:
+    """
+    Lets any number of readers, or a single writer, hold the lock.
+
+    Writers are preferred: once a writer is waiting, new readers wait behind
+    it, so a steady stream of readers cannot starve writes. The writing thread
+    may take the write or read lock again, and a reading thread may take the
+    read lock again, but a reader cannot upgrade to writing.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._waiting_writers = 0
+        self._writer: Optional[int] = None  # Thread ident of the writer
+        self._write_depth = 0
+        self._local = threading.local()  # Read depth of the current thread
+
+    @property
+    def _read_depth(self) -> int:
+        return getattr(self._local, 'read_depth', 0)
+
+    @_read_depth.setter
+    def _read_depth(self, value: int) -> None:
+        self._local.read_depth = value
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        # Only the writing thread ever sets _writer to its own ident, so this is safe unlocked
+        if self._writer == threading.get_ident():
+            yield
+            return
+
+        if not self._read_depth:
+            with self._cond:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+
+        self._read_depth += 1
+        try:
+            yield
+        finally:
+            self._read_depth -= 1
+            if not self._read_depth:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        me = threading.get_ident()
+        if self._read_depth and self._writer != me:
+            raise RuntimeError("Cannot take the write lock while holding the read lock")
+
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+                self._write_depth = 1
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
@@ -0,0 +1,225 @@
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing.
+
+Texts are compared by the Jaccard similarity of their sets of word
+shingles (runs of SHINGLE_WORDS words). A MinHash signature estimates it:
+the share of equal values in two signatures is an unbiased estimate of the
+similarity. An LSH index splits signatures into bands and buckets texts by
+each band, so a lookup only compares texts sharing a whole band, which is
+likely above the threshold and unlikely below it, instead of every text.
+
+Shared by the Gmail ingest and the app's document stores.
+"""
+
+import re
+import threading
+import zlib
+from typing import Generic, Hashable, TypeVar
+
+import numpy as np
+
+SHINGLE_WORDS = 3
+DEFAULT_NUM_PERMUTATIONS = 128
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+# Texts with fewer shingles are never near duplicates, short replies like "Thanks!" would all match
+MIN_SHINGLES = 8
+
+# Shingles hashed at once, bounds the (shingles, permutations) matrix
+SIGNATURE_BLOCK_SHINGLES = 4096
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """The distinct 32-bit hashes of a text's word shingles, ignoring case, spacing and punctuation."""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = {
+        " ".join(words[index:index + SHINGLE_WORDS])
+        for index in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    } if words else set()
+    return np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures, with num_permutations hash functions (a * x + b) mod p.
+
+    Signatures are only comparable between hashers of the same number of
+    permutations and seed.
+    """
+
+    def __init__(self, num_permutations: int = DEFAULT_NUM_PERMUTATIONS, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # Below 2**32, so a * x + b cannot overflow 64 bits for 32-bit x
+        self.a = rng.integers(1, 1 << 32, size=num_permutations, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_permutations, dtype=np.uint64)
+        self.num_permutations = num_permutations
+
+    def signature(self, text: str) -> np.ndarray | None:
+        """
+        Compute the signature of a text.
+
+        Returns
+        -------
+        np.ndarray | None
+            A (num_permutations,) uint32 array, None for texts too short to compare.
+        """
+        hashes = shingle_hashes(text)
+        if len(hashes) < MIN_SHINGLES:
+            return None
+
+        signature = np.full(self.num_permutations, MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), SIGNATURE_BLOCK_SHINGLES):
+            block = hashes[start:start + SIGNATURE_BLOCK_SHINGLES, None]
+            permuted = ((block * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the texts of two signatures."""
+    return float(np.mean(first == second))
+
+
+def lsh_bands(num_permutations: int, threshold: float) -> tuple[int, int]:
+    """
+    Choose how to split signatures into bands for a similarity threshold.
+
+    Texts of similarity s share a band with probability 1 - (1 - s**rows)**bands,
+    an S-curve rising at about (1 / bands) ** (1 / rows). The curve is placed
+    just below the threshold, candidates are then checked on whole signatures.
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of bands, and of rows per band.
+    """
+    splits = [
+        (num_permutations // rows, rows)
+        for rows in range(1, num_permutations + 1)
+        if num_permutations % rows == 0
+    ]
+    below = [(bands, rows) for bands, rows in splits if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below or splits[:1], key=lambda split: (1 / split[0]) ** (1 / split[1]))
+
+
+KeyT = TypeVar('KeyT', bound=Hashable)
+
+
+class NearDuplicateIndex(Generic[KeyT]):
+    """
+    LSH index of MinHash signatures, finding the texts similar to a new one.
+
+    Thread-safe, find_or_add() checks and indexes a text atomically, so
+    concurrent copies of a text are not all taken for originals.
+
+    Parameters
+    ----------
+    threshold : float
+        The estimated Jaccard similarity from which texts are near duplicates.
+    num_permutations : int
+        The signature length, longer signatures estimate similarity more precisely.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        num_permutations: int = DEFAULT_NUM_PERMUTATIONS,
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"The similarity threshold must be in (0, 1], not {threshold}")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_permutations=num_permutations)
+        self.bands, self.rows = lsh_bands(num_permutations, threshold)
+        self._buckets: list[dict[bytes, set[KeyT]]] = [{} for _ in range(self.bands)]
+        self._signatures: dict[KeyT, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: KeyT) -> bool:
+        return key in self._signatures
+
+    def signature(self, text: str) -> np.ndarray | None:
+        return self.hasher.signature(text)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows)]
+
+    def add(self, key: KeyT, signature: np.ndarray | None) -> None:
+        """Index a text's signature under a key, replacing the key's previous one."""
+        with self._lock:
+            self._remove(key)
+            if signature is not None:
+                self._add(key, signature)
+
+    def _add(self, key: KeyT, signature: np.ndarray) -> None:
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: KeyT) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: KeyT) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del buckets[band_key]
+
+    def query(self, signature: np.ndarray | None) -> list[tuple[KeyT, float]]:
+        """
+        Find the indexed texts similar to a signature.
+
+        Returns
+        -------
+        list[tuple[KeyT, float]]
+            (key, estimated similarity) of the texts at or above the threshold, most similar first.
+        """
+        if signature is None:
+            return []
+        with self._lock:
+            return self._query(signature)
+
+    def _query(self, signature: np.ndarray) -> list[tuple[KeyT, float]]:
+        candidates: set[KeyT] = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+        matches = [(key, similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted(
+            (match for match in matches if match[1] >= self.threshold),
+            key=lambda match: -match[1],
+        )
+
+    def find_or_add(self, key: KeyT, signature: np.ndarray | None) -> tuple[KeyT, float] | None:
+        """
+        Find the indexed text most similar to a new one, or index the new one if there is none.
+
+        Returns
+        -------
+        tuple[KeyT, float] | None
+            (key, estimated similarity) of the original, None if the text was indexed.
+        """
+        if signature is None:
+            return None
+        with self._lock:
+            matches = [match for match in self._query(signature) if match[0] != key]
+            if matches:
+                return matches[0]
+            self._remove(key)
+            self._add(key, signature)
+            return None
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import asyncio
+
 import rio
 
 
@@ -11,6 +13,7 @@ from ..components import (
     GeneratingResponsePlaceholder,
 )
 from ..custom_logging import LOGGER
+from ..doc_query import DocQuery, QueryHit
 from ..document import Doc, DocID
 from ..instructions import Context
 
@@ -56,6 +59,21 @@ class ResearcherChatPage(DocStorePageBase):
         )
         self.chat_interface.set_default_researcher()
 
+    @rio.event.on_populate
+    async def warm_query_indexes(self) -> None:
+        # Off the event loop, so the first question to a researcher reading passages does not wait for the indexes
+        if self._uses_passages():
+            await asyncio.to_thread(self._warm_query_indexes)
+
+    def _uses_passages(self) -> bool:
+        researcher = self.chat_interface.researcher if self.chat_interface is not None else None
+        return researcher is not None and researcher.uses_passages
+
+    def _warm_query_indexes(self) -> None:
+        if self.doc_store.search_index is None:
+            self.doc_store.enable_search_index()
+        self.doc_store.enable_vector_index().sync()
+
     def handle_select(self, doc_id: DocID) -> None:
         LOGGER.info(f"Document Selected {doc_id}")
 
@@ -117,10 +135,16 @@ class ResearcherChatPage(DocStorePageBase):
 
         # Generate a response
         try:
+            # Off the event loop, a query may still have documents to index
+            hits: list[QueryHit] = []
+            if self.chat_interface.researcher.uses_passages:
+                hits = await asyncio.to_thread(self.doc_store.query, DocQuery(text=message_text, limit=5))
             messages = self.chat_interface.researcher.reply(
                 messages=self.chat_interface.messages,
                 context=Context(
                     documents=[selected_document],
+                    passages=[hit.passage for hit in hits],
+                    query=message_text,
                 ),
             )
             # Add all messages to chat history
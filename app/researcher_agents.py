@@ -1,17 +1,27 @@
+import threading
+from collections import OrderedDict
 from typing import Callable
 
 from openai import Client as OpenAIClient
 from openai.types.chat import (
     ChatCompletionUserMessageParam,
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr  # type: ignore[attr-defined]
 
 from app.custom_logging import LOGGER
 
 from .chat import ChatMessage, ChatRole
+from .chunking import Chunk, Chunker, ChunkID, count_tokens
+from .document import Doc, DocID
 from .instructions import Context, InstructionNames, generate_instructions
 from .llm import OpenAIConfig
 
+# Longer documents are summarized chunk by chunk
+SUMMARY_MAX_DOCUMENT_TOKENS = 3000
+SUMMARY_CHUNK_TOKENS = 1000
+SUMMARY_CACHE_ENTRIES = 1024  # Chunk summaries kept
+SUMMARY_RECENT_DOCUMENTS = 16  # Documents whose chunks are kept, to re-chunk only what an edit changed
+
 
 def get_openai_client() -> tuple[OpenAIClient, OpenAIConfig]:
     """Get the OpenAI client instance."""
@@ -35,6 +45,7 @@ class Researcher(BaseModel):
     name: str = "LazyResearcher"
     description: str = "This researcher has simple instructions and needs to be configured."
     instructions_generator: Callable[[Context], str] = default_instructions
+    uses_passages: bool = False  # Whether its instructions read Context.passages, which cost a query to find
 
     def reply(
         self,
@@ -48,6 +59,17 @@ class Researcher(BaseModel):
         instructions = self.instructions_generator(context)
         LOGGER.debug(f"Generated instructions: {instructions}")
 
+        responses.append(
+            ChatMessage(
+                role=ChatRole.ASSISTANT,
+                content=self.complete(instructions),
+            )
+        )
+
+        return responses
+
+    def complete(self, instructions: str) -> str:
+        """Get the model's response to instructions."""
         client, config = get_openai_client()
         completion = client.chat.completions.create(
             model=config.model,
@@ -64,15 +86,74 @@ class Researcher(BaseModel):
         response = completion.choices[0].message.content
         assert response is not None, "Response content is empty."
         LOGGER.debug(f"OpenAI response: {response}")
+        return response
 
-        responses.append(
-            ChatMessage(
-                role=ChatRole.ASSISTANT,
-                content=response,
-            )
-        )
 
-        return responses
+class ChunkedSummarizer(Researcher):
+    """
+    Summarizer of documents of any length.
+
+    Documents over max_document_tokens are summarized chunk by chunk, and the
+    summaries combined. Chunk summaries are cached by chunk ID, so after an
+    edit only the chunks it changed are summarized again.
+    """
+
+    max_document_tokens: int = SUMMARY_MAX_DOCUMENT_TOKENS
+    _chunker: Chunker = PrivateAttr(default_factory=lambda: Chunker(max_tokens=SUMMARY_CHUNK_TOKENS, overlap_tokens=0))
+    _chunk_summaries: OrderedDict[ChunkID, str] = PrivateAttr(default_factory=OrderedDict)
+    _recent_chunks: OrderedDict[DocID, tuple[str, list[Chunk]]] = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def reply(
+        self,
+        messages: list[ChatMessage],
+        context: Context,
+    ) -> list[ChatMessage]:
+        if not context.documents or count_tokens(context.documents[0].content) <= self.max_document_tokens:
+            return super().reply(messages=messages, context=context)
+
+        doc = context.documents[0]
+        summaries = [self._summarize_chunk(doc, chunk) for chunk in self._chunks(doc)]
+        context = Context(
+            documents=context.documents,
+            passages=context.passages,
+            query=context.query,
+            part_summaries=summaries,
+        )
+        return super().reply(messages=messages, context=context)
+
+    def _chunks(self, doc: Doc) -> list[Chunk]:
+        """Chunk a document, re-chunking only the edited part if it was chunked before."""
+        content = doc.content
+        if doc.doc_id is None:
+            return self._chunker.chunk(content)
+        with self._lock:
+            recent = self._recent_chunks.pop(doc.doc_id, None)
+        if recent is not None:
+            chunks = self._chunker.rechunk(recent[0], recent[1], content)
+        else:
+            chunks = self._chunker.chunk(content)
+
+        with self._lock:
+            self._recent_chunks[doc.doc_id] = (content, chunks)
+            while len(self._recent_chunks) > SUMMARY_RECENT_DOCUMENTS:
+                self._recent_chunks.popitem(last=False)
+        return chunks
+
+    def _summarize_chunk(self, doc: Doc, chunk: Chunk) -> str:
+        with self._lock:
+            summary = self._chunk_summaries.get(chunk.chunk_id)
+            if summary is not None:
+                self._chunk_summaries.move_to_end(chunk.chunk_id)
+                return summary
+
+        part = Doc(name=doc.name, content=chunk.text(doc.content), doc_id=doc.doc_id)
+        summary = self.complete(generate_instructions(InstructionNames.SUMMARIZE_DOCUMENT, Context(documents=[part])))
+        with self._lock:
+            self._chunk_summaries[chunk.chunk_id] = summary
+            while len(self._chunk_summaries) > SUMMARY_CACHE_ENTRIES:
+                self._chunk_summaries.popitem(last=False)
+        return summary
 
 
 class Researchers:
@@ -86,15 +167,25 @@ class Researchers:
         instructions_generator=default_instructions,
     )
 
-    SUMMARIZER = Researcher(
+    SUMMARIZER = ChunkedSummarizer(
         name="Summarizer",
-        description="This researcher summarizes text.",
+        description="This researcher summarizes text, long documents part by part.",
         instructions_generator=lambda context: generate_instructions(
             InstructionNames.SUMMARIZE_DOCUMENT,
             context=context,
         ),
     )
 
+    RESEARCH_ASSISTANT = Researcher(
+        name="ResearchAssistant",
+        description="This researcher answers questions from the most relevant passages of your documents.",
+        instructions_generator=lambda context: generate_instructions(
+            InstructionNames.ANSWER_FROM_PASSAGES,
+            context=context,
+        ),
+        uses_passages=True,
+    )
+
 
 def get_default_researcher() -> Researcher:
     """Get the default researcher instance."""
@@ -0,0 +1,507 @@
+"""
+SQLite-backed document storage.
+
+Scales a namespace well past what fits comfortably in a dict: documents live
+in a single SQLite file (in WAL mode), are only decoded when accessed, and can
+be looked up by id, name and updated_at through indexes.
+
+Metadata and content are stored in separate columns, so a lazy map can list
+documents without reading their content. The store's statistics are kept in
+the same file, see SqliteNamespaceStats.
+"""
+
+import functools
+import json
+import sqlite3
+import threading
+import weakref
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+from .content_cache import (
+    DEFAULT_CONTENT_CACHE_BYTES,
+    DEFAULT_WARM_CACHE_BYTES,
+    ContentLRU,
+)
+from .custom_logging import LOGGER
+from .doc_codec import is_doc_file_name
+from .doc_stats import STATS_VERSION, NamespaceStats
+from .document import (
+    DOC_ID_COUNTER_FN,
+    BaseDocMap,
+    Doc,
+    DocEncoder,
+    DocID,
+    DocStore,
+    DocStoreNamespace,
+    LazyDoc,
+    read_doc_id_counter,
+    serialize_datetime,
+)
+
+if TYPE_CHECKING:
+    from .doc_search import SearchIndex
+    from .embedding import Embedder
+    from .vector_index import VectorIndex
+
+SQLITE_FILE_EXT = '.sqlite3'
+SEARCH_INDEX_EXT = '.search.index'
+VECTOR_INDEX_EXT = '.vectors'
+
+NEXT_DOC_ID_KEY = 'next_doc_id'
+
+# Documents written per transaction when migrating a JSON directory
+MIGRATION_BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS docs_name ON docs (name);
+CREATE INDEX IF NOT EXISTS docs_updated_at ON docs (updated_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('next_doc_id', 1);
+CREATE TABLE IF NOT EXISTS doc_stats (
+    doc_id INTEGER PRIMARY KEY,
+    version TEXT NOT NULL,
+    content_bytes INTEGER NOT NULL,
+    token_estimate INTEGER NOT NULL,
+    tags TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def encode_metadata(doc: Doc) -> str:
+    # The checksum lets lazy documents tell their version without loading their content
+    return json.dumps({**doc.to_metadata_dict(), 'content_checksum': doc.content_checksum()}, cls=DocEncoder)
+
+
+def decode_doc(metadata: str, content: str) -> Doc:
+    return Doc.from_record({**json.loads(metadata), 'content': content})
+
+
+class SqliteDocMap(BaseDocMap):
+    """
+    Document map stored in a SQLite file.
+
+    Documents are decoded on access rather than held in memory, and new IDs
+    come from a counter persisted in the same file. A lazy map returns
+    LazyDocs, whose content is only read when accessed and then kept in
+    content_cache.
+
+    While a decoded document is referenced, looking it up again returns the
+    same instance, as with an in-memory map, so a document changed in place
+    is the one written back, see SqliteDocStore.mark_dirty().
+
+    Each thread gets its own connection, so in WAL mode readers never wait
+    for a writer. Writes are serialized by a lock.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        max_docs: Optional[int] = None,
+        lazy: bool = False,
+        content_cache: Optional[ContentLRU] = None,
+    ):
+        self.db_path = db_path
+        self.max_docs = max_docs
+        self.lazy = lazy
+        self.content_cache = content_cache if content_cache is not None else ContentLRU()
+
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        # Document ID -> instance handed out and still referenced
+        self._live_docs: weakref.WeakValueDictionary[DocID, Doc] = weakref.WeakValueDictionary()
+        self._live_docs_lock = threading.Lock()
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._write_lock:
+            # WAL lets readers proceed while a write is in progress, and is persistent in the file
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+        LOGGER.debug(f"Opened SQLite doc map at {db_path}")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection of the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # NORMAL sync only fsyncs at checkpoints, which is still safe against corruption in WAL mode
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _decode_row(self, doc_id: DocID, metadata: str, content: Optional[str] = None) -> Doc:
+        with self._live_docs_lock:
+            live_doc = self._live_docs.get(doc_id)
+        if live_doc is not None:
+            return live_doc
+
+        if not self.lazy:
+            assert content is not None
+            doc = decode_doc(metadata, content)
+        else:
+            doc = LazyDoc.from_metadata(
+                json.loads(metadata),
+                content_loader=functools.partial(self._load_content, doc_id),
+                content_cache=self.content_cache,
+            )
+        with self._live_docs_lock:
+            return self._live_docs.setdefault(doc_id, doc)
+
+    def _load_content(self, doc_id: DocID) -> str:
+        row = self.conn.execute("SELECT content FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+        return row[0]
+
+    @property
+    def _columns(self) -> str:
+        """Columns to select for _decode_row, leaving content out in lazy mode."""
+        return "doc_id, metadata" if self.lazy else "doc_id, metadata, content"
+
+    def next_doc_id(self) -> DocID:
+        with self._write_lock, self.conn:
+            (doc_id,) = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (NEXT_DOC_ID_KEY,)
+            ).fetchone()
+            self.conn.execute(
+                "UPDATE meta SET value = ? WHERE key = ?", (doc_id + 1, NEXT_DOC_ID_KEY)
+            )
+        return doc_id
+
+    def _put(self, doc_id: DocID, doc: Doc) -> None:
+        """Write a document without committing."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO docs (doc_id, name, created_at, updated_at, metadata, content) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                doc_id,
+                doc.name,
+                doc.created_at.isoformat(),
+                doc.updated_at.isoformat(),
+                encode_metadata(doc),
+                doc.content,
+            ),
+        )
+        self.content_cache.invalidate(doc_id)
+        with self._live_docs_lock:
+            self._live_docs[doc_id] = doc
+        # Keep the counter ahead of explicitly chosen IDs
+        self._advance_doc_id(doc_id)
+
+    def _advance_doc_id(self, doc_id: DocID) -> None:
+        """Never hand out IDs up to doc_id, without committing."""
+        self.conn.execute(
+            "UPDATE meta SET value = MAX(value, ?) WHERE key = ?", (doc_id + 1, NEXT_DOC_ID_KEY)
+        )
+
+    def __getitem__(self, doc_id: DocID) -> Doc:
+        row = self.conn.execute(f"SELECT {self._columns} FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+        return self._decode_row(*row)
+
+    def __setitem__(self, doc_id: DocID, doc: Doc) -> None:
+        with self._write_lock, self.conn:
+            self._put(doc_id, doc)
+
+    def __delitem__(self, doc_id: DocID) -> None:
+        with self._write_lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+        self.content_cache.invalidate(doc_id)
+        with self._live_docs_lock:
+            self._live_docs.pop(doc_id, None)
+        if cursor.rowcount == 0:
+            raise KeyError(doc_id)
+
+    def __contains__(self, doc_id: object) -> bool:
+        row = self.conn.execute("SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[DocID]:
+        for (doc_id,) in self.conn.execute("SELECT doc_id FROM docs ORDER BY doc_id"):
+            yield doc_id
+
+    def __len__(self) -> int:
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()
+        return count
+
+    def values(self) -> Iterator[Doc]:  # type: ignore[override]
+        # One query instead of a lookup per key
+        for row in self.conn.execute(f"SELECT {self._columns} FROM docs ORDER BY doc_id"):
+            yield self._decode_row(*row)
+
+    def items(self) -> Iterator[tuple[DocID, Doc]]:  # type: ignore[override]
+        for row in self.conn.execute(f"SELECT {self._columns} FROM docs ORDER BY doc_id"):
+            yield row[0], self._decode_row(*row)
+
+    def update(self, *args, **kwargs) -> None:  # type: ignore[override]
+        # A single transaction for the whole batch
+        with self._write_lock, self.conn:
+            for doc_id, doc in dict(*args, **kwargs).items():
+                self._put(doc_id, doc)
+
+    def find_by_name(self, name: str) -> list[Doc]:
+        """Get the documents with the given name, using the name index."""
+        rows = self.conn.execute(f"SELECT {self._columns} FROM docs WHERE name = ? ORDER BY doc_id", (name,))
+        return [self._decode_row(*row) for row in rows]
+
+    def find_updated_between(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> list[Doc]:
+        """Get the documents updated in [start, end), most recent first, using the updated_at index."""
+        start_key = serialize_datetime(start) if start else ''
+        end_key = serialize_datetime(end) if end else '\uffff'
+        rows = self.conn.execute(
+            f"SELECT {self._columns} FROM docs WHERE updated_at >= ? AND updated_at < ? ORDER BY updated_at DESC",
+            (start_key, end_key),
+        )
+        return [self._decode_row(*row) for row in rows]
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class SqliteNamespaceStats(NamespaceStats):
+    """
+    NamespaceStats kept in the doc_stats table of a SqliteDocMap's file.
+
+    Like the documents, changes are written through as they happen, and
+    only the rows of the documents a change touched are written.
+    """
+
+    def __init__(self, doc_map: SqliteDocMap):
+        self.doc_map = doc_map
+        self._touched: set[DocID] = set()  # Documents whose row is not yet written
+        super().__init__()
+        self._load()
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        super().on_docs_put(docs)
+        self.persist()
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        super().on_docs_loaded(docs)
+        self.persist()
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        super().on_docs_removed(doc_ids)
+        self.persist()
+
+    def _subtract(self, doc_id: DocID) -> None:
+        # Measuring a document subtracts its old contribution first, so this sees every change
+        super()._subtract(doc_id)
+        self._touched.add(doc_id)
+
+    def persist(self) -> None:
+        """Write the rows of the documents changed since the last write."""
+        if not self._changed:
+            return
+        rows = []
+        removed = []
+        for doc_id in self._touched:
+            contribution = self.contributions.get(doc_id)
+            if contribution is None:
+                removed.append((doc_id,))
+            else:
+                version, content_bytes, token_estimate, tags = contribution
+                rows.append((doc_id, version, content_bytes, token_estimate, json.dumps(tags)))
+
+        conn = self.doc_map.conn
+        with self.doc_map._write_lock, conn:
+            conn.executemany("DELETE FROM doc_stats WHERE doc_id = ?", removed)
+            conn.executemany(
+                "INSERT OR REPLACE INTO doc_stats (doc_id, version, content_bytes, token_estimate, tags) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            meta = {'version': str(STATS_VERSION)}
+            if self.last_modified is not None:
+                meta['last_modified'] = self.last_modified.isoformat()
+            conn.executemany("INSERT OR REPLACE INTO stats_meta (key, value) VALUES (?, ?)", meta.items())
+        self._touched.clear()
+        self._changed = False
+
+    def _load(self) -> None:
+        conn = self.doc_map.conn
+        meta = dict(conn.execute("SELECT key, value FROM stats_meta"))
+        if meta.get('version') != str(STATS_VERSION):
+            if meta:
+                LOGGER.info(f"Statistics in {self.doc_map.db_path} are of another version, recounting")
+            with self.doc_map._write_lock, conn:
+                conn.execute("DELETE FROM doc_stats")
+                conn.execute("DELETE FROM stats_meta")
+            return
+
+        rows = conn.execute("SELECT doc_id, version, content_bytes, token_estimate, tags FROM doc_stats")
+        for doc_id, version, content_bytes, token_estimate, tags in rows:
+            self._add(doc_id, (version, content_bytes, token_estimate, tuple(json.loads(tags))))
+        if 'last_modified' in meta:
+            self.last_modified = datetime.fromisoformat(meta['last_modified'])
+
+
+class SqliteDocStore(DocStore):
+    """
+    A document store kept in a single SQLite file per namespace.
+
+    Unlike LocalFilesystemDocStore, opening the store does not read any
+    documents, and every change is written through to the file.
+    """
+
+    doc_map: SqliteDocMap
+    db_path: Path
+
+    def __init__(
+        self,
+        namespace: DocStoreNamespace,
+        local_root_dir: Path,
+        lazy: bool = False,
+        content_cache_bytes: int = DEFAULT_CONTENT_CACHE_BYTES,
+        warm_cache_bytes: int = DEFAULT_WARM_CACHE_BYTES,
+    ):
+        super().__init__(namespace=namespace)
+        self.db_path = local_root_dir / f"{namespace}{SQLITE_FILE_EXT}"
+        self.content_cache = ContentLRU(byte_budget=content_cache_bytes, warm_byte_budget=warm_cache_bytes)
+        self.doc_map = SqliteDocMap(self.db_path, lazy=lazy, content_cache=self.content_cache)
+
+    def _get_doc_map_from_store(self) -> SqliteDocMap:
+        return self.doc_map
+
+    def refresh(self) -> None:
+        # The map reads straight from the file, there is nothing to reload
+        pass
+
+    def save_document(self, doc: Doc) -> None:
+        assert doc.doc_id is not None
+        self.doc_map[doc.doc_id] = doc
+
+    def save_documents(self, docs: Iterable[Doc]) -> None:
+        """Save several documents in a single transaction."""
+        self.doc_map.update({doc.doc_id: doc for doc in docs if doc.doc_id is not None})
+
+    def save_all_to_remote(self) -> None:
+        # Changes are written through as they happen, only the observers have anything to save
+        self._notify_saved()
+
+    def enable_search_index(self, index_path: Optional[Path] = None) -> "SearchIndex":
+        return super().enable_search_index(index_path or self.db_path.with_suffix(SEARCH_INDEX_EXT))
+
+    def enable_vector_index(
+        self,
+        embedder: Optional["Embedder"] = None,
+        approximate: bool = False,
+        index_dir: Optional[Path] = None,
+        quantization: Optional[str] = None,
+    ) -> "VectorIndex":
+        return super().enable_vector_index(
+            embedder=embedder,
+            approximate=approximate,
+            index_dir=index_dir or self.db_path.with_suffix(VECTOR_INDEX_EXT),
+            quantization=quantization,
+        )
+
+    def _new_namespace_stats(self, stats_path: Optional[Path]) -> NamespaceStats:
+        # Without a file of their own, the statistics are kept in the store's
+        if stats_path is not None:
+            return super()._new_namespace_stats(stats_path)
+        return SqliteNamespaceStats(self.doc_map)
+
+    def _mark_dirty(self, doc_id: DocID) -> None:
+        pass
+
+    def mark_dirty(self, doc_id: DocID) -> None:
+        """Write a document that was changed in place through to the file."""
+        with self.lock.write():
+            # The instance the caller changed, the map hands out the same one while it is referenced
+            doc = self.doc_map[doc_id]
+            self.doc_map[doc_id] = doc
+            self._notify_put([doc])
+
+    def _mark_deleted(self, doc_id: DocID, file_names: list[str]) -> None:
+        pass
+
+    def get_documents_by_name(self, name: str) -> list[Doc]:
+        return self.doc_map.find_by_name(name)
+
+    def get_documents_updated_between(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> list[Doc]:
+        return self.doc_map.find_updated_between(start=start, end=end)
+
+    def migrate_from_json_dir(self, json_dir: Path) -> int:
+        """
+        Import every document of a LocalFilesystemDocStore directory.
+
+        Documents are written in batched transactions, existing documents with
+        the same ID are replaced, and the observers are told of each batch.
+        IDs the directory's store handed out are never handed out again, even
+        those of documents deleted since.
+
+        Args:
+            json_dir: Directory holding one file per document, in any DocFormat
+
+        Returns:
+            The number of documents imported
+        """
+        last_doc_id = read_doc_id_counter(json_dir / DOC_ID_COUNTER_FN)
+        imported = 0
+        batch: list[Doc] = []
+        for path in sorted(json_dir.iterdir()):
+            if not is_doc_file_name(path.name):
+                continue
+            try:
+                batch.append(Doc.load_from_path(path=path))
+            except Exception as e:
+                LOGGER.error(f"Doc at path {path} failed to migrate: {e}")
+                continue
+
+            if len(batch) >= MIGRATION_BATCH_SIZE:
+                self._import_batch(batch, last_doc_id)
+                imported += len(batch)
+                batch = []
+
+        self._import_batch(batch, last_doc_id)
+        imported += len(batch)
+
+        LOGGER.info(f"Migrated {imported} documents from {json_dir} into {self.db_path}")
+        return imported
+
+    def _import_batch(self, docs: list[Doc], last_doc_id: DocID) -> None:
+        with self.lock.write():
+            # The source's counter is carried over in the same transaction as the documents
+            with self.doc_map._write_lock, self.doc_map.conn:
+                for doc in docs:
+                    if doc.doc_id is not None:
+                        self.doc_map._put(doc.doc_id, doc)
+                self.doc_map._advance_doc_id(last_doc_id)
+            if docs:
+                self._notify_put(docs)
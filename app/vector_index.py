@@ -0,0 +1,423 @@
+"""
+Semantic retrieval of document passages.
+
+Documents are split into chunks, see chunking, each embedded into a row of
+one contiguous matrix. A query is embedded the same way and scored against every
+row with a single matrix-vector product, or, in approximate mode, against the
+rows of the few clusters nearest to it (an IVF index).
+
+VectorIndex observes a DocStore, but embedding can be slow, so changes are
+only queued under the store's lock and embedded at the next search or sync().
+
+The matrix can be kept memory-mapped in a directory, and quantized so that
+searches mostly read a compact copy of it, see vector_storage.
+"""
+
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from .atomic_io import atomic_write_text
+from .chunking import Chunker, chunk_id
+from .custom_logging import LOGGER
+from .document import Doc, DocID, DocStoreObserver
+from .embedding import Embedder, HashingEmbedder
+from .vector_storage import PQ_MIN_ROWS, EmbeddingMatrix, Quantizations
+
+VECTOR_INDEX_VERSION = 2
+VECTOR_INDEX_META_FN = 'index.meta'  # JSON, named so it is never taken for a document
+
+COMPACT_DEAD_RATIO = 0.5  # Compact once this share of the rows are of changed or deleted documents
+COMPACT_MIN_ROWS = 1024
+
+# Approximate mode
+IVF_MIN_ROWS = 4096  # Smaller indexes are searched exhaustively
+IVF_TRAIN_SAMPLE_PER_LIST = 64
+IVF_RETRAIN_GROWTH = 2.0  # Clusters are trained again once the index grew by this factor
+DEFAULT_IVF_PROBES = 8
+
+RERANK_FACTOR = 8  # Candidates per result scored on quantized vectors, re-ranked on the float ones
+
+DocLoader = Callable[[DocID], Optional[Doc]]
+
+
+@dataclass
+class Passage:
+    """A span of a document's content, with its similarity to a query."""
+
+    doc_id: DocID
+    start: int
+    end: int
+    text: str
+    score: float = 0.0
+
+
+class VectorIndex(DocStoreObserver):
+    """
+    Passage embeddings of documents, searched by cosine similarity.
+
+    Each document's chunks are consecutive rows of an EmbeddingMatrix.
+    Rows of changed or deleted documents are marked dead and dropped by the
+    next compaction. Chunks a changed document still has keep their vectors,
+    only new chunks are embedded.
+
+    With an index_dir the matrix is memory-mapped from files there, and
+    persist(), called whenever the store is saved, records which rows are
+    valid. Reopening maps the files without reading them, and only documents
+    whose Doc.version changed since are embedded again.
+
+    Args:
+        doc_loader: Gets a document by ID, to read passages from
+        embedder: Defaults to a local HashingEmbedder
+        chunker: Splits documents into passages, defaults to a Chunker of the default settings
+        approximate: Search only the clusters nearest the query once the
+            index holds IVF_MIN_ROWS passages, trading some recall for speed
+        ivf_probes: Clusters searched per query in approximate mode
+        index_dir: Directory to keep the index in, in memory if None
+        quantization: Score against int8 or PQ codes before re-ranking, see Quantizations
+    """
+
+    def __init__(
+        self,
+        doc_loader: DocLoader,
+        embedder: Optional[Embedder] = None,
+        chunker: Optional[Chunker] = None,
+        approximate: bool = False,
+        ivf_probes: int = DEFAULT_IVF_PROBES,
+        index_dir: Optional[Path] = None,
+        quantization: str = Quantizations.NONE,
+    ):
+        self.doc_loader = doc_loader
+        self.embedder = embedder or HashingEmbedder()
+        self.chunker = chunker or Chunker()
+        self.approximate = approximate
+        self.ivf_probes = ivf_probes
+        self.index_dir = index_dir
+        self.quantization = quantization
+
+        self.docs: dict[DocID, tuple[str, int, int]] = {}  # Document ID -> (Doc.version when embedded, first row, row count)
+        self.live = np.zeros(0, dtype=bool)  # Whether each row is of a current document
+        self._trained_rows = 0  # Live rows when the clusters were trained
+        if index_dir is not None:
+            index_dir.mkdir(parents=True, exist_ok=True)
+        if index_dir is None or not self._open(index_dir):
+            self.matrix = EmbeddingMatrix(dimension=self.embedder.dimension, quantization=quantization, index_dir=index_dir)
+
+        self._pending: dict[DocID, Optional[Doc]] = {}  # Changes not yet embedded, None for deletions
+        self._lock = threading.Lock()  # Guards the pending changes and the matrix, never held while embedding
+        self._sync_lock = threading.Lock()  # Applies syncs one at a time, in order
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @property
+    def live_row_count(self) -> int:
+        return int(self.live[:self.matrix.row_count].sum())
+
+    # Store changes, queued to be embedded outside the store's lock
+
+    def on_attached(self, docs: list[Doc]) -> None:
+        doc_ids = {doc.doc_id for doc in docs}
+        with self._lock:
+            for doc_id in self.docs:
+                if doc_id not in doc_ids:
+                    self._pending[doc_id] = None
+        self.on_docs_loaded(docs)
+
+    def on_docs_put(self, docs: list[Doc]) -> None:
+        with self._lock:
+            for doc in docs:
+                if doc.doc_id is not None:
+                    self._pending[doc.doc_id] = doc
+
+    def on_docs_loaded(self, docs: list[Doc]) -> None:
+        with self._lock:
+            for doc in docs:
+                if doc.doc_id is None:
+                    continue
+                entry = self.docs.get(doc.doc_id)
+                if entry is None or entry[0] != doc.version or doc.doc_id in self._pending:
+                    self._pending[doc.doc_id] = doc
+
+    def on_docs_removed(self, doc_ids: list[DocID]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                self._pending[doc_id] = None
+
+    def on_store_saved(self) -> None:
+        self.persist()
+
+    # Indexing
+
+    def sync(self) -> int:
+        """
+        Embed the documents changed since the last sync.
+
+        Returns:
+            The number of documents embedded or removed
+        """
+        with self._sync_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            try:
+                vectors, new_rows = self._embed(pending)
+            except Exception:
+                # Try them again next time, unless changed again since
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+                raise
+
+            with self._lock:
+                self._apply(pending, vectors, new_rows)
+        return len(pending)
+
+    def _embed(self, pending: dict[DocID, Optional[Doc]]) -> tuple[np.ndarray, list[tuple[DocID, int, int, int]]]:
+        """
+        Embed the chunks of the pending documents, as (vectors, (doc_id, start, end, key) per row).
+
+        Chunks a document already had are copied from its rows. Called with
+        the sync lock held, which is all the matrix needs to be read: only
+        syncs change it.
+        """
+        texts = []
+        embedded_rows = []  # Indexes in new_rows of the texts
+        reused_rows = []  # (index in new_rows, old row)
+        new_rows: list[tuple[DocID, int, int, int]] = []
+        keys = self.matrix.column('keys')
+        for doc_id, doc in pending.items():
+            if doc is None:
+                continue
+            content = doc.content
+            # The name gives every chunk of a document some shared context, so it is part of what is embedded
+            name_key = chunk_id(doc.name)
+            old_rows = {}
+            if doc_id in self.docs:
+                _, first, count = self.docs[doc_id]
+                old_rows = {int(key): first + offset for offset, key in enumerate(keys[first:first + count])}
+
+            for chunk in self.chunker.chunk(content):
+                key = chunk.chunk_id ^ name_key
+                if key in old_rows:
+                    reused_rows.append((len(new_rows), old_rows[key]))
+                else:
+                    embedded_rows.append(len(new_rows))
+                    texts.append(f"{doc.name}\n{chunk.text(content)}")
+                new_rows.append((doc_id, chunk.start, chunk.end, key))
+
+        vectors = np.empty((len(new_rows), self.embedder.dimension), dtype=np.float32)
+        if reused_rows:
+            indexes, rows = zip(*reused_rows)
+            vectors[list(indexes)] = self.matrix.vectors[list(rows)]
+        if texts:
+            vectors[embedded_rows] = self.embedder.embed(texts)
+        LOGGER.debug(f"Embedded {len(texts)} chunks, reused {len(reused_rows)}")
+        return vectors, new_rows
+
+    def _apply(
+        self,
+        pending: dict[DocID, Optional[Doc]],
+        vectors: np.ndarray,
+        new_rows: list[tuple[DocID, int, int, int]],
+    ) -> None:
+        """Swap in the embedded changes, called with the lock held."""
+        for doc_id in pending:
+            entry = self.docs.pop(doc_id, None)
+            if entry is not None:
+                self.live[entry[1]:entry[1] + entry[2]] = False
+
+        first_row = self.matrix.append(
+            vectors,
+            [doc_id for doc_id, _, _, _ in new_rows],
+            [(start, end) for _, start, end, _ in new_rows],
+            [key for _, _, _, key in new_rows],
+        )
+        self._reserve_live()
+        self.live[first_row:self.matrix.row_count] = True
+
+        # Rows of a document are consecutive, new_rows is grouped by document
+        row_counts: dict[DocID, int] = {}
+        for doc_id, _, _, _ in new_rows:
+            row_counts[doc_id] = row_counts.get(doc_id, 0) + 1
+        row = first_row
+        for doc_id, doc in pending.items():
+            if doc is not None:
+                count = row_counts.get(doc_id, 0)
+                self.docs[doc_id] = (doc.version, row, count)
+                row += count
+
+        self._maintain()
+
+    def _reserve_live(self) -> None:
+        if len(self.live) < self.matrix.row_count:
+            live = np.zeros(max(2 * len(self.live), self.matrix.row_count), dtype=bool)
+            live[:len(self.live)] = self.live
+            self.live = live
+
+    def _maintain(self) -> None:
+        """Compact, or train the clusters and codebooks, when due."""
+        live_rows = np.flatnonzero(self.live[:self.matrix.row_count])
+        needs_clusters = self.approximate and len(live_rows) >= IVF_MIN_ROWS and (
+            self.matrix.centroids is None or len(live_rows) >= IVF_RETRAIN_GROWTH * self._trained_rows
+        )
+        needs_codebooks = (
+            self.quantization == Quantizations.PQ and self.matrix.codebooks is None and len(live_rows) >= PQ_MIN_ROWS
+        )
+        dead_count = self.matrix.row_count - len(live_rows)
+        needs_compaction = self.matrix.row_count >= COMPACT_MIN_ROWS and dead_count > COMPACT_DEAD_RATIO * self.matrix.row_count
+        if not (needs_clusters or needs_codebooks or needs_compaction):
+            return
+
+        if needs_clusters:
+            cluster_count = int(np.sqrt(len(live_rows)))
+            sample_rows = min(len(live_rows), cluster_count * IVF_TRAIN_SAMPLE_PER_LIST)
+            self.matrix.train_clusters(live_rows, cluster_count, sample_rows)
+            self._trained_rows = len(live_rows)
+            LOGGER.debug(f"Trained {cluster_count} clusters over {len(live_rows)} passages")
+        if needs_codebooks:
+            self.matrix.train_codebooks(live_rows)
+            LOGGER.debug(f"Trained product quantization codebooks over {len(live_rows)} passages")
+
+        # Drops the dead rows, and encodes the rest with what was just trained
+        new_rows = self.matrix.rewrite(self.live[:self.matrix.row_count].copy())
+        self.docs = {
+            doc_id: (version, int(new_rows[first]) if count else 0, count)
+            for doc_id, (version, first, count) in self.docs.items()
+        }
+        self.live = np.ones(self.matrix.row_count, dtype=bool)
+
+    # Persistence
+
+    def _open(self, index_dir: Path) -> bool:
+        """
+        Map the index saved in index_dir.
+
+        Returns:
+            Whether there was one of the same settings, the directory is cleared if not
+        """
+        try:
+            with open(index_dir / VECTOR_INDEX_META_FN) as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            meta = {}
+        except Exception as e:
+            LOGGER.error(f"Vector index {index_dir} failed to load, rebuilding it: {e}")
+            meta = {}
+
+        settings = (VECTOR_INDEX_VERSION, self.embedder.name, self.chunker.name, self.quantization)
+        if (meta.get('version'), meta.get('embedder'), meta.get('chunker'), meta.get('quantization')) != settings:
+            if meta:
+                LOGGER.info(f"Vector index {index_dir} was built with other settings, rebuilding it")
+            # Including files of an index never saved
+            for path in index_dir.iterdir():
+                path.unlink()
+            return False
+
+        self.matrix = EmbeddingMatrix(
+            dimension=self.embedder.dimension,
+            quantization=self.quantization,
+            index_dir=index_dir,
+            generation=meta['generation'],
+            row_count=meta['row_count'],
+        )
+        self.docs = {int(doc_id): (version, first, count) for doc_id, (version, first, count) in meta['docs'].items()}
+        self._trained_rows = meta['trained_rows']
+        self.live = np.zeros(self.matrix.row_count, dtype=bool)
+        for _, first, count in self.docs.values():
+            self.live[first:first + count] = True
+        return True
+
+    def persist(self) -> None:
+        """Flush the matrix and record its valid rows, so the index can be reopened as it is now."""
+        if self.index_dir is None:
+            return
+        with self._lock:
+            self.matrix.flush()
+            meta = {
+                'version': VECTOR_INDEX_VERSION,
+                'embedder': self.embedder.name,
+                'chunker': self.chunker.name,
+                'quantization': self.quantization,
+                'generation': self.matrix.generation,
+                'row_count': self.matrix.row_count,
+                'trained_rows': self._trained_rows,
+                'docs': self.docs,
+            }
+            atomic_write_text(self.index_dir / VECTOR_INDEX_META_FN, json.dumps(meta))
+            self.matrix.delete_old_generations()
+
+    # Searching
+
+    def search(self, query: str, limit: int = 5, doc_ids: Optional[np.ndarray] = None) -> list[Passage]:
+        """
+        Find the passages most similar to a query, embedding pending changes first.
+
+        Args:
+            query: Text to embed and compare
+            limit: Maximum number of passages
+            doc_ids: Only score the passages of these documents, if given
+
+        Returns:
+            Up to limit passages, most similar first
+        """
+        self.sync()
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            hits = self._nearest_rows(query_vector, limit, doc_ids)
+            found = [
+                (int(self.matrix.columns['docs'].array[row]), *self.matrix.columns['spans'].array[row].tolist(), score)
+                for row, score in hits
+            ]
+
+        passages = []
+        for doc_id, start, end, score in found:
+            doc = self.doc_loader(doc_id)
+            if doc is not None:
+                passages.append(Passage(doc_id=doc_id, start=start, end=end, text=doc.content[start:end], score=score))
+        return passages
+
+    def _nearest_rows(
+        self, query_vector: np.ndarray, limit: int, doc_ids: Optional[np.ndarray] = None,
+    ) -> list[tuple[int, float]]:
+        """(row, score) of the rows nearest a query vector, called with the lock held."""
+        matrix = self.matrix
+        live = self.live[:matrix.row_count]
+        if doc_ids is not None:
+            live = live & np.isin(matrix.column('docs'), doc_ids, kind='table')
+        if self.approximate and matrix.centroids is not None:
+            probes = np.argsort(-(matrix.centroids @ query_vector))[:self.ivf_probes]
+            rows = np.flatnonzero(np.isin(matrix.column('lists'), probes) & live)
+        else:
+            rows = np.flatnonzero(live)
+        if not len(rows) or limit <= 0:
+            return []
+
+        # Scoring every row saves gathering the live ones, unless most are dead
+        score_all = len(rows) > matrix.row_count / 2
+        scores = matrix.approximate_scores(query_vector, None if score_all else rows)
+        if score_all:
+            scores[~live] = -np.inf
+
+        candidate_count = min(limit * RERANK_FACTOR if matrix.is_quantized else limit, len(scores))
+        top = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+        top = top[np.isfinite(scores[top])]
+        top_rows = top if score_all else rows[top]
+        if matrix.is_quantized:
+            # Re-rank with the float vectors, reading only these rows of them
+            top_rows = np.sort(top_rows)
+            scores_top = matrix.exact_scores(query_vector, top_rows)
+        else:
+            scores_top = scores[top]
+
+        order = np.argsort(-scores_top, kind='stable')[:limit]
+        return [
+            (int(top_rows[i]), float(scores_top[i]))
+            for i in order
+            if scores_top[i] > 0  # Unrelated passages
+        ]
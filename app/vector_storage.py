@@ -0,0 +1,382 @@
+"""
+Storage of the passage embeddings of a VectorIndex.
+
+EmbeddingMatrix keeps one row per passage in column arrays, either in memory
+or memory-mapped from files in an index directory. Mapped columns are only
+paged in as they are read, so opening an index costs the same whatever its
+size, and an index far larger than memory can still be searched.
+
+Searches score the rows against a compact, quantized copy of the vectors,
+then re-rank the best candidates with the full float32 vectors, so only a
+handful of float rows are read per query:
+
+    int8    One byte per dimension plus a scale per row, 4x smaller
+    pq      Product quantization, one byte per subspace of PQ_SUBSPACE_DIMENSIONS
+            dimensions, 32x smaller by default, after training on the first
+            PQ_MIN_ROWS passages
+
+Files are never rewritten in place. Rows are only appended, and rewrites, by
+compaction or training, go to a new generation of files, so the files of the
+generation a saved index refers to stay intact.
+"""
+
+import io
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from .atomic_io import atomic_write_bytes
+
+MIN_CAPACITY = 1024
+SCORE_BLOCK_ROWS = 8192  # Rows scored at once, bounds the scratch memory of a search
+
+PQ_CODEBOOK_SIZE = 256  # Centroids per subspace, each code is a byte
+PQ_SUBSPACE_DIMENSIONS = 8
+PQ_MIN_ROWS = 4096  # Searches are exact until there are enough rows to train on
+PQ_TRAIN_SAMPLE_ROWS = 32768
+KMEANS_ITERATIONS = 8
+
+
+class Quantizations:
+    """Compact copies of the vectors searches score against, by name."""
+
+    NONE = 'none'
+    INT8 = 'int8'
+    PQ = 'pq'
+
+    ALL = (NONE, INT8, PQ)
+
+
+class GrowableArray:
+    """
+    A (rows, *row_shape) array growing by doubling, in memory or mapped from a file.
+
+    Args:
+        dtype: Element type
+        row_shape: Shape of each row
+        path: File to map, created if missing; in memory if None
+    """
+
+    def __init__(self, dtype, row_shape: tuple = (), path: Optional[Path] = None):
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.path = path
+        self.row_nbytes = self.dtype.itemsize * int(np.prod(row_shape, dtype=np.int64))
+        existing_rows = path.stat().st_size // self.row_nbytes if path is not None and path.exists() else 0
+        self.array = self._allocate(existing_rows)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        if self.path is None or not capacity:
+            return np.zeros((capacity, *self.row_shape), dtype=self.dtype)
+        with open(self.path, 'ab') as file:
+            if file.tell() < capacity * self.row_nbytes:
+                file.truncate(capacity * self.row_nbytes)  # Extended with zeros
+        return np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(capacity, *self.row_shape))
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def reserve(self, rows: int) -> None:
+        """Make room for at least this many rows."""
+        if rows <= len(self.array):
+            return
+        capacity = max(MIN_CAPACITY, rows, 2 * len(self.array))
+        if self.path is None:
+            grown = np.zeros((capacity, *self.row_shape), dtype=self.dtype)
+            grown[:len(self.array)] = self.array
+            self.array = grown
+        else:
+            self.flush()
+            # Growing the file leaves existing mappings of it valid
+            self.array = self._allocate(capacity)
+
+    def flush(self) -> None:
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+
+
+def _save_array(path: Path, array: np.ndarray) -> None:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    atomic_write_bytes(path, buffer.getvalue())
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Per-row symmetric int8 quantization, as (codes, scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    safe_scales = np.where(scales > 0, scales, 1)
+    codes = np.rint(vectors / safe_scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def kmeans(samples: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, spherical: bool = False) -> np.ndarray:
+    """
+    Lloyd's k-means, seeded from random samples.
+
+    Spherical k-means assigns by dot product and keeps unit-length centroids,
+    for unit-length samples; otherwise by Euclidean distance.
+    """
+    rng = np.random.default_rng(0)
+    k = min(k, len(samples))
+    centroids = samples[rng.choice(len(samples), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = assign_clusters(samples, centroids, spherical)
+        # Summing through a one-hot matrix product is much faster than np.add.at
+        one_hot = np.zeros((len(samples), k), dtype=np.float32)
+        one_hot[np.arange(len(samples)), assignments] = 1
+        sums = one_hot.T @ samples
+        counts = np.bincount(assignments, minlength=k)
+        has_members = counts > 0
+        # Clusters left empty keep their previous centroid
+        if spherical:
+            norms = np.linalg.norm(sums[has_members], axis=1, keepdims=True)
+            centroids[has_members] = sums[has_members] / np.maximum(norms, 1e-12)
+        else:
+            centroids[has_members] = sums[has_members] / counts[has_members, None]
+    return centroids
+
+
+def assign_clusters(samples: np.ndarray, centroids: np.ndarray, spherical: bool = False) -> np.ndarray:
+    if spherical:
+        return np.argmax(samples @ centroids.T, axis=1).astype(np.int32)
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, the first term does not change the argmin
+    distances = -2 * samples @ centroids.T + (centroids ** 2).sum(axis=1)
+    return np.argmin(distances, axis=1).astype(np.int32)
+
+
+class EmbeddingMatrix:
+    """
+    Passage embeddings and their rows' metadata, as columns of a matrix.
+
+    Not thread-safe, the VectorIndex owning it serializes access.
+
+    Args:
+        dimension: Dimension of the embeddings
+        quantization: See Quantizations
+        index_dir: Directory to map the columns from, in memory if None
+        generation: Generation of the files to map, see the module docstring
+        row_count: Number of valid rows in the files
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        quantization: str = Quantizations.NONE,
+        index_dir: Optional[Path] = None,
+        generation: int = 0,
+        row_count: int = 0,
+    ):
+        if quantization not in Quantizations.ALL:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if quantization == Quantizations.PQ and dimension % PQ_SUBSPACE_DIMENSIONS:
+            raise ValueError(f"PQ needs a dimension divisible by {PQ_SUBSPACE_DIMENSIONS}, not {dimension}")
+
+        self.dimension = dimension
+        self.quantization = quantization
+        self.index_dir = index_dir
+        self.generation = generation
+        self.row_count = row_count
+        self._open_columns(generation)
+        self._old_columns: Optional[dict[str, GrowableArray]] = None  # Of the previous generation, until saved
+
+        self.centroids: Optional[np.ndarray] = self._load_array('centroids')  # Clusters, for approximate search
+        self.codebooks: Optional[np.ndarray] = self._load_array('codebooks')  # (subspaces, PQ_CODEBOOK_SIZE, sub-dimension)
+
+    def _path(self, name: str, generation: int) -> Optional[Path]:
+        return self.index_dir / f"{name}-{generation}.bin" if self.index_dir is not None else None
+
+    def _open_columns(self, generation: int, fresh: bool = False) -> None:
+        if fresh and self.index_dir is not None:
+            # Left over by a rewrite interrupted before its generation was saved
+            for path in self.index_dir.glob(f"*-{generation}.*"):
+                path.unlink()
+        self.columns = {
+            'vectors': GrowableArray(np.float32, (self.dimension,), self._path('vectors', generation)),
+            'docs': GrowableArray(np.int64, (), self._path('docs', generation)),
+            'spans': GrowableArray(np.int64, (2,), self._path('spans', generation)),
+            'keys': GrowableArray(np.uint64, (), self._path('keys', generation)),  # What each row's vector is of
+            'lists': GrowableArray(np.int32, (), self._path('lists', generation)),
+        }
+        if self.quantization == Quantizations.INT8:
+            self.columns['codes'] = GrowableArray(np.int8, (self.dimension,), self._path('codes', generation))
+            self.columns['scales'] = GrowableArray(np.float32, (), self._path('scales', generation))
+        elif self.quantization == Quantizations.PQ:
+            subspaces = self.dimension // PQ_SUBSPACE_DIMENSIONS
+            self.columns['codes'] = GrowableArray(np.uint8, (subspaces,), self._path('codes', generation))
+
+    def _load_array(self, name: str) -> Optional[np.ndarray]:
+        if self.index_dir is None:
+            return None
+        path = self.index_dir / f"{name}-{self.generation}.npy"
+        return np.load(path) if path.exists() else None
+
+    def column(self, name: str) -> np.ndarray:
+        """The valid rows of a column."""
+        return self.columns[name].array[:self.row_count]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.column('vectors')
+
+    @property
+    def is_quantized(self) -> bool:
+        """Whether searches score against quantized vectors, PQ only once trained."""
+        return self.quantization == Quantizations.INT8 or self.codebooks is not None
+
+    def append(
+        self,
+        vectors: np.ndarray,
+        doc_ids: Union[Sequence[int], np.ndarray],
+        spans: Union[Sequence[tuple[int, int]], np.ndarray],
+        keys: Union[Sequence[int], np.ndarray],
+    ) -> int:
+        """
+        Append rows.
+
+        Args:
+            vectors: The embeddings
+            doc_ids: The document of each row
+            spans: The (start, end) offsets of each row's text in its document
+            keys: A hash of each row's embedded text, rows of the same key have the same vector
+
+        Returns:
+            The first new row
+        """
+        first_row = self.row_count
+        if not len(vectors):
+            return first_row
+        rows = slice(first_row, first_row + len(vectors))
+        for column in self.columns.values():
+            column.reserve(rows.stop)
+
+        self.columns['vectors'].array[rows] = vectors
+        self.columns['docs'].array[rows] = doc_ids
+        self.columns['spans'].array[rows] = spans
+        self.columns['keys'].array[rows] = keys
+        if self.centroids is not None:
+            self.columns['lists'].array[rows] = assign_clusters(vectors, self.centroids, spherical=True)
+        self._encode(vectors, rows)
+        self.row_count = rows.stop
+        return first_row
+
+    def _encode(self, vectors: np.ndarray, rows: slice) -> None:
+        if self.quantization == Quantizations.INT8:
+            self.columns['codes'].array[rows], self.columns['scales'].array[rows] = quantize_int8(vectors)
+        elif self.quantization == Quantizations.PQ and self.codebooks is not None:
+            self.columns['codes'].array[rows] = self._pq_encode(vectors)
+
+    def _pq_encode(self, vectors: np.ndarray) -> np.ndarray:
+        codebooks = self.codebooks
+        assert codebooks is not None, "Codebooks should be trained before encoding."
+        subvectors = vectors.reshape(len(vectors), len(codebooks), -1)
+        codes = np.empty((len(vectors), len(codebooks)), dtype=np.uint8)
+        for subspace, codebook in enumerate(codebooks):
+            codes[:, subspace] = assign_clusters(subvectors[:, subspace], codebook)
+        return codes
+
+    def train_codebooks(self, live_rows: np.ndarray) -> None:
+        """Learn the PQ codebooks from a sample of the rows, and encode every row."""
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(live_rows, min(len(live_rows), PQ_TRAIN_SAMPLE_ROWS), replace=False))
+        sample = np.asarray(self.columns['vectors'].array[sample_rows])
+        subspaces = self.dimension // PQ_SUBSPACE_DIMENSIONS
+        subvectors = sample.reshape(len(sample), subspaces, PQ_SUBSPACE_DIMENSIONS)
+        self.codebooks = np.stack([kmeans(subvectors[:, subspace], PQ_CODEBOOK_SIZE) for subspace in range(subspaces)])
+
+    def train_clusters(self, live_rows: np.ndarray, cluster_count: int, sample_rows: int) -> None:
+        """Cluster a sample of the rows for approximate search, see rewrite() to assign every row."""
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self.columns['vectors'].array[np.sort(rng.choice(live_rows, sample_rows, replace=False))])
+        self.centroids = kmeans(sample, cluster_count, spherical=True)
+
+    def rewrite(self, keep: np.ndarray) -> np.ndarray:
+        """
+        Write the kept rows, encoded with the current codebooks and clusters, to a new generation.
+
+        Args:
+            keep: Whether to keep each row
+
+        Returns:
+            The new row of each old one, -1 for the dropped ones
+        """
+        old_columns = self.columns
+        new_rows = np.cumsum(keep) - 1
+        new_rows[~keep] = -1
+
+        self.generation += 1
+        self._open_columns(self.generation, fresh=True)
+        self.row_count = 0
+        kept = np.flatnonzero(keep)
+        for start in range(0, len(kept), SCORE_BLOCK_ROWS):
+            block = kept[start:start + SCORE_BLOCK_ROWS]
+            self.append(
+                np.asarray(old_columns['vectors'].array[block]),
+                old_columns['docs'].array[block],
+                old_columns['spans'].array[block],
+                old_columns['keys'].array[block],
+            )
+        self._old_columns = old_columns
+        return new_rows
+
+    def flush(self) -> None:
+        """Write the columns and trained arrays of the current generation to disk."""
+        if self.index_dir is None:
+            return
+        for column in self.columns.values():
+            column.flush()
+        for name in ('centroids', 'codebooks'):
+            array = getattr(self, name)
+            path = self.index_dir / f"{name}-{self.generation}.npy"
+            if array is not None and not path.exists():
+                _save_array(path, array)
+
+    def delete_old_generations(self) -> None:
+        """Delete the files of earlier generations, once the current one is saved."""
+        self._old_columns = None
+        if self.index_dir is None:
+            return
+        for path in self.index_dir.iterdir():
+            stem = path.stem
+            if '-' in stem and stem.rsplit('-', 1)[1].isdigit() and int(stem.rsplit('-', 1)[1]) < self.generation:
+                path.unlink(missing_ok=True)
+
+    # Scoring
+
+    def approximate_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Scores of rows against a unit-length query, from the quantized vectors if any.
+
+        Args:
+            query: The query vector
+            rows: Rows to score, every valid row if None
+        """
+        if not self.is_quantized:
+            return self.exact_scores(query, rows)
+
+        count = self.row_count if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        if self.quantization == Quantizations.PQ:
+            codebooks = self.codebooks
+            assert codebooks is not None, "PQ is only scored against once trained."
+            # Asymmetric distance: the query stays float, each code looks up its dot product
+            tables = np.einsum('skd,sd->sk', codebooks, query.reshape(len(codebooks), -1))
+            subspaces = np.arange(len(codebooks))
+        else:
+            dequantized = np.empty((min(count, SCORE_BLOCK_ROWS), self.dimension), dtype=np.float32)
+        for start in range(0, count, SCORE_BLOCK_ROWS):
+            block = slice(start, min(start + SCORE_BLOCK_ROWS, count))
+            block_rows: Union[slice, np.ndarray] = block if rows is None else rows[block]
+            codes = self.columns['codes'].array[block_rows]
+            if self.quantization == Quantizations.INT8:
+                block_dequantized = dequantized[:len(codes)]
+                np.copyto(block_dequantized, codes)
+                scores[block] = (block_dequantized @ query) * self.columns['scales'].array[block_rows]
+            else:
+                scores[block] = tables[subspaces, codes].sum(axis=1)
+        return scores
+
+    def exact_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is None:
+            return self.vectors @ query
+        return self.columns['vectors'].array[rows] @ query
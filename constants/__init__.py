@@ -29,3 +29,4 @@ class FilePaths:
     GOOGLE_CLOUD_API_TOKEN = GMAIL_DIR / "google-cloud-api-token.pickle"
     PARSED_EMAILS_DIR = GMAIL_DIR / "parsed-emails"
     PARSED_EMAILS_DIR.mkdir(parents=True, exist_ok=True)
+    INGEST_REPORTS_DIR = GMAIL_DIR / "ingest-reports"
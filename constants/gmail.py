@@ -11,6 +11,15 @@ class GmailAPIMessageKeys:
     INTERNAL_DATE = "internalDate"
 
 
+class GmailAPIThreadKeys:
+    """Class representing keys for the ThreadResponse."""
+
+    ID = "id"
+    HISTORY_ID = "historyId"
+    SNIPPET = "snippet"
+    MESSAGES = "messages"
+
+
 class GmailAPIHeaderKeys:
     """Constants for header dictionary keys."""
 
@@ -32,8 +41,25 @@ class GmailAPIPayloadKeys:
     HEADERS: str = "headers"
 
 
+class IngestFailureStages:
+    """Stages of the ingest at which a message or thread can fail."""
+
+    FETCH: str = "fetch"
+    PARSE: str = "parse"
+    STORE: str = "store"
+
+
 class ListMessagesKeys:
     """Class representing keys for the ListMessagesResponse."""
 
     ID = "id"
     THREAD_ID = "threadId"
+
+
+class ListThreadsKeys:
+    """Class representing keys for the ListThreadsResponse."""
+
+    THREADS = "threads"
+    ID = "id"
+    HISTORY_ID = "historyId"
+    SNIPPET = "snippet"
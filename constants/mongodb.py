@@ -4,20 +4,72 @@ class MongoDatabaseNames:
 
 class MongoDBCollections:
     MESSAGES: str = "messages"
+    THREADS: str = "threads"
+    ATTACHMENT_TEXT_CACHE: str = "attachment_text_cache"
+    DEAD_LETTERS: str = "dead_letters"
 
 
 class MessageDocumentKeys:
     """Constants for MongoDB document keys."""
 
     MESSAGE_ID: str = "message_id"
+    THREAD_ID: str = "thread_id"
+    INTERNAL_DATE: str = "internal_date"
     SENDER: str = "sender"
     SNIPPET: str = "snippet"
     SUBJECT: str = "subject"
     BODY: str = "body"
+    ORIGINAL_BODY_S3_KEY: str = "original_body_s3_key"
+    ORIGINAL_BODY_SIZE: str = "original_body_size"
     DATE_RECEIVED: str = "date_received"
     PROCESSED_AT: str = "processed_at"
     CONTENT_TYPE: str = "content_type"
     ATTACHMENTS: str = "attachments"
+    MINHASH: str = "minhash"
+    DUPLICATE_OF: str = "duplicate_of"
+
+
+class ThreadDocumentKeys:
+    """Constants for MongoDB thread document keys."""
+
+    THREAD_ID: str = "thread_id"
+    HISTORY_ID: str = "history_id"
+    SUBJECT: str = "subject"
+    SNIPPET: str = "snippet"
+    PARTICIPANTS: str = "participants"
+    MESSAGE_IDS: str = "message_ids"
+    MESSAGE_COUNT: str = "message_count"
+    FIRST_MESSAGE_AT: str = "first_message_at"
+    LAST_MESSAGE_AT: str = "last_message_at"
+    PROCESSED_AT: str = "processed_at"
+
+
+class DeadLetterDocumentKeys:
+    """Constants for MongoDB dead-letter document keys."""
+
+    ITEM_ID: str = "item_id"
+    ITEM_TYPE: str = "item_type"
+    STAGE: str = "stage"
+    ERROR: str = "error"
+    ERROR_TYPE: str = "error_type"
+    ATTEMPTS: str = "attempts"
+    STATUS: str = "status"
+    FIRST_FAILED_AT: str = "first_failed_at"
+    LAST_FAILED_AT: str = "last_failed_at"
+
+
+class DeadLetterItemTypes:
+    """Kinds of items that can be dead-lettered."""
+
+    MESSAGE: str = "message"
+    THREAD: str = "thread"
+
+
+class DeadLetterStatuses:
+    """Statuses of a dead-letter document."""
+
+    PENDING: str = "pending"
+    EXHAUSTED: str = "exhausted"
 
 
 class PartKeys:
@@ -39,3 +91,13 @@ class AttachmentDocumentKeys:
     MIME_TYPE: str = "content_type"
     S3_BUCKET: str = "s3_bucket"
     S3_KEY: str = "s3_key"
+    CONTENT_HASH: str = "content_hash"
+
+
+class AttachmentTextCacheKeys:
+    """Constants for the extracted attachment text cache documents."""
+
+    CONTENT_HASH: str = "content_hash"
+    TEXT_CONTENT: str = "text_content"
+    MIME_TYPE: str = "content_type"
+    EXTRACTED_AT: str = "extracted_at"
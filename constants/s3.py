@@ -3,3 +3,4 @@ class S3Constants:
 
     BUCKET_NAME: str = "memory-machine-receiving"
     ATTACHMENT_KEY_PREFIX: str = "attachments/"
+    ORIGINAL_BODY_KEY_PREFIX: str = "original-bodies/"
@@ -0,0 +1,154 @@
+"""
+Dead-letter queue for Gmail ingest failures.
+
+Messages (or threads) that fail at any stage of the ingest are recorded in a
+MongoDB collection with the failing stage and error, instead of only being
+logged. ``GmailMessageProcessor.retry_dead_letters`` then re-processes just
+those items, so a transient failure costs one targeted retry rather than a
+full mailbox re-scan.
+"""
+
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+
+from pydantic import BaseModel
+from pymongo import ASCENDING
+
+from constants import DeadLetterDocumentKeys, DeadLetterItemTypes, DeadLetterStatuses
+
+
+class RetryPolicy(BaseModel):
+    """Exponential backoff policy for retrying dead-lettered items."""
+
+    max_attempts: int = 5  # Per item and retry run
+    base_delay_seconds: float = 1.0
+    max_delay_seconds: float = 60.0
+    jitter: float = 0.1  # Fraction of the delay added at random
+
+    def delay_for(self, attempt: int) -> float:
+        """
+        Get the delay to wait before the given retry attempt.
+
+        Parameters
+        ----------
+        attempt : int
+            The 1-based number of the attempt about to be made.
+
+        Returns
+        -------
+        float
+            The delay in seconds.
+        """
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** max(attempt - 1, 0))
+        return delay + random.uniform(0, delay * self.jitter)
+
+
+class DeadLetterQueue:
+    """
+    Persistent record of the items that failed to ingest.
+
+    There is at most one record per item, failing again increments its
+    count of failed attempts, overwrites the last stage and error and makes
+    it pending again.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index(
+            [
+                (DeadLetterDocumentKeys.ITEM_TYPE, ASCENDING),
+                (DeadLetterDocumentKeys.ITEM_ID, ASCENDING),
+            ],
+            unique=True,
+        )
+        self.collection.create_index(DeadLetterDocumentKeys.STATUS)
+
+    def record_failure(
+        self,
+        item_id: str,
+        stage: str,
+        error: BaseException,
+        item_type: str = DeadLetterItemTypes.MESSAGE,
+    ) -> None:
+        """
+        Record that an item failed to ingest.
+
+        Parameters
+        ----------
+        item_id : str
+            The Gmail message (or thread) ID.
+        stage : str
+            The ingest stage that failed, one of IngestFailureStages.
+        error : BaseException
+            The error raised by the stage.
+        item_type : str
+            Whether the item is a message or a thread.
+        """
+        now = datetime.now()
+        self.collection.update_one(
+            {
+                DeadLetterDocumentKeys.ITEM_TYPE: item_type,
+                DeadLetterDocumentKeys.ITEM_ID: item_id,
+            },
+            {
+                "$set": {
+                    DeadLetterDocumentKeys.STAGE: stage,
+                    DeadLetterDocumentKeys.ERROR: str(error),
+                    DeadLetterDocumentKeys.ERROR_TYPE: type(error).__name__,
+                    DeadLetterDocumentKeys.STATUS: DeadLetterStatuses.PENDING,
+                    DeadLetterDocumentKeys.LAST_FAILED_AT: now,
+                },
+                "$setOnInsert": {DeadLetterDocumentKeys.FIRST_FAILED_AT: now},
+                "$inc": {DeadLetterDocumentKeys.ATTEMPTS: 1},
+            },
+            upsert=True,
+        )
+
+    def pending(self, item_type: str | None = None, limit: int = 0) -> list[dict]:
+        """Get the items still waiting to be retried, oldest failure first."""
+        query: dict = {DeadLetterDocumentKeys.STATUS: DeadLetterStatuses.PENDING}
+        if item_type:
+            query[DeadLetterDocumentKeys.ITEM_TYPE] = item_type
+
+        cursor = self.collection.find(query).sort(DeadLetterDocumentKeys.FIRST_FAILED_AT, ASCENDING)
+        return list(cursor.limit(limit))
+
+    def resolve(self, item_id: str, item_type: str = DeadLetterItemTypes.MESSAGE) -> None:
+        """Remove an item from the queue once it has been ingested."""
+        self.collection.delete_one(
+            {
+                DeadLetterDocumentKeys.ITEM_TYPE: item_type,
+                DeadLetterDocumentKeys.ITEM_ID: item_id,
+            }
+        )
+
+    def mark_exhausted(self, item_id: str, item_type: str = DeadLetterItemTypes.MESSAGE) -> None:
+        """Stop retrying an item that has used up its retry attempts."""
+        self.collection.update_one(
+            {
+                DeadLetterDocumentKeys.ITEM_TYPE: item_type,
+                DeadLetterDocumentKeys.ITEM_ID: item_id,
+            },
+            {"$set": {DeadLetterDocumentKeys.STATUS: DeadLetterStatuses.EXHAUSTED}},
+        )
+
+
+class IngestStageError(Exception):
+    """Raised when an ingest stage fails, the original error is chained as the cause."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Ingest failed at stage '{stage}'")
+        self.stage = stage
+
+
+@contextmanager
+def ingest_stage(stage: str) -> Iterator[None]:
+    """Tag any error raised inside the block with the ingest stage it happened in."""
+    try:
+        yield
+    except IngestStageError:
+        raise
+    except Exception as e:
+        raise IngestStageError(stage) from e
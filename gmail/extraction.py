@@ -0,0 +1,385 @@
+"""
+Text extraction for email attachments.
+
+Extractors are dispatched by MIME type and run in a process pool, so parsing
+PDFs or office documents does not stall the Gmail/S3/MongoDB round-trips of the
+ingest loop. Extraction is submitted with ``submit`` and collected later, so
+the loop can fetch the next message while the pool parses. Extracted text is
+cached by the SHA-256 of the attachment data, in MongoDB and, within a byte
+budget, in memory, so identical attachments (the same PDF sent to several
+threads, re-ingested messages, ...) are only ever extracted once. Failed
+extractions are not cached, they are retried the next time the attachment is
+seen.
+"""
+
+import hashlib
+import io
+import mimetypes
+import re
+import threading
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import TYPE_CHECKING, Callable
+from xml.etree import ElementTree
+
+from app.content_cache import ContentLRU
+from constants import AttachmentTextCacheKeys
+from custom_logging import getLogger
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+
+    from gmail.processor import Attachment
+
+logger = getLogger(__name__)
+
+# Text attachments smaller than this are decoded in-process, a round-trip to
+# the pool would cost more than the decode itself
+INLINE_EXTRACTION_MAX_BYTES = 64 * 1024
+
+GENERIC_MIME_TYPES = {None, "", "application/octet-stream"}
+
+# Extracted text kept in memory, the rest is read back from MongoDB
+DEFAULT_MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class ExtractionError(Exception):
+    """Extracting the text of an attachment failed, it is retried next time."""
+
+
+def content_hash(data: bytes) -> str:
+    """Hash attachment data, used as the extraction cache key."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _decode_text(data: bytes) -> str:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects the visible text of an HTML document."""
+
+    SKIPPED_TAGS = {"script", "style", "head", "title"}
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table"}
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: list[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+
+def _extract_html(data: bytes) -> str | None:
+    text = _decode_text(data)
+
+    parser = _HTMLTextParser()
+    parser.feed(text)
+    parser.close()
+
+    collapsed = re.sub(r"[ \t]+", " ", "".join(parser.chunks))
+    return re.sub(r"\n\s*\n+", "\n\n", collapsed).strip()
+
+
+def _extract_pdf(data: bytes) -> str | None:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("pypdf is not installed, PDF text cannot be extracted")
+
+    reader = PdfReader(io.BytesIO(data))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages).strip()
+
+
+def _extract_zipped_xml_text(data: bytes, member_pattern: str, text_tags: set[str]) -> str | None:
+    """Extract the text nodes of the XML members of a zipped office document."""
+    paragraphs = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        members = sorted(name for name in archive.namelist() if re.fullmatch(member_pattern, name))
+        for member in members:
+            root = ElementTree.fromstring(archive.read(member))
+            for element in root.iter():
+                # Tags are namespaced, e.g. "{http://...wordprocessingml...}t"
+                if element.tag.rsplit("}", 1)[-1] in text_tags and element.text:
+                    paragraphs.append(element.text)
+    return "\n".join(paragraphs).strip()
+
+
+def _extract_docx(data: bytes) -> str | None:
+    return _extract_zipped_xml_text(data, r"word/document\.xml", {"t"})
+
+
+def _extract_pptx(data: bytes) -> str | None:
+    return _extract_zipped_xml_text(data, r"ppt/slides/slide\d+\.xml", {"t"})
+
+
+def _extract_xlsx(data: bytes) -> str | None:
+    return _extract_zipped_xml_text(data, r"xl/sharedStrings\.xml", {"t"})
+
+
+def _extract_odf(data: bytes) -> str | None:
+    return _extract_zipped_xml_text(data, r"content\.xml", {"p", "h", "span"})
+
+
+TEXT_EXTRACTORS: dict[str, Callable[[bytes], str | None]] = {
+    "text/plain": _decode_text,
+    "text/markdown": _decode_text,
+    "text/x-markdown": _decode_text,
+    "text/csv": _decode_text,
+    "application/json": _decode_text,
+    "text/html": _extract_html,
+    "application/pdf": _extract_pdf,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": _extract_docx,
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": _extract_pptx,
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": _extract_xlsx,
+    "application/vnd.oasis.opendocument.text": _extract_odf,
+}
+
+
+def resolve_mime_type(mime_type: str | None, filename: str) -> str | None:
+    """Use the declared MIME type, falling back to a guess from the file name."""
+    if mime_type in GENERIC_MIME_TYPES:
+        guessed, _ = mimetypes.guess_type(filename)
+        if filename.endswith(".md"):
+            guessed = "text/markdown"
+        return guessed
+    return mime_type
+
+
+def get_extractor(mime_type: str | None) -> Callable[[bytes], str | None] | None:
+    """The extractor of a MIME type, None if the type is unsupported."""
+    extractor = TEXT_EXTRACTORS.get(mime_type or "")
+    if extractor is None and mime_type and mime_type.startswith("text/"):
+        return _decode_text
+    return extractor
+
+
+def extract_text(mime_type: str | None, data: bytes) -> str | None:
+    """
+    Extract the text of an attachment.
+
+    Runs inside the worker processes, so it must stay a module-level function.
+
+    Parameters
+    ----------
+    mime_type : str | None
+        The resolved MIME type of the attachment.
+    data : bytes
+        The attachment data.
+
+    Returns
+    -------
+    str | None
+        The extracted text, or None if the type is unsupported.
+
+    Raises
+    ------
+    ExtractionError
+        If parsing failed.
+    """
+    extractor = get_extractor(mime_type)
+    if extractor is None:
+        return None
+
+    try:
+        return extractor(data)
+    except ExtractionError:
+        raise
+    except Exception as e:
+        # Raised as a plain message, parser exceptions do not always pickle back from the pool
+        raise ExtractionError(f"Failed to extract text from {mime_type} attachment: {e}") from None
+
+
+class PendingExtraction:
+    """
+    Attachments submitted for text extraction, see ``AttachmentTextExtractor.submit``.
+
+    Parameters
+    ----------
+    extractor : AttachmentTextExtractor
+        The extractor the attachments were submitted to.
+    attachments : list[Attachment]
+        The attachments to fill in.
+    futures : dict[str, tuple[str | None, Future]]
+        Content hash -> (MIME type, extraction running in the pool).
+    results : dict[str, str | None]
+        Content hash -> text of the attachments already resolved.
+    """
+
+    def __init__(
+        self,
+        extractor: "AttachmentTextExtractor",
+        attachments: list["Attachment"],
+        futures: dict[str, tuple[str | None, Future]],
+        results: dict[str, str | None],
+    ):
+        self.extractor = extractor
+        self.attachments = attachments
+        self.futures = futures
+        # Held here rather than read back from the memory cache, which may have evicted them
+        self.results = results
+
+    def wait(self) -> None:
+        """Wait for the extractions and fill in the ``text_content`` of the attachments."""
+        for hash_, (mime_type, future) in self.futures.items():
+            try:
+                text = future.result()
+            except Exception as e:
+                logger.warning(f"Text extraction for attachment {hash_} failed: {e}")
+                continue
+            self.extractor._store_cached(hash_, mime_type, text)
+            self.results[hash_] = text
+        self.futures = {}
+
+        for attachment in self.attachments:
+            attachment.text_content = self.results.get(attachment.content_hash or "")
+
+
+class AttachmentTextExtractor:
+    """
+    Fills in the ``text_content`` of attachments.
+
+    Thread-safe, the pool and the memory cache are shared by the threads using it.
+
+    Parameters
+    ----------
+    cache_collection : Collection | None
+        MongoDB collection persisting extracted text by content hash.
+        If None, only the in-memory cache is used.
+    max_workers : int | None
+        Size of the process pool, defaults to the number of CPUs.
+    memory_cache_bytes : int
+        Budget of the least recently used extracted text kept in memory.
+    """
+
+    def __init__(
+        self,
+        cache_collection: "Collection | None" = None,
+        max_workers: int | None = None,
+        memory_cache_bytes: int = DEFAULT_MEMORY_CACHE_BYTES,
+    ):
+        self.cache_collection = cache_collection
+        self.max_workers = max_workers
+        # Thread-safe on its own, hot text as strings and the least recent compressed
+        self._memory_cache = ContentLRU(byte_budget=memory_cache_bytes // 2, warm_byte_budget=memory_cache_bytes // 2)
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()  # Guards the pool
+
+        if self.cache_collection is not None:
+            self.cache_collection.create_index(AttachmentTextCacheKeys.CONTENT_HASH, unique=True)
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Started lazily, runs without CPU-heavy attachments never pay for it
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _load_cached(self, hashes: set[str]) -> dict[str, str]:
+        """Get the cached extractions of the given hashes, from memory or else from MongoDB."""
+        cached: dict[str, str] = {}
+        for hash_ in hashes:
+            text = self._memory_cache.get(hash_)
+            if text is not None:
+                cached[hash_] = text
+        missing = [hash_ for hash_ in hashes if hash_ not in cached]
+        if not missing or self.cache_collection is None:
+            return cached
+
+        records = self.cache_collection.find({AttachmentTextCacheKeys.CONTENT_HASH: {"$in": missing}})
+        for record in records:
+            text = record.get(AttachmentTextCacheKeys.TEXT_CONTENT)
+            # Records without text are failures of earlier versions, extracted again
+            if text is not None:
+                hash_ = record[AttachmentTextCacheKeys.CONTENT_HASH]
+                self._memory_cache.put(hash_, text)
+                cached[hash_] = text
+        return cached
+
+    def _store_cached(self, hash_: str, mime_type: str | None, text: str | None) -> None:
+        if text is None:
+            return
+        self._memory_cache.put(hash_, text)
+        if self.cache_collection is None:
+            return
+
+        self.cache_collection.update_one(
+            {AttachmentTextCacheKeys.CONTENT_HASH: hash_},
+            {
+                "$set": {
+                    AttachmentTextCacheKeys.TEXT_CONTENT: text,
+                    AttachmentTextCacheKeys.MIME_TYPE: mime_type,
+                    AttachmentTextCacheKeys.EXTRACTED_AT: datetime.now(),
+                }
+            },
+            upsert=True,
+        )
+
+    def extract_attachments(self, attachments: list["Attachment"]) -> None:
+        """
+        Extract the text of the attachments in parallel, in place.
+
+        Attachments that already have text content are left untouched.
+        """
+        self.submit(attachments).wait()
+
+    def submit(self, attachments: list["Attachment"]) -> PendingExtraction:
+        """
+        Start extracting the text of the attachments, without waiting for it.
+
+        Cached, unsupported and small text attachments are resolved right away,
+        the others are parsed in the process pool until ``wait`` is called on
+        the returned extraction.
+        """
+        pending = [attachment for attachment in attachments if attachment.text_content is None]
+        for attachment in pending:
+            attachment.content_hash = attachment.content_hash or content_hash(attachment.data)
+        results: dict[str, str | None] = {}
+        results.update(self._load_cached({attachment.content_hash for attachment in pending if attachment.content_hash}))
+
+        futures: dict[str, tuple[str | None, Future]] = {}
+        for attachment in pending:
+            hash_ = attachment.content_hash
+            assert hash_ is not None
+            if hash_ in results or hash_ in futures:
+                continue
+
+            mime_type = resolve_mime_type(attachment.mime_type, attachment.filename)
+            extractor = get_extractor(mime_type)
+            if extractor is None:
+                results[hash_] = None
+            elif extractor is _decode_text and len(attachment.data) <= INLINE_EXTRACTION_MAX_BYTES:
+                text = _decode_text(attachment.data)
+                self._memory_cache.put(hash_, text)
+                results[hash_] = text
+            else:
+                futures[hash_] = (mime_type, self.pool.submit(extract_text, mime_type, attachment.data))
+
+        return PendingExtraction(self, pending, futures, results)
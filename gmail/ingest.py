@@ -8,6 +8,7 @@ import os
 from constants import FilePaths, S3Constants
 from custom_logging import getLogger
 from gmail.processor import GmailMessageProcessor
+from gmail.report import ReportFormats
 
 logger = getLogger(__name__)
 
@@ -18,6 +19,12 @@ if __name__ == "__main__":
     REPLACE_EXISTING = True  # Set to True to replace existing documents
     DRY_RUN = True  # Set to True for a dry run (no actual uploads to S3 or MongoDB)
     EMAIL_FILTER = os.getenv("EMAIL_FILTER", None)  # Optional email filter
+    THREAD_MODE = os.getenv("THREAD_MODE", "false").lower() == "true"  # Ingest whole threads
+    REPORT_FORMAT = os.getenv("REPORT_FORMAT", ReportFormats.HTML)  # "html" or "ndjson"
+    OPEN_REPORT = os.getenv("OPEN_REPORT", "false").lower() == "true"  # Open the report when done
+    # Estimated similarity from which a message nearly duplicates an earlier one, "none" to not check
+    NEAR_DUPLICATE_THRESHOLD = os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9")
+    MERGE_NEAR_DUPLICATES = os.getenv("MERGE_NEAR_DUPLICATES", "true").lower() == "true"
     if EMAIL_FILTER:
         logger.info(f"Using email filter: {EMAIL_FILTER}")
     else:
@@ -30,9 +37,25 @@ if __name__ == "__main__":
         dest_s3_bucket_name=S3Constants.BUCKET_NAME,
         check_interval=CHECK_INTERVAL,
         replace_existing=REPLACE_EXISTING,
+        near_duplicate_threshold=None if NEAR_DUPLICATE_THRESHOLD.lower() == "none" else float(NEAR_DUPLICATE_THRESHOLD),
+        merge_near_duplicates=MERGE_NEAR_DUPLICATES,
     )
 
-    processor.process_emails(
-        dry_run=DRY_RUN,
-        email_filter=EMAIL_FILTER,
-    )
+    if THREAD_MODE:
+        logger.info("Thread mode enabled, ingesting whole conversations.")
+        processor.process_threads(
+            dry_run=DRY_RUN,
+            email_filter=EMAIL_FILTER,
+            report_format=REPORT_FORMAT,
+            open_report=OPEN_REPORT,
+        )
+    else:
+        processor.process_emails(
+            dry_run=DRY_RUN,
+            email_filter=EMAIL_FILTER,
+            report_format=REPORT_FORMAT,
+            open_report=OPEN_REPORT,
+        )
+
+    # Stop the attachment text extraction workers
+    processor.text_extractor.shutdown()
@@ -0,0 +1,272 @@
+"""
+Normalization of email bodies at ingest.
+
+Reply chains repeat the full text of every earlier message, so storing raw
+bodies grows quadratically with thread length. This module reduces a body to
+the text its sender actually wrote by removing:
+
+- quoted history (``> ...`` lines and everything after an "On ... wrote:" or
+  "Original Message" reply header),
+- forwarded-message header blocks (the forwarded content itself is kept),
+- signatures, either after the RFC 3676 ``-- `` delimiter or repeated
+  trailing blocks already seen from the same sender that look like a name
+  or contact block rather than prose.
+"""
+
+import hashlib
+import re
+import threading
+
+from pydantic import BaseModel
+
+# Reply headers: everything from the header onwards is quoted history
+REPLY_HEADER_PATTERNS = [
+    # Gmail / Apple Mail, the attribution may wrap onto a second line
+    re.compile(r"^On\s[^\n]{0,300}(?:\n[^\n]{0,300})?\swrote:\s*$", re.MULTILINE),
+    # Outlook
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.MULTILINE | re.IGNORECASE),
+    re.compile(r"^_{10,}\s*\nFrom:\s", re.MULTILINE),
+    re.compile(r"^From:\s[^\n]+\n(?:Sent|Date):\s[^\n]+\n(?:To|Subject):\s", re.MULTILINE),
+]
+
+# Forwarded headers: the header block is dropped, the forwarded body is kept
+FORWARD_MARKER_PATTERN = re.compile(
+    r"^(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)\s*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+FORWARD_HEADER_LINE_PATTERN = re.compile(r"^(?:From|Date|Sent|Subject|To|Cc):\s", re.IGNORECASE)
+
+QUOTED_LINE_PATTERN = re.compile(r"^\s*>")
+
+# RFC 3676 signature delimiter, and the common mobile client footers
+SIGNATURE_DELIMITER_PATTERN = re.compile(r"^--\s?$", re.MULTILINE)
+MOBILE_SIGNATURE_PATTERN = re.compile(r"^Sent from my [^\n]+$", re.MULTILINE | re.IGNORECASE)
+
+# Longest trailing block (in lines) considered as a signature candidate
+MAX_SIGNATURE_LINES = 8
+# Longest line of a signature candidate, longer lines are prose
+MAX_SIGNATURE_LINE_CHARS = 60
+
+# A line ending a sentence is written text, not part of a name or contact block
+SENTENCE_END_PATTERN = re.compile(r"[.!?\u2026][\"')\]]*$")
+# A body reduced to a greeting has lost its text, not a signature
+GREETING_PATTERN = re.compile(
+    r"^(?:hi|hello|hey|dear|greetings|good (?:morning|afternoon|evening))\b[^\n]{0,60}$",
+    re.IGNORECASE,
+)
+
+
+class NormalizedBody(BaseModel):
+    """The result of normalizing an email body."""
+
+    text: str
+    original: str
+    removed_quoted_history: bool = False
+    removed_forward_headers: bool = False
+    removed_signature: bool = False
+
+    @property
+    def was_modified(self) -> bool:
+        """Whether normalization removed anything from the original body."""
+        return self.text != self.original
+
+
+def _normalize_newlines(text: str) -> str:
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def strip_quoted_history(text: str) -> tuple[str, bool]:
+    """
+    Remove quoted history from a reply.
+
+    Parameters
+    ----------
+    text : str
+        The email body.
+
+    Returns
+    -------
+    tuple[str, bool]
+        The body without quoted history, and whether anything was removed.
+    """
+    cut_at = len(text)
+    for pattern in REPLY_HEADER_PATTERNS:
+        match = pattern.search(text)
+        if match and match.start() < cut_at:
+            cut_at = match.start()
+
+    lines = text[:cut_at].split("\n")
+    kept_lines = [line for line in lines if not QUOTED_LINE_PATTERN.match(line)]
+
+    return "\n".join(kept_lines), cut_at < len(text) or len(kept_lines) < len(lines)
+
+
+def strip_forward_headers(text: str) -> tuple[str, bool]:
+    """
+    Remove forwarded-message header blocks, keeping the forwarded content.
+
+    Parameters
+    ----------
+    text : str
+        The email body.
+
+    Returns
+    -------
+    tuple[str, bool]
+        The body without forwarded headers, and whether anything was removed.
+    """
+    lines = text.split("\n")
+    kept_lines: list[str] = []
+    in_header_block = False
+    removed = False
+
+    for line in lines:
+        if FORWARD_MARKER_PATTERN.match(line):
+            in_header_block = True
+            removed = True
+            continue
+
+        if in_header_block:
+            # The header block ends at the first line that is not a header
+            if FORWARD_HEADER_LINE_PATTERN.match(line):
+                continue
+            in_header_block = False
+            if not line.strip():
+                continue
+
+        kept_lines.append(line)
+
+    return "\n".join(kept_lines), removed
+
+
+def _trailing_block(text: str) -> tuple[str, str]:
+    """Split the text into (everything before the last paragraph, the last paragraph)."""
+    stripped = text.rstrip()
+    split_at = stripped.rfind("\n\n")
+    if split_at == -1:
+        return "", stripped
+    return stripped[:split_at], stripped[split_at + 2:]
+
+
+def _looks_like_signature(head: str, block: str) -> bool:
+    """Whether a trailing block can be a signature, rather than the text written before it."""
+    lines = [line.strip() for line in block.split("\n") if line.strip()]
+    if not lines or len(lines) > MAX_SIGNATURE_LINES:
+        return False
+    if any(len(line) > MAX_SIGNATURE_LINE_CHARS or SENTENCE_END_PATTERN.search(line) for line in lines):
+        return False
+
+    head = head.strip()
+    return len(head) >= len(block.strip()) and not GREETING_PATTERN.match(head)
+
+
+def _fingerprint(block: str) -> str:
+    collapsed = " ".join(block.split()).lower()
+    return hashlib.sha1(collapsed.encode("utf-8")).hexdigest()
+
+
+class SignatureRegistry:
+    """
+    Remembers trailing blocks per sender so repeated signatures can be removed.
+
+    A trailing block is only treated as a signature once it has been seen
+    twice from the same sender, so a one-off closing paragraph is never lost.
+
+    Thread-safe, an ingest run shares it between the threads retrying messages.
+    """
+
+    def __init__(self):
+        self._seen: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def is_known(self, sender: str, block: str) -> bool:
+        fingerprint = _fingerprint(block)
+        with self._lock:
+            return fingerprint in self._seen.get(sender, ())
+
+    def remember(self, sender: str, block: str) -> None:
+        fingerprint = _fingerprint(block)
+        with self._lock:
+            self._seen.setdefault(sender, set()).add(fingerprint)
+
+
+class BodyNormalizer:
+    """
+    Normalizes email bodies so that only the newly written text is stored.
+
+    One normalizer should be shared across an ingest run so that signatures
+    repeated across a sender's messages are recognized.
+    """
+
+    def __init__(self, signature_registry: SignatureRegistry | None = None):
+        self.signature_registry = signature_registry or SignatureRegistry()
+
+    def strip_signature(self, text: str, sender: str | None = None) -> tuple[str, bool]:
+        """
+        Remove the signature from the end of a body.
+
+        Parameters
+        ----------
+        text : str
+            The email body, without quoted history.
+        sender : str | None
+            The sender, used to recognize repeated signatures.
+
+        Returns
+        -------
+        tuple[str, bool]
+            The body without its signature, and whether anything was removed.
+        """
+        for pattern in (SIGNATURE_DELIMITER_PATTERN, MOBILE_SIGNATURE_PATTERN):
+            match = None
+            for match in pattern.finditer(text):
+                pass
+            if match and text[:match.start()].strip():
+                return text[:match.start()], True
+
+        if not sender:
+            return text, False
+
+        head, block = _trailing_block(text)
+        if not _looks_like_signature(head, block):
+            return text, False
+
+        if self.signature_registry.is_known(sender, block):
+            return head, True
+
+        self.signature_registry.remember(sender, block)
+        return text, False
+
+    def normalize(self, body: str, sender: str | None = None) -> NormalizedBody:
+        """
+        Normalize an email body.
+
+        Parameters
+        ----------
+        body : str
+            The raw body of the email.
+        sender : str | None
+            The sender of the email, used to recognize repeated signatures.
+
+        Returns
+        -------
+        NormalizedBody
+            The normalized text along with the original body.
+        """
+        original = _normalize_newlines(body)
+
+        # Forward headers go first, so they are not mistaken for Outlook reply headers
+        text, removed_forward_headers = strip_forward_headers(original)
+        text, removed_quoted_history = strip_quoted_history(text)
+        text, removed_signature = self.strip_signature(text, sender=sender)
+
+        # Collapse the runs of blank lines left behind by the removals
+        text = re.sub(r"\n{3,}", "\n\n", text).strip()
+
+        return NormalizedBody(
+            text=text if text != original.strip() else original,
+            original=original,
+            removed_quoted_history=removed_quoted_history,
+            removed_forward_headers=removed_forward_headers,
+            removed_signature=removed_signature,
+        )
@@ -2,30 +2,51 @@ import base64
 import json
 import os
 import pickle
-import tempfile
-import webbrowser
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from typing import Any, Callable, Iterable, Iterator
 
 import boto3
+import numpy as np
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from json2html import json2html
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo import ASCENDING, ReplaceOne
 
+from app.near_duplicates import DEFAULT_SIMILARITY_THRESHOLD, NearDuplicateIndex
 # Import constants
 from constants import (
     AttachmentDocumentKeys,
+    DeadLetterDocumentKeys,
+    DeadLetterItemTypes,
     GmailAPIHeaderKeys,
     GmailAPIMessageKeys,
     GmailAPIPayloadKeys,
+    GmailAPIThreadKeys,
+    IngestFailureStages,
+    ListThreadsKeys,
     MessageDocumentKeys,
     MongoDatabaseNames,
     MongoDBCollections,
     PartKeys,
+    S3Constants,
+    ThreadDocumentKeys,
 )
 from custom_logging import getLogger
+from gmail.dead_letter import (
+    DeadLetterQueue,
+    IngestStageError,
+    RetryPolicy,
+    ingest_stage,
+)
+from gmail.extraction import AttachmentTextExtractor, PendingExtraction
+from gmail.normalize import BodyNormalizer
+from gmail.report import IngestReport, ReportFormats, make_ingest_report
 
 # MongoDB library
 from mongodb import client
@@ -33,24 +54,6 @@ from mongodb import client
 logger = getLogger(__name__)
 
 
-def open_html_in_browser(html_content):
-    # Create a temporary file
-    temp = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-
-    # Write the HTML content to the temporary file
-    temp.write(html_content.encode("utf-8"))
-    temp.close()
-
-    # Get the absolute path to the file
-    file_url = "file://" + os.path.abspath(temp.name)
-
-    # Open the file in the browser
-    webbrowser.open(file_url)
-
-    # Optional: You might want to set up cleanup of the temp file
-    # This depends on your specific needs
-
-
 # Gmail API scopes
 GMAIL_AUTH_SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
@@ -68,32 +71,15 @@ class Attachment(BaseModel):
     text_content: str | None = None
     bytes_len: int | None = None
     mime_type: str | None = None
+    content_hash: str | None = None
 
-    def _try_parse_text_content(self):
-        """Try to parse the text content from the attachment data."""
-
-        if self.filename.endswith(".md"):
-            try:
-                self.text_content = self.data.decode("utf-8")
-            except UnicodeDecodeError:
-                logger.warning(f"Failed to decode attachment data for {self.filename}")
-                self.text_content = None
-
-        else:
-            try:
-                self.text_content = self.data.decode("utf-8")
-            except UnicodeDecodeError:
-                logger.warning(f"Failed to decode attachment data for {self.filename}")
-                self.text_content = None
-
-    def __post_init__(self):
+    def model_post_init(self, __context):
         """Post-initialization to set default values."""
 
         if self.bytes_len is None:
             self.bytes_len = len(self.data)
 
-        if self.text_content is None:
-            self._try_parse_text_content()
+        # Text content is filled in afterwards by the AttachmentTextExtractor
 
     def __repr__(self):
         """String representation of the Attachment object."""
@@ -108,6 +94,7 @@ class Attachment(BaseModel):
             AttachmentDocumentKeys.S3_KEY: self.s3_key,
             AttachmentDocumentKeys.TEXT_CONTENT: self.text_content,
             AttachmentDocumentKeys.MIME_TYPE: self.mime_type,
+            AttachmentDocumentKeys.CONTENT_HASH: self.content_hash,
         }
 
 
@@ -122,6 +109,9 @@ class GmailMessage(BaseModel):
     sender: str
     subject: str
     body: str | None = None
+    # The raw body, only set when normalization stripped quoted history or signatures
+    original_body: str | None = Field(default=None, exclude=True, repr=False)
+    original_body_s3_key: str | None = None
     date_received: str
     thread_id: str
     label_ids: list[str]
@@ -131,6 +121,10 @@ class GmailMessage(BaseModel):
     history_id: str
     internal_date: str
     attachments: list[Attachment] = []
+    # MinHash signature of the body and attachment text, see near_duplicates
+    minhash: np.ndarray | None = Field(default=None, repr=False)
+    # ID of the earlier message this one nearly duplicates
+    duplicate_of: str | None = None
 
     def __repr__(self):
         """String representation of the GmailMessage object."""
@@ -154,12 +148,18 @@ class GmailMessage(BaseModel):
         """Convert the Gmail message to a MongoDB-compatible dictionary."""
         msg_info = {
             MessageDocumentKeys.MESSAGE_ID: self.id,
+            MessageDocumentKeys.THREAD_ID: self.thread_id,
+            MessageDocumentKeys.INTERNAL_DATE: int(self.internal_date),
             MessageDocumentKeys.SENDER: self.sender,
             MessageDocumentKeys.SUBJECT: self.subject,
             MessageDocumentKeys.SNIPPET: self.snippet,
             MessageDocumentKeys.BODY: self.body,
+            MessageDocumentKeys.ORIGINAL_BODY_S3_KEY: self.original_body_s3_key,
+            MessageDocumentKeys.ORIGINAL_BODY_SIZE: len(self.original_body) if self.original_body else None,
             MessageDocumentKeys.DATE_RECEIVED: self.date_received,
             MessageDocumentKeys.PROCESSED_AT: datetime.now(),
+            MessageDocumentKeys.MINHASH: self.minhash.tolist() if self.minhash is not None else None,
+            MessageDocumentKeys.DUPLICATE_OF: self.duplicate_of,
         }
 
         # Add attachments to the message record
@@ -170,6 +170,7 @@ class GmailMessage(BaseModel):
                 AttachmentDocumentKeys.FILE_DATA_SIZE: attachment.bytes_len,
                 AttachmentDocumentKeys.S3_KEY: attachment.s3_key,
                 AttachmentDocumentKeys.MIME_TYPE: attachment.mime_type,
+                AttachmentDocumentKeys.CONTENT_HASH: attachment.content_hash,
             }
             for attachment in self.attachments
         ]
@@ -192,6 +193,53 @@ class GmailMessage(BaseModel):
         """Get the parts of the message payload."""
         return self.payload.get(GmailAPIPayloadKeys.PARTS, [])
 
+    @property
+    def comparable_text(self) -> str:
+        """The text compared to find near duplicates, the body and the text of the attachments."""
+        texts = [self.body, *(attachment.text_content for attachment in self.attachments)]
+        return "\n\n".join(text for text in texts if text)
+
+
+class GmailThread(BaseModel):
+    """Class representing a Gmail thread (conversation)."""
+
+    id: str
+    history_id: str
+    snippet: str = ""
+    messages: list[GmailMessage] = []
+
+    def __repr__(self):
+        """String representation of the GmailThread object."""
+        return f"GmailThread(id={self.id}, messages={len(self.messages)})"
+
+    @property
+    def ordered_messages(self) -> list[GmailMessage]:
+        """Get the messages of the thread ordered by the time Gmail received them."""
+        return sorted(self.messages, key=lambda message: int(message.internal_date))
+
+    def to_mongodb_record_dict(self) -> dict:
+        """
+        Convert the thread to a MongoDB-compatible dictionary.
+
+        The thread record only holds ordered references to its messages, the
+        message bodies themselves live in the messages collection.
+        """
+        messages = self.ordered_messages
+        participants = list(dict.fromkeys(message.sender for message in messages))
+
+        return {
+            ThreadDocumentKeys.THREAD_ID: self.id,
+            ThreadDocumentKeys.HISTORY_ID: self.history_id,
+            ThreadDocumentKeys.SUBJECT: messages[0].subject if messages else None,
+            ThreadDocumentKeys.SNIPPET: self.snippet,
+            ThreadDocumentKeys.PARTICIPANTS: participants,
+            ThreadDocumentKeys.MESSAGE_IDS: [message.id for message in messages],
+            ThreadDocumentKeys.MESSAGE_COUNT: len(messages),
+            ThreadDocumentKeys.FIRST_MESSAGE_AT: int(messages[0].internal_date) if messages else None,
+            ThreadDocumentKeys.LAST_MESSAGE_AT: int(messages[-1].internal_date) if messages else None,
+            ThreadDocumentKeys.PROCESSED_AT: datetime.now(),
+        }
+
 
 class GmailMessageProcessor:
     """
@@ -207,6 +255,8 @@ class GmailMessageProcessor:
         dest_s3_bucket_name: str,
         check_interval: int | None = None,
         replace_existing=False,
+        near_duplicate_threshold: float | None = DEFAULT_SIMILARITY_THRESHOLD,
+        merge_near_duplicates: bool = True,
     ):
         """
         Initialize the uploader with necessary credentials and settings.
@@ -217,21 +267,57 @@ class GmailMessageProcessor:
             s3_bucket_name (str): Name of the S3 bucket to upload files to
             check_interval (int): How often to check for new emails (in seconds)
             replace_existing (bool): Whether to replace existing documents (True) or skip them (False)
+            near_duplicate_threshold (float | None): Estimated share of word shingles in common from which
+                a message nearly duplicates an earlier one, None to not look for near duplicates
+            merge_near_duplicates (bool): Whether to store near duplicates as a reference to the earlier
+                message (True), without their text, or in full, marked with it (False)
         """
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.s3_bucket_name = dest_s3_bucket_name
         self.check_interval = check_interval
         self.replace_existing = replace_existing
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.merge_near_duplicates = merge_near_duplicates
+
+        # Signatures of the stored messages, loaded from MongoDB on first use (see near_duplicate_index)
+        self._near_duplicate_index: NearDuplicateIndex[str] | None = None
+        self._near_duplicate_index_lock = threading.Lock()
+
+        # Shared across the run so repeated signatures are recognized
+        self.body_normalizer = BodyNormalizer()
 
         # Initialize services
-        self.gmail_service = self.authenticate_gmail()
+        # The Gmail client is not thread-safe, each thread gets its own (see gmail_service)
+        self._thread_local = threading.local()
+        self._thread_local.gmail_service = self.authenticate_gmail()
         self.s3_client = boto3.client("s3")
 
         # MongoDB connection
         self.mongo_client = client
         self.db = self.mongo_client[MongoDatabaseNames.EMAIL]
         self.messages_collection = self.db[MongoDBCollections.MESSAGES]
+        self.threads_collection = self.db[MongoDBCollections.THREADS]
+        self._ensure_indexes()
+
+        # Failed messages are recorded here and retried with retry_dead_letters
+        self.dead_letters = DeadLetterQueue(self.db[MongoDBCollections.DEAD_LETTERS])
+
+        # Attachment text is extracted in a process pool and cached by content hash
+        self.text_extractor = AttachmentTextExtractor(
+            cache_collection=self.db[MongoDBCollections.ATTACHMENT_TEXT_CACHE],
+        )
+
+    def _ensure_indexes(self):
+        """Create the indexes used to look up messages and threads (no-op if they exist)."""
+        self.messages_collection.create_index(MessageDocumentKeys.MESSAGE_ID)
+        self.messages_collection.create_index(
+            [
+                (MessageDocumentKeys.THREAD_ID, ASCENDING),
+                (MessageDocumentKeys.INTERNAL_DATE, ASCENDING),
+            ]
+        )
+        self.threads_collection.create_index(ThreadDocumentKeys.THREAD_ID, unique=True)
 
     def authenticate_gmail(self):
         """Authenticate with Gmail API and return the service."""
@@ -255,12 +341,22 @@ class GmailMessageProcessor:
             # Save credentials for next run
             with open(self.token_file, "wb") as token:
                 pickle.dump(creds, token)
+        self._gmail_credentials = creds
 
         # Build the Gmail service
         gmail_build = build("gmail", "v1", credentials=creds)
         logger.info("Gmail API authenticated successfully.")
         return gmail_build
 
+    @property
+    def gmail_service(self):
+        """The Gmail API service for the current thread."""
+        service = getattr(self._thread_local, "gmail_service", None)
+        if service is None:
+            service = build("gmail", "v1", credentials=self._gmail_credentials)
+            self._thread_local.gmail_service = service
+        return service
+
     def list_messages(
         self,
         sender_filter: str | None = None,
@@ -317,6 +413,40 @@ class GmailMessageProcessor:
             logger.warning(f"Message {msg_id} not found.")
             return None
 
+        return self._build_gmail_message(result=result)
+
+    def _build_gmail_message(self, result: dict) -> GmailMessage | None:
+        """
+        Build a GmailMessage, including its attachments and body, from a message resource.
+
+        See ``_parse_gmail_message`` and ``_finish_gmail_message``.
+        """
+        parsed = self._parse_gmail_message(result=result)
+        if parsed is None:
+            return None
+
+        gmail_message, extraction = parsed
+        self._finish_gmail_message(gmail_message, extraction)
+        return gmail_message
+
+    def _parse_gmail_message(self, result: dict) -> tuple[GmailMessage, PendingExtraction | None] | None:
+        """
+        Parse a message resource and submit the text extraction of its attachments.
+
+        Parameters
+        ----------
+        result : dict
+            A message resource in the "full" format, as returned by
+            ``messages().get`` or embedded in ``threads().get``.
+
+        Returns
+        -------
+        tuple[GmailMessage, PendingExtraction | None] | None
+            The parsed message, without its body, and the extraction of its
+            attachments, if any, or None if it could not be parsed.
+        """
+        msg_id = result[GmailAPIMessageKeys.ID]
+
         # Parse the message result into a GmailMessage object
         gmail_message = self._parse_message_from_result(result=result)
         if not gmail_message:
@@ -324,6 +454,7 @@ class GmailMessageProcessor:
             return None
 
         # Check if the message has attachments
+        extraction = None
         if not gmail_message.payload.get(GmailAPIPayloadKeys.PARTS):
             logger.warning(f"Message {msg_id} has no attachments.")
 
@@ -337,20 +468,438 @@ class GmailMessageProcessor:
             if attachments:
                 # Add attachments to the message object
                 gmail_message.attachments = attachments
+                extraction = self.text_extractor.submit(attachments)
+
+        return gmail_message, extraction
+
+    def _finish_gmail_message(self, gmail_message: GmailMessage, extraction: PendingExtraction | None) -> None:
+        """Wait for the text of a parsed message's attachments and set its body from them."""
+        if extraction is not None:
+            extraction.wait()
 
         # Search the attachments for the body of the messag, which is usually
         # the first attachment where mime_type is text/plain
         body = None
+        body_attachment = None
         for attachment in gmail_message.attachments:
             if attachment.mime_type == "text/plain":
                 body = attachment.text_content
+                body_attachment = attachment
                 break
-        if body:
-            gmail_message.body = body
+        if body and body_attachment:
+            # Keep only the newly written text, the original goes to S3 on store
+            normalized = self.body_normalizer.normalize(body, sender=gmail_message.sender)
+            gmail_message.body = normalized.text
+            if normalized.was_modified:
+                gmail_message.original_body = normalized.original
+
+            # Don't store the raw body a second time on its attachment record
+            body_attachment.text_content = None
         else:
-            logger.warning(f"No body found in attachments for message {msg_id}.")
+            logger.warning(f"No body found in attachments for message {gmail_message.id}.")
 
-        return gmail_message
+    def list_threads(
+        self,
+        sender_filter: str | None = None,
+    ) -> list[dict[str, str]]:
+        """List all threads in the user's mailbox."""
+
+        if sender_filter:
+            # Filter threads by sender
+            logger.info(f"Filtering threads by sender: {sender_filter}")
+            query = f"from:{sender_filter}"
+        else:
+            query = None
+
+        try:
+            response = (
+                self.gmail_service.users()
+                .threads()
+                .list(
+                    userId="me",
+                    q=query,
+                )
+                .execute()
+            )
+            threads = response.get(ListThreadsKeys.THREADS, [])
+            return threads
+        except Exception as e:
+            logger.error(f"Error listing threads: {e}")
+            return []
+
+    def is_thread_processed(self, thread_id: str, history_id: str | None) -> bool:
+        """
+        Check if a thread has already been stored and has not changed since.
+
+        A thread whose history ID differs from the stored one has received new
+        messages (or label changes) and should be processed again.
+        """
+        if self.replace_existing:
+            return False
+
+        result = self.threads_collection.find_one(
+            {ThreadDocumentKeys.THREAD_ID: thread_id},
+            projection={ThreadDocumentKeys.HISTORY_ID: True},
+        )
+        if result is None:
+            return False
+
+        return history_id is not None and result.get(ThreadDocumentKeys.HISTORY_ID) == history_id
+
+    def get_gmail_thread(self, thread_id: str) -> GmailThread | None:
+        """
+        Get a whole conversation with a single ``threads().get`` call.
+
+        Parameters
+        ----------
+        thread_id : str
+            The Gmail thread ID.
+
+        Returns
+        -------
+        GmailThread | None
+            The thread with all of its parsable messages, or None if it was not found.
+        """
+        result = (
+            self.gmail_service.users()
+            .threads()
+            .get(userId="me", id=thread_id, format="full")
+            .execute()
+        )
+        if not result:
+            logger.warning(f"Thread {thread_id} not found.")
+            return None
+
+        return self._build_gmail_thread(result=result)
+
+    def _build_gmail_thread(self, result: dict) -> GmailThread:
+        """Build a GmailThread from a thread resource, skipping messages that fail to parse."""
+        return self._finish_gmail_thread(result, self._parse_gmail_thread(result))
+
+    def _parse_gmail_thread(self, result: dict) -> list[tuple[GmailMessage, PendingExtraction | None]]:
+        """Parse the messages of a thread resource, their attachments all extracted at once."""
+        parsed = [
+            self._parse_gmail_message(result=message_result)
+            for message_result in result.get(GmailAPIThreadKeys.MESSAGES, [])
+        ]
+        return [message for message in parsed if message is not None]
+
+    def _finish_gmail_thread(
+        self,
+        result: dict,
+        parsed: list[tuple[GmailMessage, PendingExtraction | None]],
+    ) -> GmailThread:
+        for gmail_message, extraction in parsed:
+            self._finish_gmail_message(gmail_message, extraction)
+
+        return GmailThread(
+            id=result[GmailAPIThreadKeys.ID],
+            history_id=result[GmailAPIThreadKeys.HISTORY_ID],
+            snippet=result.get(GmailAPIThreadKeys.SNIPPET, ""),
+            messages=[gmail_message for gmail_message, _ in parsed],
+        )
+
+    def load_thread(self, thread_id: str) -> list[dict]:
+        """
+        Load every stored message of a conversation, oldest first.
+
+        Served by the (thread_id, internal_date) index with a single query.
+        """
+        cursor = self.messages_collection.find(
+            {MessageDocumentKeys.THREAD_ID: thread_id},
+        ).sort(MessageDocumentKeys.INTERNAL_DATE, ASCENDING)
+        return list(cursor)
+
+    @property
+    def near_duplicate_index(self) -> NearDuplicateIndex[str]:
+        """The index of the stored messages' signatures, loaded from MongoDB on first use."""
+        assert self.near_duplicate_threshold is not None, "Near-duplicate detection is disabled."
+        with self._near_duplicate_index_lock:
+            if self._near_duplicate_index is None:
+                index: NearDuplicateIndex[str] = NearDuplicateIndex(threshold=self.near_duplicate_threshold)
+                cursor = self.messages_collection.find(
+                    {
+                        MessageDocumentKeys.MINHASH: {"$ne": None},
+                        MessageDocumentKeys.DUPLICATE_OF: None,
+                    },
+                    projection={MessageDocumentKeys.MESSAGE_ID: True, MessageDocumentKeys.MINHASH: True},
+                )
+                for record in cursor:
+                    index.add(
+                        record[MessageDocumentKeys.MESSAGE_ID],
+                        np.array(record[MessageDocumentKeys.MINHASH], dtype=np.uint32),
+                    )
+                logger.info(f"Loaded the signatures of {len(index)} messages for near-duplicate detection.")
+                self._near_duplicate_index = index
+            return self._near_duplicate_index
+
+    def _check_near_duplicate(self, gmail_message: GmailMessage) -> None:
+        """
+        Look for an earlier message nearly the same as a new one, before storing it.
+
+        Messages that are not near duplicates are indexed, so later copies
+        match them. Merged near duplicates keep no text of their own, only a
+        reference to the earlier message, and their original body is not
+        archived.
+        """
+        if self.near_duplicate_threshold is None:
+            return
+
+        gmail_message.minhash = self.near_duplicate_index.signature(gmail_message.comparable_text)
+        match = self.near_duplicate_index.find_or_add(gmail_message.id, gmail_message.minhash)
+        if match is None:
+            return
+
+        original_id, similarity = match
+        gmail_message.duplicate_of = original_id
+        logger.info(f"Message {gmail_message.id} is a near duplicate of message {original_id} ({similarity:.0%} similar).")
+        if self.merge_near_duplicates:
+            gmail_message.body = None
+            gmail_message.original_body = None
+            for attachment in gmail_message.attachments:
+                attachment.text_content = None
+
+    def _store_thread(self, gmail_thread: GmailThread) -> None:
+        """Upsert the thread record and all of its messages in one bulk write."""
+        for message in gmail_thread.ordered_messages:
+            self._check_near_duplicate(message)
+            self._archive_original_body(message)
+
+        self.messages_collection.bulk_write(
+            [
+                ReplaceOne(
+                    {MessageDocumentKeys.MESSAGE_ID: message.id},
+                    message.to_mongodb_record_dict(),
+                    upsert=True,
+                )
+                for message in gmail_thread.ordered_messages
+            ],
+            ordered=False,
+        )
+        self.threads_collection.replace_one(
+            {ThreadDocumentKeys.THREAD_ID: gmail_thread.id},
+            gmail_thread.to_mongodb_record_dict(),
+            upsert=True,
+        )
+
+    def _archive_original_body(self, gmail_message: GmailMessage) -> None:
+        """
+        Upload the raw body of a normalized message to S3 and record its key.
+
+        Only messages whose body was changed by normalization are archived, the
+        original can be fetched back on demand with ``load_original_body``.
+        """
+        if not gmail_message.original_body:
+            return
+
+        s3_key = f"{S3Constants.ORIGINAL_BODY_KEY_PREFIX}{gmail_message.id}.txt"
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket_name,
+            Key=s3_key,
+            Body=gmail_message.original_body.encode("utf-8"),
+            ContentType="text/plain; charset=utf-8",
+        )
+        gmail_message.original_body_s3_key = s3_key
+        logger.info(f"Archived original body of message {gmail_message.id} to S3: {s3_key}")
+
+    def load_original_body(self, msg_id: str) -> str | None:
+        """Load the raw body of a stored message, fetching it from S3 if it was normalized."""
+        record = self.messages_collection.find_one(
+            {MessageDocumentKeys.MESSAGE_ID: msg_id},
+            projection={
+                MessageDocumentKeys.BODY: True,
+                MessageDocumentKeys.ORIGINAL_BODY_S3_KEY: True,
+            },
+        )
+        if not record:
+            return None
+
+        s3_key = record.get(MessageDocumentKeys.ORIGINAL_BODY_S3_KEY)
+        if not s3_key:
+            return record.get(MessageDocumentKeys.BODY)
+
+        response = self.s3_client.get_object(Bucket=self.s3_bucket_name, Key=s3_key)
+        return response["Body"].read().decode("utf-8")
+
+    def _ingest_message(self, msg_id: str, dry_run: bool = False) -> GmailMessage | None:
+        """
+        Fetch, parse and store a single message.
+
+        Parameters
+        ----------
+        msg_id : str
+            The Gmail message ID.
+        dry_run : bool
+            If True, do not upload to S3 or MongoDB.
+
+        Returns
+        -------
+        GmailMessage | None
+            The ingested message, or None if it does not exist.
+
+        Raises
+        ------
+        IngestStageError
+            If a stage failed, naming the stage, with the original error as its cause.
+        """
+        finish = self._start_ingest_message(msg_id)
+        return finish(dry_run) if finish is not None else None
+
+    def _start_ingest_message(self, msg_id: str) -> Callable[[bool], GmailMessage] | None:
+        """
+        Fetch and parse a message, the text of its attachments extracted in the background.
+
+        Returns
+        -------
+        Callable[[bool], GmailMessage] | None
+            Finishes the ingest given dry_run, waiting for the extraction and
+            storing the message, or None if the message does not exist.
+
+        Raises
+        ------
+        IngestStageError
+            If a stage failed, naming the stage, with the original error as its cause.
+        """
+        with ingest_stage(IngestFailureStages.FETCH):
+            result = (
+                self.gmail_service.users().messages().get(userId="me", id=msg_id).execute()
+            )
+        if not result:
+            return None
+
+        with ingest_stage(IngestFailureStages.PARSE):
+            parsed = self._parse_gmail_message(result=result)
+            if not parsed:
+                raise ValueError(f"Message {msg_id} could not be parsed")
+
+        def finish(dry_run: bool) -> GmailMessage:
+            gmail_message, extraction = parsed
+            with ingest_stage(IngestFailureStages.PARSE):
+                self._finish_gmail_message(gmail_message, extraction)
+
+            with ingest_stage(IngestFailureStages.STORE):
+                if not dry_run:
+                    self._check_near_duplicate(gmail_message)
+                    self._archive_original_body(gmail_message)
+                    self.messages_collection.insert_one(gmail_message.to_mongodb_record_dict())
+                    logger.info(f"Inserted message {msg_id} into MongoDB.")
+                else:
+                    logger.info(f"Dry run: {gmail_message}")
+
+            return gmail_message
+
+        return finish
+
+    def _ingest_thread(self, thread_id: str, dry_run: bool = False) -> GmailThread | None:
+        """
+        Fetch, parse and store a whole thread.
+
+        Raises
+        ------
+        IngestStageError
+            If a stage failed, naming the stage, with the original error as its cause.
+        """
+        finish = self._start_ingest_thread(thread_id)
+        return finish(dry_run) if finish is not None else None
+
+    def _start_ingest_thread(self, thread_id: str) -> Callable[[bool], GmailThread] | None:
+        """
+        Fetch and parse a thread, the text of its attachments extracted in the background.
+
+        See ``_start_ingest_message``.
+        """
+        with ingest_stage(IngestFailureStages.FETCH):
+            result = (
+                self.gmail_service.users()
+                .threads()
+                .get(userId="me", id=thread_id, format="full")
+                .execute()
+            )
+        if not result:
+            return None
+
+        with ingest_stage(IngestFailureStages.PARSE):
+            parsed = self._parse_gmail_thread(result=result)
+            if not parsed:
+                raise ValueError(f"Thread {thread_id} has no parsable messages")
+
+        def finish(dry_run: bool) -> GmailThread:
+            with ingest_stage(IngestFailureStages.PARSE):
+                gmail_thread = self._finish_gmail_thread(result, parsed)
+
+            with ingest_stage(IngestFailureStages.STORE):
+                if not dry_run:
+                    self._store_thread(gmail_thread=gmail_thread)
+                    logger.info(
+                        f"Stored thread {thread_id} with {len(gmail_thread.messages)} messages in MongoDB."
+                    )
+                else:
+                    logger.info(f"Dry run: {gmail_thread!r}")
+
+            return gmail_thread
+
+        return finish
+
+    @staticmethod
+    def _ingest_pipelined(
+        item_ids: Iterable[str],
+        start: Callable[[str], Callable[[bool], Any] | None],
+        dry_run: bool,
+    ) -> Iterator[tuple[str, Any, IngestStageError | None]]:
+        """
+        Ingest items one after the other, each started before the previous one is finished.
+
+        The text of an item's attachments is then extracted in the process pool
+        while the next item is fetched, instead of holding up the loop.
+
+        Yields
+        ------
+        tuple[str, Any, IngestStageError | None]
+            The item ID, the ingested item, None if it does not exist, and the
+            error if a stage failed.
+        """
+
+        def finish(started: tuple[str, Callable[[bool], Any] | None, IngestStageError | None]):
+            item_id, finish_item, error = started
+            if error is not None or finish_item is None:
+                return item_id, None, error
+            try:
+                return item_id, finish_item(dry_run), None
+            except IngestStageError as e:
+                return item_id, None, e
+
+        previous = None
+        for item_id in item_ids:
+            started: tuple[str, Callable[[bool], Any] | None, IngestStageError | None]
+            try:
+                started = (item_id, start(item_id), None)
+            except IngestStageError as e:
+                started = (item_id, None, e)
+            if previous is not None:
+                yield finish(previous)
+            previous = started
+        if previous is not None:
+            yield finish(previous)
+
+    def _record_failure(
+        self,
+        item_id: str,
+        error: IngestStageError,
+        item_type: str = DeadLetterItemTypes.MESSAGE,
+        dry_run: bool = False,
+        report: IngestReport | None = None,
+    ) -> None:
+        """Log an ingest failure and add the item to the dead-letter queue."""
+        logger.error(f"Failed to ingest {item_type} {item_id} at stage '{error.stage}': {error.__cause__}")
+        if report:
+            report.write_failure(item_id=item_id, stage=error.stage, error=error.__cause__)
+        if not dry_run:
+            self.dead_letters.record_failure(
+                item_id=item_id,
+                stage=error.stage,
+                error=error.__cause__ or error,
+                item_type=item_type,
+            )
 
     def _parse_message_from_result(self, result: dict) -> GmailMessage | None:
         """Parse the message result into a GmailMessage object."""
@@ -423,7 +972,6 @@ class GmailMessageProcessor:
 
         attachment_id = body.get(PartKeys.ATTACHMENT_ID)
 
-        text_content = None
         if not attachment_id:
             bytes_str: str = body.get(PartKeys.DATA)
             if not bytes_str:
@@ -434,8 +982,7 @@ class GmailMessageProcessor:
 
             # Decode the str, which is base64 encoded
             data = base64.urlsafe_b64decode(bytes_str)
-            text_content = data.decode("utf-8", errors="ignore")
-            if not text_content:
+            if not data:
                 logger.warning(
                     f"No text content found for attachment {filename} (no attachment ID)"
                 )
@@ -485,7 +1032,6 @@ class GmailMessageProcessor:
         attachment = Attachment(
             filename=filename,
             data=data,
-            text_content=text_content,
             s3_bucket=self.s3_bucket_name,
             s3_key=s3_key,
             mime_type=part.get(PartKeys.MIME_TYPE),
@@ -533,6 +1079,16 @@ class GmailMessageProcessor:
         except Exception as e:
             logger.error(f"Error marking message {msg_id} as read: {e}")
 
+    def _mark_thread_as_read(self, thread_id):
+        """Mark every message of a thread as read with a single call."""
+        try:
+            self.gmail_service.users().threads().modify(
+                userId="me", id=thread_id, body={"removeLabelIds": ["UNREAD"]}
+            ).execute()
+            logger.info(f"Marked thread {thread_id} as read")
+        except Exception as e:
+            logger.error(f"Error marking thread {thread_id} as read: {e}")
+
     def _infer_content_type(self, filename):
         """Guess the content type based on file extension."""
         import mimetypes
@@ -544,14 +1100,22 @@ class GmailMessageProcessor:
         self,
         email_filter: str | None = None,
         dry_run: bool = False,
+        report_format: str = ReportFormats.HTML,
+        open_report: bool = False,
     ):
         """
         Main function to process emails, download attachments, and upload to S3.
 
         Parameters
         ----------
+        email_filter : str | None
+            Optional sender to filter messages by.
         dry_run : bool
             If True, perform a dry run without uploading to S3 or MongoDB.
+        report_format : str
+            Format of the ingest report, one of ReportFormats.
+        open_report : bool
+            If True, open the ingest report in the browser when the run ends.
 
         Returns
         -------
@@ -567,8 +1131,34 @@ class GmailMessageProcessor:
             return
         logger.info(f"Found {len(list_messages)} unread messages with attachments.")
 
-        list_html_content = []
+        # Each message is written to the report as soon as it is processed
+        with make_ingest_report(report_format=report_format) as report:
+            # Get the message details and insert the message into MongoDB
+            ingested = self._ingest_pipelined(
+                self._messages_to_ingest(list_messages, dry_run=dry_run),
+                self._start_ingest_message,
+                dry_run=dry_run,
+            )
+            for msg_id, gmail_message, error in ingested:
+                if error is not None:
+                    self._record_failure(item_id=msg_id, error=error, dry_run=dry_run, report=report)
+                    continue
+                if not gmail_message:
+                    logger.info(f"Message {msg_id} not found.")
+                    continue
+
+                report.write_message(gmail_message)
+
+                # Mark the message as read
+                self._mark_as_read(msg_id)
 
+                logger.info(f"Finished processing message: {msg_id}")
+
+        if open_report:
+            report.open_in_browser()
+
+    def _messages_to_ingest(self, list_messages: list[dict], dry_run: bool) -> Iterator[str]:
+        """The IDs of the listed messages to ingest, skipping those already processed unless replacing them."""
         for message in list_messages:
             msg_id = message[GmailAPIMessageKeys.ID]
             logger.info(f"Processing message: {msg_id}")
@@ -590,52 +1180,174 @@ class GmailMessageProcessor:
                         logger.info(
                             f"Message {msg_id} has already been processed. Replacing existing document."
                         )
+            yield msg_id
+
+    def process_threads(
+        self,
+        email_filter: str | None = None,
+        dry_run: bool = False,
+        report_format: str = ReportFormats.HTML,
+        open_report: bool = False,
+    ):
+        """
+        Process whole conversations instead of individual messages.
+
+        Each thread is fetched with one API call and stored as one thread record
+        holding ordered references to its messages, which are upserted alongside.
+
+        Parameters
+        ----------
+        email_filter : str | None
+            Optional sender to filter threads by.
+        dry_run : bool
+            If True, perform a dry run without uploading to S3 or MongoDB.
+        report_format : str
+            Format of the ingest report, one of ReportFormats.
+        open_report : bool
+            If True, open the ingest report in the browser when the run ends.
+
+        Returns
+        -------
+        None
+        """
+        logger.info("Checking for threads...")
+        list_threads = self.list_threads(
+            sender_filter=email_filter,
+        )
+        if not list_threads:
+            logger.info("No threads found.")
+            return
+        logger.info(f"Found {len(list_threads)} threads.")
+
+        def to_ingest():
+            for thread in list_threads:
+                thread_id = thread[ListThreadsKeys.ID]
+                logger.info(f"Processing thread: {thread_id}")
+
+                if not dry_run and self.is_thread_processed(
+                    thread_id=thread_id,
+                    history_id=thread.get(ListThreadsKeys.HISTORY_ID),
+                ):
+                    logger.info(f"Thread {thread_id} is unchanged since it was processed. Skipping.")
+                    continue
+                yield thread_id
+
+        # Each message is written to the report as soon as its thread is processed
+        with make_ingest_report(report_format=report_format) as report:
+            ingested = self._ingest_pipelined(to_ingest(), self._start_ingest_thread, dry_run=dry_run)
+            for thread_id, gmail_thread, error in ingested:
+                if error is not None:
+                    self._record_failure(
+                        item_id=thread_id,
+                        error=error,
+                        item_type=DeadLetterItemTypes.THREAD,
+                        dry_run=dry_run,
+                        report=report,
+                    )
+                    continue
+                if not gmail_thread:
+                    logger.info(f"Thread {thread_id} not found.")
+                    continue
+
+                for gmail_message in gmail_thread.ordered_messages:
+                    report.write_message(gmail_message)
+                self._mark_thread_as_read(thread_id)
+
+                logger.info(f"Finished processing thread: {thread_id}")
+
+        if open_report:
+            report.open_in_browser()
+
+    def _retry_dead_letter(
+        self,
+        record: dict,
+        retry_policy: RetryPolicy,
+        dry_run: bool = False,
+    ) -> bool:
+        """
+        Retry a single dead-lettered item until it succeeds or runs out of attempts.
+
+        Attempts are counted per retry run, an item failing again after it was
+        exhausted, e.g. during an ordinary ingest, gets the full number again.
+
+        Returns
+        -------
+        bool
+            True if the item was ingested (or no longer exists), False if it was exhausted.
+        """
+        item_id = record[DeadLetterDocumentKeys.ITEM_ID]
+        item_type = record.get(DeadLetterDocumentKeys.ITEM_TYPE, DeadLetterItemTypes.MESSAGE)
+        attempts = 0
 
-            # Get the message details
-            gmail_message = self.get_gmail_message(msg_id=msg_id)
-            if not gmail_message:
-                logger.info(f"Message {msg_id} not found.")
+        while attempts < retry_policy.max_attempts:
+            attempts += 1
+            time.sleep(retry_policy.delay_for(attempts))
+            try:
+                if item_type == DeadLetterItemTypes.THREAD:
+                    thread = self._ingest_thread(thread_id=item_id, dry_run=dry_run)
+                    message_ids: list[str] = []
+                    if thread:
+                        self._mark_thread_as_read(item_id)
+                elif not dry_run and self.is_message_processed(item_id):
+                    logger.info(f"Message {item_id} has been processed since it failed.")
+                    message_ids = []
+                else:
+                    message = self._ingest_message(msg_id=item_id, dry_run=dry_run)
+                    message_ids = [item_id] if message else []
+            except IngestStageError as e:
+                self._record_failure(item_id=item_id, error=e, item_type=item_type, dry_run=dry_run)
                 continue
 
-            # Insert the message into MongoDB
-            message_record = gmail_message.to_mongodb_record_dict()
+            for msg_id in message_ids:
+                self._mark_as_read(msg_id)
             if not dry_run:
-                self.messages_collection.insert_one(message_record)
-                logger.info(f"Inserted message {msg_id} into MongoDB.")
-            else:
-                logger.info(f"Dry run: {gmail_message}")
-
-            # Add the message to the HTML content
-            html_content = gmail_message.to_html()
-            list_html_content.append(html_content)
-
-            # Mark the message as read
-            self._mark_as_read(msg_id)
-
-            logger.info(f"Finished processing message: {msg_id}")
-
-        # Generate HTML content for all messages
-        message_separator = "<br><hr><br>"
-
-        html_content = message_separator.join(list_html_content)
-        # Convert the HTML content to a string
-        html_content = f"""
-        <html>
-        <body>
-            <h1>Gmail Messages</h1>
-            <p>Processed messages:</p>
-            <table>
-                <tr>
-                    <th>Message ID</th>
-                    <th>Sender</th>
-                    <th>Subject</th>
-                    <th>Date Received</th>
-                    <th>Body</th>
-                </tr>
-                {html_content}
-            </table>
-        </body>
-        </html>
-        """
-
-        open_html_in_browser(html_content)
+                self.dead_letters.resolve(item_id=item_id, item_type=item_type)
+            logger.info(f"Retried {item_type} {item_id} successfully.")
+            return True
+
+        logger.error(f"Giving up on {item_type} {item_id} after {attempts} attempts.")
+        if not dry_run:
+            self.dead_letters.mark_exhausted(item_id=item_id, item_type=item_type)
+        return False
+
+    def retry_dead_letters(
+        self,
+        retry_policy: RetryPolicy | None = None,
+        max_workers: int = 4,
+        dry_run: bool = False,
+    ) -> dict[str, int]:
+        """
+        Re-process only the items in the dead-letter queue, in parallel.
+
+        Parameters
+        ----------
+        retry_policy : RetryPolicy | None
+            The backoff policy applied to each item, defaults to RetryPolicy().
+        max_workers : int
+            The number of items retried concurrently.
+        dry_run : bool
+            If True, perform a dry run without uploading to S3 or MongoDB.
+
+        Returns
+        -------
+        dict[str, int]
+            The number of items that were "resolved" and "exhausted".
+        """
+        retry_policy = retry_policy or RetryPolicy()
+        records = self.dead_letters.pending()
+        if not records:
+            logger.info("No dead-lettered items to retry.")
+            return {"resolved": 0, "exhausted": 0}
+        logger.info(f"Retrying {len(records)} dead-lettered items with {max_workers} workers.")
+
+        results = {"resolved": 0, "exhausted": 0}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._retry_dead_letter, record, retry_policy, dry_run)
+                for record in records
+            ]
+            for future in as_completed(futures):
+                results["resolved" if future.result() else "exhausted"] += 1
+
+        logger.info(f"Dead-letter retry finished: {results}")
+        return results
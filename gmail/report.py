@@ -0,0 +1,203 @@
+"""
+Streaming reports of Gmail ingest runs.
+
+Each processed message is appended to the report file as soon as it is
+finished, so memory stays flat over long runs and an interrupted run still
+leaves a usable partial report. A summary footer is written when the run ends.
+"""
+
+import html
+import json
+import os
+import webbrowser
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+
+from constants import FilePaths
+from custom_logging import getLogger
+
+if TYPE_CHECKING:
+    from gmail.processor import GmailMessage
+
+logger = getLogger(__name__)
+
+
+class ReportFormats:
+    """Supported ingest report formats."""
+
+    HTML: str = "html"
+    NDJSON: str = "ndjson"
+
+
+def _create_report_file(extension: str) -> tuple[Path, IO[str]]:
+    """Create a new report file, named after the current time, numbered if runs started in the same second."""
+    FilePaths.INGEST_REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_ingest"
+    number = 1
+    while True:
+        suffix = f"_{number}" if number > 1 else ""
+        path = FilePaths.INGEST_REPORTS_DIR / f"{stem}{suffix}{extension}"
+        try:
+            # "x" fails rather than overwrite the report of another run
+            return path, open(path, "x", encoding="utf-8")
+        except FileExistsError:
+            number += 1
+
+
+def open_file_in_browser(path: Path) -> None:
+    """Open a local file in the default web browser."""
+    webbrowser.open("file://" + os.path.abspath(path))
+
+
+class IngestReport(metaclass=ABCMeta):
+    """
+    A report sink that writes each processed item as soon as it finishes.
+
+    Use as a context manager, the summary footer is written on exit, even if
+    the run raised.
+    """
+
+    file_extension: str
+
+    def __init__(self, path: Path | None = None):
+        self._file: IO[str]
+        if path is None:
+            path, self._file = _create_report_file(self.file_extension)
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+        self.path = path
+        self.started_at = datetime.now()
+        self.processed_count = 0
+        self.failed_count = 0
+        self._write_header()
+        logger.info(f"Writing ingest report to {self.path}")
+
+    def __enter__(self) -> "IngestReport":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(interrupted=exc_type is not None)
+
+    def _write(self, text: str) -> None:
+        # Flushed per item so the report is readable while the run is in progress
+        self._file.write(text)
+        self._file.flush()
+
+    @property
+    def summary(self) -> dict:
+        finished_at = datetime.now()
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "duration_seconds": round((finished_at - self.started_at).total_seconds(), 3),
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+        }
+
+    def write_message(self, gmail_message: "GmailMessage") -> None:
+        """Append a processed message to the report."""
+        self.processed_count += 1
+        self._write_message(gmail_message)
+
+    def write_failure(self, item_id: str, stage: str, error: BaseException | None) -> None:
+        """Append an item that failed to ingest to the report."""
+        self.failed_count += 1
+        self._write_failure(item_id, stage, error)
+
+    def close(self, interrupted: bool = False) -> None:
+        """Write the summary footer and close the report file."""
+        if self._file.closed:
+            return
+
+        summary = self.summary
+        summary["interrupted"] = interrupted
+        self._write_footer(summary)
+        self._file.close()
+        logger.info(f"Ingest report written to {self.path}: {summary}")
+
+    def open_in_browser(self) -> None:
+        open_file_in_browser(self.path)
+
+    @abstractmethod
+    def _write_header(self) -> None:
+        ...
+
+    @abstractmethod
+    def _write_message(self, gmail_message: "GmailMessage") -> None:
+        ...
+
+    @abstractmethod
+    def _write_failure(self, item_id: str, stage: str, error: BaseException | None) -> None:
+        ...
+
+    @abstractmethod
+    def _write_footer(self, summary: dict) -> None:
+        ...
+
+
+class HtmlIngestReport(IngestReport):
+    """Ingest report as an HTML page, one table per message."""
+
+    file_extension = ".html"
+
+    MESSAGE_SEPARATOR = "<br><hr><br>\n"
+
+    def _write_header(self) -> None:
+        self._write(
+            "<html>\n<body>\n"
+            "<h1>Gmail Messages</h1>\n"
+            f"<p>Ingest started at {html.escape(self.started_at.isoformat())}</p>\n"
+        )
+
+    def _write_message(self, gmail_message: "GmailMessage") -> None:
+        self._write(gmail_message.to_html() + "\n" + self.MESSAGE_SEPARATOR)
+
+    def _write_failure(self, item_id: str, stage: str, error: BaseException | None) -> None:
+        self._write(
+            f"<p><b>Failed:</b> {html.escape(item_id)} at stage "
+            f"'{html.escape(stage)}': {html.escape(str(error))}</p>\n" + self.MESSAGE_SEPARATOR
+        )
+
+    def _write_footer(self, summary: dict) -> None:
+        rows = "".join(
+            f"<tr><th>{html.escape(key)}</th><td>{html.escape(str(value))}</td></tr>"
+            for key, value in summary.items()
+        )
+        self._write(f"<h2>Summary</h2>\n<table border='1'>{rows}</table>\n</body>\n</html>\n")
+
+
+class NdjsonIngestReport(IngestReport):
+    """Ingest report as newline-delimited JSON, one record per line."""
+
+    file_extension = ".ndjson"
+
+    def _write_line(self, record: dict) -> None:
+        self._write(json.dumps(record, default=str) + "\n")
+
+    def _write_header(self) -> None:
+        self._write_line({"type": "start", "started_at": self.started_at.isoformat()})
+
+    def _write_message(self, gmail_message: "GmailMessage") -> None:
+        self._write_line({"type": "message", "message": gmail_message.to_mongodb_record_dict()})
+
+    def _write_failure(self, item_id: str, stage: str, error: BaseException | None) -> None:
+        self._write_line({"type": "failure", "item_id": item_id, "stage": stage, "error": str(error)})
+
+    def _write_footer(self, summary: dict) -> None:
+        self._write_line({"type": "summary", **summary})
+
+
+REPORT_CLASSES: dict[str, type[IngestReport]] = {
+    ReportFormats.HTML: HtmlIngestReport,
+    ReportFormats.NDJSON: NdjsonIngestReport,
+}
+
+
+def make_ingest_report(report_format: str = ReportFormats.HTML, path: Path | None = None) -> IngestReport:
+    """Create an ingest report of the given format."""
+    if report_format not in REPORT_CLASSES:
+        raise ValueError(f"Unknown report format: {report_format}")
+    return REPORT_CLASSES[report_format](path=path)
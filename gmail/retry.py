@@ -0,0 +1,39 @@
+"""
+Gmail dead-letter retry
+This script re-processes only the messages and threads that previously failed
+to ingest, as recorded in the dead-letter collection.
+"""
+import os
+
+from constants import FilePaths, S3Constants
+from custom_logging import getLogger
+from gmail.dead_letter import RetryPolicy
+from gmail.processor import GmailMessageProcessor
+
+logger = getLogger(__name__)
+
+
+if __name__ == "__main__":
+    # Configuration
+    DRY_RUN = False  # Set to True for a dry run (no actual uploads to S3 or MongoDB)
+    MAX_WORKERS = int(os.getenv("RETRY_MAX_WORKERS", "4"))  # Items retried concurrently
+    RETRY_POLICY = RetryPolicy(
+        max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "5")),
+        base_delay_seconds=float(os.getenv("RETRY_BASE_DELAY_SECONDS", "1.0")),
+    )
+
+    processor = GmailMessageProcessor(
+        credentials_file=FilePaths.GOOGLE_CLOUD_API_CREDENTIALS,
+        token_file=FilePaths.GOOGLE_CLOUD_API_TOKEN,
+        dest_s3_bucket_name=S3Constants.BUCKET_NAME,
+        replace_existing=False,
+    )
+
+    processor.retry_dead_letters(
+        retry_policy=RETRY_POLICY,
+        max_workers=MAX_WORKERS,
+        dry_run=DRY_RUN,
+    )
+
+    # Stop the attachment text extraction workers
+    processor.text_extractor.shutdown()